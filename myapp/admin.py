@@ -1,13 +1,16 @@
 from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.shortcuts import redirect
 from django.urls import path
 from django.http import HttpResponse
 from django.utils.html import format_html
-from .models import YouTubeComment, UserProfile, Plan, UserPlan
+from .models import YouTubeComment, UserProfile, Plan, UserPlan, ClusteringResult, EngagementRollup
+from .importers import ImportInterrupted, import_csv_file
+from .signals import muted_comment_signals, notify_comments_changed
+from .vectors import embedding_info
 import csv
-from io import TextIOWrapper
 from datetime import datetime, timedelta
 
 # 管理画面のタイトルをカスタマイズ
@@ -111,12 +114,35 @@ class UserProfileAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__email')
     readonly_fields = ('created_at', 'updated_at')
 
+@admin.register(ClusteringResult)
+class ClusteringResultAdmin(admin.ModelAdmin):
+    list_display = ('id', 'owner', 'status', 'mode', 'drift', 'comment_count', 'started_at', 'finished_at')
+    list_filter = ('status', 'mode')
+    readonly_fields = ('owner', 'status', 'mode', 'drift', 'comment_count', 'error', 'started_at', 'finished_at')
+    exclude = ('payload', 'model_state')  # 座標データ・学習状態は大きいため表示しない
+
+
+@admin.register(EngagementRollup)
+class EngagementRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'video_id', 'owner', 'comment_count', 'like_sum', 'reply_sum', 'engagement_sum')
+    list_filter = ('owner',)
+    search_fields = ('video_id',)
+    date_hierarchy = 'day'
+
+    # コメントから自動で集計するため、管理画面からは編集しない（修復は rebuild_rollups コマンド）
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(YouTubeComment)
 class YouTubeCommentAdmin(admin.ModelAdmin):
     list_display = ('id', 'author', 'owner', 'like_count', 'reply_count', 'created_at')
     list_filter = ('owner', 'created_at')
     search_fields = ('author', 'comment_text', 'video_id', 'owner__username')
-    readonly_fields = ('id',)
+    readonly_fields = ('id', 'embedding_summary')
     fieldsets = (
         ('基本情報', {
             'fields': ('video_id', 'comment_id', 'comment_text', 'author')
@@ -125,11 +151,19 @@ class YouTubeCommentAdmin(admin.ModelAdmin):
             'fields': ('like_count', 'reply_count', 'reply_depth_potential', 'engagement_score')
         }),
         ('その他', {
-            'fields': ('created_at', 'ai_reply', 'embedding', 'owner')
+            'fields': ('created_at', 'ai_reply', 'embedding_summary', 'owner')
         }),
     )
     change_list_template = "admin/myapp/youtubecomment/change_list.html"
 
+    @admin.display(description='埋め込み')
+    def embedding_summary(self, obj):
+        # バイナリのため型と次元数のみ表示
+        if obj.embedding is None:
+            return '-'
+        dtype, dim = embedding_info(obj.embedding)
+        return f'{dtype} × {dim}'
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         # 有料プランチェック（新しいUserPlanモデルを使用）
@@ -145,6 +179,8 @@ class YouTubeCommentAdmin(admin.ModelAdmin):
                 pass
         extra_context['is_premium'] = is_premium
         extra_context['current_plan'] = current_plan
+        # インポート先の所有者の選択肢（既定はログイン中の管理者）
+        extra_context['import_owners'] = User.objects.order_by('username').only('id', 'username')
         return super().changelist_view(request, extra_context=extra_context)
 
     # ✅ URLルーティング追加
@@ -157,28 +193,29 @@ class YouTubeCommentAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
 
+    def _import_owner(self, request):
+        """インポート先の所有者（フォームで選んだユーザー。空欄は所有者なし、未指定はログイン中のユーザー）"""
+        if "owner" not in request.POST:
+            return request.user
+        owner_id = request.POST["owner"]
+        if not owner_id:
+            return None
+        return User.objects.filter(pk=owner_id).first() if owner_id.isdigit() else None
+
     # ✅ CSVインポート機能
     def import_csv(self, request):
         if request.method == "POST" and request.FILES.get("csv_file"):
-            csv_file = TextIOWrapper(request.FILES["csv_file"].file, encoding="utf-8")
-            reader = csv.DictReader(csv_file)
-            count = 0
-            for row in reader:
-                YouTubeComment.objects.create(
-                    video_id=row.get("video_id"),
-                    comment_id=row.get("comment_id"),
-                    comment_text=row.get("comment_text"),
-                    author=row.get("author"),
-                    like_count=int(row.get("like_count") or 0),
-                    reply_count=int(row.get("reply_count") or 0),
-                    reply_depth_potential=int(row.get("reply_depth_potential") or 0),
-                    engagement_score=float(row.get("engagement_score") or 0),
-                    created_at=row.get("created_at") or None,
-                    ai_reply=row.get("ai_reply") if row.get("ai_reply") != "null" else None,
-                    embedding=row.get("embedding") if row.get("embedding") else None,
-                )
-                count += 1
-            messages.success(request, f"{count} 件のコメントをインポートしました。")
+            # ダッシュボードの集計は所有者ごとのため、選んだユーザーのコメントとして取り込む
+            owner = self._import_owner(request)
+            if owner is None and request.POST.get("owner"):
+                messages.error(request, "インポート先のユーザーが見つかりません。")
+                return redirect("..")
+            try:
+                result = import_csv_file(request.FILES["csv_file"], owner=owner, upsert=request.POST.get("upsert") == "1")
+            except ImportInterrupted as exc:
+                messages.error(request, exc.summary("CSV"))
+                return redirect("..")
+            messages.success(request, result.summary())
             return redirect("..")
 
         messages.error(request, "CSVファイルを選択してください。")
@@ -186,8 +223,15 @@ class YouTubeCommentAdmin(admin.ModelAdmin):
 
     # ✅ 全件削除機能（CSVと同じレベルに定義）
     def delete_all(self, request):
-        count = YouTubeComment.objects.count()
-        YouTubeComment.objects.all().delete()
+        # コメントごとのシグナル処理（集計・通知）はせず、まとめて1回で行う
+        with transaction.atomic(), muted_comment_signals():
+            count = YouTubeComment.objects.count()
+            owner_ids = set(YouTubeComment.objects.values_list('owner_id', flat=True).distinct())
+            YouTubeComment.objects.all().delete()
+            EngagementRollup.objects.all().delete()
+            # コメントを持っていた各所有者（所有者なしを含む）の集計が変わる（コミット後に所有者ごとに1回）
+            for owner_id in owner_ids:
+                notify_comments_changed(owner_id)
         messages.success(request, f"{count} 件のコメントを削除しました。")
         return redirect("..")
 
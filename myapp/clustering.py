@@ -0,0 +1,605 @@
+"""
+コメントの3Dクラスタリング
+計算はリクエスト外（バックグラウンドスレッド / refresh_clustering コマンド）で行い、
+結果は ClusteringResult に保存する。ダッシュボードは最新の完了結果を読むだけ
+"""
+import hashlib
+import logging
+import pickle
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from scipy import sparse
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .dataversion import acquire_lock, release_lock, scope_name
+from .tiercache import shared_cache
+from .kselection import PARALLEL_MIN_POINTS, candidate_ks, select_k
+from .models import ClusteringResult, YouTubeComment
+from .nlp import clean_text, extract_japanese_words_many
+
+logger = logging.getLogger(__name__)
+
+# 自動選択したクラスタ数のキャッシュ期間（キーはデータのバージョンごと）
+K_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def top_k_indices(values, k):
+    """Indices of the k largest values, largest first (argpartition, then sort only the k)."""
+    if len(values) <= k:
+        return np.argsort(values)[::-1]
+    top = np.argpartition(values, -k)[-k:]
+    return top[np.argsort(values[top])[::-1]]
+
+
+def analyze_cluster_features(comments, cluster_labels, vectorizer, n_clusters, tokens=None, vectors=None, weights=None):
+    """Analyze features of each cluster and generate summary.
+
+    TF-IDF keywords come from per-label row sums of the already computed TF-IDF matrix (vectors);
+    word frequencies are counted in a single pass, reusing precomputed tokens when given.
+    weights (duplicate group sizes) make each collapsed point count as many comments.
+    """
+    cluster_analyses = []
+    labels = np.asarray(cluster_labels, dtype=int)
+    n_comments = len(comments)
+    if n_comments == 0:
+        return cluster_analyses
+    
+    # Get feature names from vectorizer
+    feature_names = vectorizer.get_feature_names_out()
+    if vectors is None:
+        vectors = vectorizer.transform(comments)
+    
+    # Per-cluster TF-IDF weight: (n_clusters x n_comments) indicator matrix times the TF-IDF matrix
+    point_weights = np.ones(n_comments) if weights is None else np.asarray(weights, dtype=float)
+    indicator = sparse.csr_matrix(
+        (point_weights, (labels, np.arange(n_comments))), shape=(n_clusters, n_comments)
+    )
+    cluster_weights = (indicator @ vectors).toarray()
+    counts = np.bincount(labels, weights=point_weights, minlength=n_clusters)
+    lengths = np.fromiter((len(c) for c in comments), dtype=float, count=n_comments)
+    avg_lengths = np.bincount(labels, weights=lengths * point_weights, minlength=n_clusters) / np.maximum(counts, 1)
+    
+    # Extract meaningful words from comments using morphological analysis (single pass over all comments)
+    missing = [j for j in range(n_comments) if tokens is None or tokens[j] is None]
+    extracted = dict(zip(missing, extract_japanese_words_many([comments[j] for j in missing])))
+    word_freqs = [Counter() for _ in range(n_clusters)]
+    for j, label in enumerate(labels):
+        words = extracted[j] if j in extracted else tokens[j]
+        weight = int(point_weights[j])
+        word_freqs[label].update(words if weight == 1 else {w: c * weight for w, c in Counter(words).items()})
+    
+    # Comment indices per cluster, in original order
+    order = np.argsort(labels, kind='stable')
+    members = np.split(order, np.cumsum(np.bincount(labels, minlength=n_clusters))[:-1])
+    
+    for i in range(n_clusters):
+        if len(members[i]) == 0:
+            continue
+        
+        # Get top keywords: combine TF-IDF and frequency-based approach
+        # First, get TF-IDF top keywords
+        feature_array = cluster_weights[i]
+        top_indices = top_k_indices(feature_array, 15)  # Top 15 keywords
+        tfidf_keywords = [feature_names[idx] for idx in top_indices if feature_array[idx] > 0]
+        
+        # Get top frequent words (at least 2 occurrences)
+        frequent_words = [word for word, count in word_freqs[i].most_common(20) if count >= 2]
+        
+        # Combine and deduplicate, prioritize frequent words
+        combined_keywords = []
+        seen = set()
+        
+        # Add frequent words first (they are more reliable)
+        for word in frequent_words[:5]:
+            if word not in seen and len(word) >= 2:
+                combined_keywords.append(word)
+                seen.add(word)
+        
+        # Add TF-IDF keywords that aren't already included
+        for keyword in tfidf_keywords:
+            if keyword not in seen and len(keyword) >= 2:
+                combined_keywords.append(keyword)
+                seen.add(keyword)
+        
+        # Get top 3 keywords
+        top_keywords = combined_keywords[:3]
+        
+        # Generate summary
+        sample_comments = [comments[j] for j in members[i][:3]]  # Sample comments
+        
+        cluster_analyses.append({
+            'cluster_id': i,
+            'comment_count': int(counts[i]),
+            'top_keywords': top_keywords,  # Top 3 keywords (unified)
+            'avg_comment_length': round(float(avg_lengths[i]), 1),
+            'sample_comments': sample_comments
+        })
+    
+    return cluster_analyses
+
+
+def prepare_comments(comments_df):
+    """Clean comments, drop empty ones and collapse duplicates; returns (comments, tokens, comment_ids, weights) or None.
+
+    Rows in the same near-duplicate group (duplicate_of) or with identical normalized text become one
+    point, represented by the first row and weighted by the group size.
+    """
+    if comments_df is None or len(comments_df) == 0:
+        return None
+    
+    # Check if comment_text column exists
+    if 'comment_text' not in comments_df.columns:
+        return None
+    
+    # Extract and clean comments (reuse normalized text / tokens stored at import time)
+    raw_texts = comments_df['comment_text'].tolist()
+    if 'normalized_text' in comments_df.columns:
+        normalized = [n if n else clean_text(raw) for n, raw in zip(comments_df['normalized_text'], raw_texts)]
+    else:
+        normalized = [clean_text(raw) for raw in raw_texts]
+    stored_tokens = comments_df['tokens'].tolist() if 'tokens' in comments_df.columns else [None] * len(normalized)
+    ids = comments_df['id'].tolist() if 'id' in comments_df.columns else [None] * len(normalized)
+    groups = comments_df['duplicate_of'].tolist() if 'duplicate_of' in comments_df.columns else [None] * len(normalized)
+    rows = []
+    weights = []
+    position = {}  # group key -> index in rows
+    for c, t, pk, group in zip(normalized, stored_tokens, ids, groups):
+        if not c or len(c.strip()) == 0:  # Remove empty comments
+            continue
+        group_key = ('group', group if group is not None and not pd.isna(group) else pk)
+        text_key = ('text', c)
+        index = position.get(group_key, position.get(text_key))
+        if index is None:
+            index = len(rows)
+            rows.append((c, t, pk))
+            weights.append(0)
+        position.setdefault(group_key, index)
+        position.setdefault(text_key, index)
+        weights[index] += 1
+    comments = [c for c, _, _ in rows]
+    tokens = [t if isinstance(t, list) else None for _, t, _ in rows]
+    comment_ids = [pk for _, _, pk in rows]
+    return comments, tokens, comment_ids, weights
+
+
+def cluster_count_for(n_comments, n_clusters=6):
+    """Number of clusters to use for n_comments; 'auto' is passed through to fit_clustering."""
+    if n_clusters == 'auto':
+        return 'auto'
+    max_clusters = n_clusters
+    if n_comments < max_clusters:
+        max_clusters = max(2, n_comments // 2)
+    return max_clusters
+
+
+def data_version(comment_ids, weights=None):
+    """Digest of the clustered comment ids (and duplicate weights); keys the auto-k cache."""
+    return hashlib.blake2b(repr((list(comment_ids), weights)).encode(), digest_size=16).hexdigest()
+
+
+def choose_cluster_count(vectors_3d, weights=None, cache_key=None):
+    """k for 'auto' mode: silhouette-best candidate, cached under cache_key.
+
+    Candidates go to a process pool only from CLUSTERING_K_PARALLEL_MIN_POINTS points; with the default
+    CLUSTERING_MAX_COMMENTS (300) they are scored in this process.
+
+    Returns (k, scores); scores is None when k came from the cache.
+    """
+    if cache_key:
+        cached = shared_cache().get(cache_key)
+        if cached is not None:
+            return cached, None
+    candidates = candidate_ks(
+        len(vectors_3d),
+        getattr(settings, 'CLUSTERING_K_MIN', 2),
+        getattr(settings, 'CLUSTERING_K_MAX', 10),
+    )
+    if len(candidates) <= 1:
+        k, scores = (candidates[0] if candidates else 2), None
+    else:
+        k, scores = select_k(
+            vectors_3d, candidates, weights=weights,
+            max_workers=getattr(settings, 'CLUSTERING_CPU_BUDGET', 1),
+            sample_size=getattr(settings, 'CLUSTERING_K_SAMPLE_SIZE', 2000),
+            parallel_min_points=getattr(settings, 'CLUSTERING_K_PARALLEL_MIN_POINTS', PARALLEL_MIN_POINTS),
+        )
+        logger.info("Auto k=%s (silhouette %s)", k, {c: round(v, 3) for c, v in scores.items()})
+    if cache_key:
+        shared_cache().set(cache_key, k, K_CACHE_TIMEOUT)
+    return k, scores
+
+
+def make_projection(n_rows, method=None):
+    """3D projection for a TF-IDF matrix: 'pca' (dense), 'svd' (sparse TruncatedSVD) or 'auto'.
+
+    'auto' uses TruncatedSVD above CLUSTERING_SVD_THRESHOLD rows so the n x 1000 matrix is never densified.
+    """
+    method = method or getattr(settings, 'CLUSTERING_REDUCTION', 'auto')
+    if method == 'auto':
+        method = 'svd' if n_rows > getattr(settings, 'CLUSTERING_SVD_THRESHOLD', 5000) else 'pca'
+    if method == 'svd':
+        return TruncatedSVD(n_components=3, random_state=42)
+    return PCA(n_components=3, random_state=42)
+
+
+def densify_for(projection, vectors):
+    """PCA needs a dense matrix; TruncatedSVD works on the CSR matrix directly."""
+    if isinstance(projection, TruncatedSVD):
+        return vectors
+    return vectors.toarray()
+
+
+def fit_clustering(comments, comment_ids, max_clusters, weights=None, k_cache_key=None):
+    """Full fit: TF-IDF -> PCA/TruncatedSVD(3) -> KMeans. Returns (vectors_3d, labels, state).
+
+    max_clusters='auto' picks k on the 3D points with choose_cluster_count.
+    """
+    # Vectorize
+    vectorizer = TfidfVectorizer(
+        max_features=1000,
+        stop_words=None,
+        ngram_range=(1, 2),
+        min_df=1,
+        max_df=0.95
+    )
+    vectors = vectorizer.fit_transform(comments)
+    
+    # Reduce to 3D
+    projection = make_projection(vectors.shape[0])
+    vectors_3d = projection.fit_transform(densify_for(projection, vectors))
+    
+    # Cluster
+    k_scores = None
+    if max_clusters == 'auto':
+        max_clusters, k_scores = choose_cluster_count(vectors_3d, weights=weights, cache_key=k_cache_key)
+    kmeans = KMeans(n_clusters=max_clusters, random_state=42, n_init=10)
+    cluster_labels = kmeans.fit_predict(vectors_3d, sample_weight=weights)
+    
+    # Keep a MiniBatchKMeans warm-started from the fitted centroids so later refreshes can partial_fit
+    online_kmeans = MiniBatchKMeans(n_clusters=max_clusters, init=kmeans.cluster_centers_, n_init=1, random_state=42)
+    online_kmeans.partial_fit(vectors_3d, sample_weight=weights)
+    
+    state = {
+        'vectorizer': vectorizer,
+        'projection': projection,
+        'kmeans': online_kmeans,
+        'n_clusters': max_clusters,
+        'k_scores': k_scores,
+        'explained_variance': float(projection.explained_variance_ratio_.sum()),
+        # 95th percentile of the distance to the nearest centroid at fit time; used as the drift cutoff
+        'distance_cutoff': float(np.percentile(kmeans.transform(vectors_3d).min(axis=1), 95)),
+        'ids': np.asarray(comment_ids, dtype=object),
+        'vectors': vectors,
+        'coords': vectors_3d,
+        'labels': cluster_labels,
+    }
+    return vectors_3d, cluster_labels, state
+
+
+def update_clustering(comments, comment_ids, state, max_clusters, weights=None):
+    """Incremental update: fold new comments into a previous fit.
+
+    Previously clustered comments keep their coordinates and labels; only new comments are
+    vectorized, projected and partial_fit into the warm-started MiniBatchKMeans.
+    Returns (vectors_3d, labels, state, drift), or None when a full refit is required.
+    """
+    if state.get('n_clusters') != max_clusters or None in comment_ids:
+        return None
+    
+    previous_index = {pk: i for i, pk in enumerate(state['ids'])}
+    known = [previous_index.get(pk) for pk in comment_ids]
+    new_positions = [i for i, k in enumerate(known) if k is None]
+    refit_fraction = getattr(settings, 'CLUSTERING_REFIT_FRACTION', 0.5)
+    if len(new_positions) > len(comment_ids) * refit_fraction:
+        return None
+    
+    vectors_3d = np.zeros((len(comment_ids), 3))
+    labels = np.zeros(len(comment_ids), dtype=int)
+    for i, k in enumerate(known):
+        if k is not None:
+            vectors_3d[i] = state['coords'][k]
+            labels[i] = state['labels'][k]
+    
+    drift = 0.0
+    new_vectors = None
+    if new_positions:
+        new_vectors = state['vectorizer'].transform([comments[i] for i in new_positions])
+        new_3d = state['projection'].transform(densify_for(state['projection'], new_vectors))
+        kmeans = state['kmeans']
+        
+        # Drift: share of new comments that fall outside the clusters seen at fit time. Comments with no
+        # word in the fitted vocabulary have an all-zero TF-IDF row and cannot be placed, so they count too
+        new_distance = kmeans.transform(new_3d).min(axis=1)
+        unseen = new_vectors.getnnz(axis=1) == 0
+        drift = float(np.mean((new_distance > state['distance_cutoff'] + 1e-9) | unseen))
+        if drift > getattr(settings, 'CLUSTERING_DRIFT_THRESHOLD', 0.5):
+            return None
+        
+        kmeans.partial_fit(new_3d, sample_weight=None if weights is None else np.asarray(weights, dtype=float)[new_positions])
+        vectors_3d[new_positions] = new_3d
+        labels[new_positions] = kmeans.predict(new_3d)
+    
+    # TF-IDF rows in comment order: stored rows for known comments, freshly transformed rows for new ones
+    if state.get('vectors') is not None:
+        n_previous = state['vectors'].shape[0]
+        row_index = np.array(known, dtype=object)
+        row_index[new_positions] = n_previous + np.arange(len(new_positions))
+        stacked = sparse.vstack([state['vectors'], new_vectors], format='csr') if new_vectors is not None else state['vectors']
+        vectors = stacked[row_index.astype(int)]
+    else:
+        vectors = state['vectorizer'].transform(comments)
+    
+    state = dict(state, ids=np.asarray(comment_ids, dtype=object), vectors=vectors, coords=vectors_3d, labels=labels)
+    return vectors_3d, labels, state, drift
+
+
+def build_cluster_data(comments, tokens, comment_ids, vectors_3d, cluster_labels, max_clusters, vectorizer, explained_variance, vectors=None, weights=None):
+    """Centers, radii, jitter and per-cluster analyses for visualization."""
+    # Analyze cluster features
+    cluster_analyses = analyze_cluster_features(comments, cluster_labels, vectorizer, max_clusters, tokens=tokens, vectors=vectors, weights=weights)
+    
+    # Calculate cluster centers and radii for sphere visualization
+    cluster_centers = []
+    cluster_radii = []
+    for i in range(max_clusters):
+        mask = cluster_labels == i
+        if np.sum(mask) > 0:
+            cluster_points = vectors_3d[mask]
+            center = np.mean(cluster_points, axis=0)
+            # Calculate radius as max distance from center to points in cluster
+            distances = np.linalg.norm(cluster_points - center, axis=1)
+            radius = np.max(distances) if len(distances) > 0 else 0.1
+            cluster_centers.append(center.tolist())
+            cluster_radii.append(float(radius))
+        else:
+            cluster_centers.append([0, 0, 0])
+            cluster_radii.append(0.1)
+    
+    # Add jitter to points to prevent overlapping
+    # Calculate the overall scale of the data
+    data_range = np.max(vectors_3d, axis=0) - np.min(vectors_3d, axis=0)
+    jitter_scale = np.mean(data_range) * 0.02  # 2% of average range
+    
+    # Add small random offset to each point
+    np.random.seed(42)  # For reproducibility
+    jitter = np.random.normal(0, jitter_scale, vectors_3d.shape)
+    vectors_3d_jittered = vectors_3d + jitter
+    
+    # Prepare data for visualization
+    return {
+        'x': vectors_3d_jittered[:, 0].tolist(),
+        'y': vectors_3d_jittered[:, 1].tolist(),
+        'z': vectors_3d_jittered[:, 2].tolist(),
+        'cluster_labels': cluster_labels.tolist(),
+        'comments': comments,
+        'comment_ids': comment_ids,
+        'weights': weights if weights is not None else [1] * len(comments),  # 重複をまとめた件数
+        'explained_variance': explained_variance,
+        'n_clusters': max_clusters,
+        'cluster_centers': cluster_centers,
+        'cluster_radii': cluster_radii,
+        'cluster_analyses': cluster_analyses
+    }
+
+
+def run_clustering(comments_df, n_clusters=6, previous_state=None, scope=None):
+    """Cluster comments, incrementally when a previous state is given.
+
+    n_clusters='auto' keeps the previous k for incremental updates and re-selects it only on a full
+    fit; the chosen k is cached per scope (owner) and data version.
+    Returns (cluster_data, state, mode, drift); cluster_data is None when there is too little data.
+    """
+    prepared = prepare_comments(comments_df)
+    if prepared is None:
+        return None, None, None, None
+    comments, tokens, comment_ids, weights = prepared
+    if len(comments) < 2:
+        return None, None, None, None
+    
+    max_clusters = cluster_count_for(len(comments), n_clusters)
+    updated = None
+    if previous_state is not None:
+        update_k = previous_state.get('n_clusters') if max_clusters == 'auto' else max_clusters
+        updated = update_clustering(comments, comment_ids, previous_state, update_k, weights=weights)
+    
+    if updated is not None:
+        vectors_3d, cluster_labels, state, drift = updated
+        mode = 'incremental'
+    else:
+        k_cache_key = f"clustering_k_{scope}_{data_version(comment_ids, weights)}" if max_clusters == 'auto' else None
+        vectors_3d, cluster_labels, state = fit_clustering(comments, comment_ids, max_clusters, weights=weights, k_cache_key=k_cache_key)
+        drift = None
+        mode = 'full'
+    
+    cluster_data = build_cluster_data(
+        comments, tokens, comment_ids, vectors_3d, cluster_labels, state['n_clusters'],
+        state['vectorizer'], state['explained_variance'], vectors=state.get('vectors'), weights=weights,
+    )
+    return cluster_data, state, mode, drift
+
+
+def perform_clustering(comments_df, n_clusters=6):
+    """Perform 3D clustering on comments."""
+    try:
+        cluster_data, _, _, _ = run_clustering(comments_df, n_clusters=n_clusters)
+        return cluster_data
+    except Exception as e:
+        import traceback
+        print(f"Clustering error: {e}")
+        print(traceback.format_exc())
+        return None
+
+
+def owner_comments(owner_id):
+    """集計対象のコメント（owner_id=Noneの場合は所有者のないコメント。他の所有者のコメントは含めない）"""
+    return YouTubeComment.objects.filter(owner_id=owner_id)
+
+
+def latest_clustering_result(owner_id, with_payload=True):
+    """最新の完了済みクラスタリング結果（なければNone）。with_payload=False なら座標と学習状態は読み込まない"""
+    queryset = ClusteringResult.objects.filter(owner_id=owner_id, status=ClusteringResult.STATUS_DONE)
+    if not with_payload:
+        queryset = queryset.defer('payload', 'model_state')
+    return queryset.order_by('-finished_at').first()
+
+
+def compute_clustering(owner_id, full=False, n_clusters=None):
+    """
+    クラスタリングを実行して ClusteringResult に保存する（同期実行）
+    前回の学習状態があれば新規コメントのみを追加学習し、ドリフトが大きい場合のみ全体を再学習する
+    n_clusters: クラスタ数または 'auto'（省略時は settings.CLUSTERING_N_CLUSTERS）
+    """
+    max_comments = getattr(settings, 'CLUSTERING_MAX_COMMENTS', 300)
+    previous_state = None
+    if not full and getattr(settings, 'CLUSTERING_INCREMENTAL', True):
+        previous_state = _load_state(owner_id)
+
+    result = ClusteringResult.objects.create(owner_id=owner_id, status=ClusteringResult.STATUS_RUNNING)
+    try:
+        # この所有者の近似重複のグループを最新にしてから、重複を1点にまとめてクラスタリングする
+        from .duplicates import index_duplicates
+        index_duplicates(owner_id=owner_id, all_owners=False)
+        rows = list(
+            owner_comments(owner_id)
+            .order_by('-created_at')
+            .values('id', 'comment_text', 'normalized_text', 'tokens', 'duplicate_of')[:max_comments]
+        )
+        n_clusters = n_clusters or getattr(settings, 'CLUSTERING_N_CLUSTERS', 6)
+        cluster_data, state, mode, drift = run_clustering(pd.DataFrame(rows), n_clusters=n_clusters, previous_state=previous_state, scope=owner_id) if rows else (None, None, None, None)
+        result.payload = cluster_data
+        result.comment_count = sum(cluster_data['weights']) if cluster_data else 0
+        result.model_state = pickle.dumps(state) if state else None
+        result.mode = mode or ''
+        result.drift = drift
+        result.status = ClusteringResult.STATUS_DONE
+    except Exception:
+        result.status = ClusteringResult.STATUS_FAILED
+        result.error = traceback.format_exc()
+        logger.exception("Clustering failed for owner_id=%s", owner_id)
+    result.finished_at = timezone.now()
+    result.save()
+    _prune_results(owner_id)
+    return result
+
+
+def _load_state(owner_id):
+    """前回の完了結果から学習状態（ベクトライザ・射影・重心）を復元"""
+    previous = (
+        ClusteringResult.objects.filter(owner_id=owner_id, status=ClusteringResult.STATUS_DONE, model_state__isnull=False)
+        .order_by('-finished_at')
+        .only('model_state')
+        .first()
+    )
+    if previous is None:
+        return None
+    try:
+        return pickle.loads(bytes(previous.model_state))
+    except Exception:
+        logger.warning("Discarding unreadable clustering state for owner_id=%s", owner_id)
+        return None
+
+
+def _prune_results(owner_id, keep=3):
+    """古い結果を削除（最新 keep 件のみ残す。プロセス終了などで計算中のまま残った行も削除）"""
+    ClusteringResult.objects.filter(
+        owner_id=owner_id,
+        status=ClusteringResult.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timedelta(hours=1),
+    ).delete()
+    old_ids = list(
+        ClusteringResult.objects.filter(owner_id=owner_id)
+        .exclude(status=ClusteringResult.STATUS_RUNNING)
+        .order_by('-started_at')
+        .values_list('id', flat=True)[keep:]
+    )
+    if old_ids:
+        ClusteringResult.objects.filter(id__in=old_ids).delete()
+
+
+# ============================================
+# バックグラウンド実行
+# ============================================
+# 同じスコープ（owner_id）の計算は同時に1つだけ。実行中に再度要求された場合は終了後にもう1回だけ実行する
+# 別プロセス（他のWebワーカー）とはキャッシュ上のロックで調整し、待っている間に他で計算が済んだ場合は計算しない
+CLUSTERING_LOCK_TIMEOUT = 10 * 60
+CLUSTERING_LOCK_POLL_INTERVAL = 1
+_schedule_lock = threading.Lock()
+_running_scopes = set()
+_dirty_scopes = set()
+_threads = []
+
+
+def schedule_clustering(owner_id):
+    """クラスタリングの再計算をバックグラウンドスレッドで予約する"""
+    if not getattr(settings, 'CLUSTERING_BACKGROUND', True):
+        return
+    with _schedule_lock:
+        if owner_id in _running_scopes:
+            _dirty_scopes.add(owner_id)
+            return
+        _running_scopes.add(owner_id)
+        thread = threading.Thread(target=_clustering_worker, args=(owner_id,), daemon=True)
+        _threads[:] = [t for t in _threads if t.is_alive()] + [thread]
+    thread.start()
+
+
+def wait_for_background_clustering(timeout=None):
+    """実行中のバックグラウンド計算の完了を待つ（管理コマンドの終了前などに使う）"""
+    with _schedule_lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join(timeout)
+
+
+def _clustering_lock_key(owner_id):
+    return f"clustering_{scope_name(owner_id)}"
+
+
+def _wait_clustering_lock(owner_id):
+    """スコープの計算ロックを取得する: (トークン, 待ったか)。期限まで取れなければトークンNoneで計算する"""
+    key = _clustering_lock_key(owner_id)
+    token = acquire_lock(key, CLUSTERING_LOCK_TIMEOUT)
+    if token is not None:
+        return token, False
+    deadline = time.monotonic() + CLUSTERING_LOCK_TIMEOUT
+    while token is None and time.monotonic() < deadline:
+        time.sleep(CLUSTERING_LOCK_POLL_INTERVAL)
+        token = acquire_lock(key, CLUSTERING_LOCK_TIMEOUT)
+    return token, True
+
+
+def _clustering_worker(owner_id):
+    try:
+        while True:
+            requested_at = timezone.now()
+            token, waited = _wait_clustering_lock(owner_id)
+            try:
+                # 待っている間に別プロセスで（要求より後に）始まった計算が終わっていれば、その結果を使う
+                if not (waited and ClusteringResult.objects.filter(
+                    owner_id=owner_id, status=ClusteringResult.STATUS_DONE, started_at__gte=requested_at,
+                ).exists()):
+                    compute_clustering(owner_id)
+            except Exception:
+                logger.exception("Background clustering failed for owner_id=%s", owner_id)
+            finally:
+                if token is not None:
+                    release_lock(_clustering_lock_key(owner_id), token)
+            with _schedule_lock:
+                if owner_id in _dirty_scopes:
+                    _dirty_scopes.discard(owner_id)
+                    continue
+                _running_scopes.discard(owner_id)
+                return
+    finally:
+        connection.close()
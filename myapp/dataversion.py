@@ -0,0 +1,206 @@
+"""
+集計キャッシュ用のデータバージョン（所有者ごとのカウンタ。所有者のないコメントは unowned）
+コメントが変わるたびに notify_comments_changed から上げ、集計結果はバージョンが一致する場合のみキャッシュから使う
+値はバージョンと一緒に固定のキーへ保存する。L1の値のバージョンが一致すれば、読むのは小さなバージョンのキーだけ（DBクエリなし）
+
+再計算は1つのリクエストだけが行う（キャッシュ上のロック）。その間、他のリクエストは古い値を返し、
+値がまだない場合だけ計算の完了を待つ。有効期限の少し前から確率的に再計算を始め（計算時間が長いほど早く）、
+期限切れに同時に集中しないようにする。ヒット・ミス・古い値・待機の回数（概数）は cache_counters で確認できる
+
+バージョン・ロック・カウンタ・集計結果は全プロセスで共有するキャッシュ（L2。myapp.tiercache）に置き、
+集計結果はプロセス内のL1にも持つ（L1の値はバージョンが一致する間だけ使う）
+"""
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+from .tiercache import load_entry, local_entry, shared_cache, store_entry
+
+# 再計算のロックの有効期限（計算中にプロセスが落ちた場合に解放されるまでの上限）
+LOCK_TIMEOUT = 60
+# 値がない場合に他のリクエストの計算完了を待つ上限（超えたら自分で計算する）
+LOCK_WAIT = 10
+LOCK_POLL_INTERVAL = 0.05
+# 早期再計算の強さ（XFetch の beta。1が標準、大きいほど早く再計算する）
+EARLY_REFRESH_BETA = 1.0
+# カウンタの種類: hit / miss（自分で計算） / early（期限前の再計算） / stale（古い値を返した） / wait（計算完了を待った）
+COUNTER_EVENTS = ('hit', 'miss', 'early', 'stale', 'wait')
+# カウンタはプロセス内で数え、この間隔（秒）ごとにL2へまとめて加算する（ヒットのたびにL2へ書き込まない）
+COUNTER_FLUSH_INTERVAL = 10
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_counts_flushed_at = time.monotonic()
+
+
+def scope_name(owner_id):
+    return 'unowned' if owner_id is None else f'owner_{owner_id}'
+
+
+def version_key(owner_id):
+    return f'data_version_{scope_name(owner_id)}'
+
+
+def value_key(owner_id, name):
+    return f'{name}_{scope_name(owner_id)}'
+
+
+def _new_version():
+    # 以前の番号と重ならないよう現在時刻にする（incr を使わないため、ファイルなど原子的な加算がないバックエンドでも失われない）
+    return time.time_ns()
+
+
+def get_data_version(owner_id):
+    """現在のデータバージョン（未設定なら初期化）"""
+    cache = shared_cache()
+    version = cache.get(version_key(owner_id))
+    if version is None:
+        cache.add(version_key(owner_id), _new_version(), None)
+        version = cache.get(version_key(owner_id))
+    return version
+
+
+def bump_data_version(owner_id):
+    """データバージョンを上げる（このスコープの集計キャッシュはすべて無効になる）"""
+    version = _new_version()
+    shared_cache().set(version_key(owner_id), version, None)
+    return version
+
+
+def lock_key(key):
+    return f'lock_{key}'
+
+
+def acquire_lock(key, timeout=LOCK_TIMEOUT):
+    """キャッシュ上のロックを取得する（取得できればトークン、他で保持中ならNone）"""
+    token = uuid.uuid4().hex
+    return token if shared_cache().add(lock_key(key), token, timeout) else None
+
+
+def release_lock(key, token):
+    # 期限切れ後に他で取り直したロックは消さない
+    cache = shared_cache()
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def counter_key(name, event):
+    return f'cache_counter_{name}_{event}'
+
+
+def count(name, event):
+    with _counts_lock:
+        _counts[name, event] += 1
+        if time.monotonic() - _counts_flushed_at < COUNTER_FLUSH_INTERVAL:
+            return
+    flush_counters()
+
+
+def flush_counters():
+    """
+    プロセス内で数えた回数をL2のカウンタに加算する
+    cache.incr はファイルベースのキャッシュなどでは読み込み→書き込みで原子的でないため、
+    複数プロセスが同時に加算すると一部が失われることがある（カウンタは傾向を見るための概数として扱う）
+    """
+    global _counts_flushed_at
+    with _counts_lock:
+        pending = dict(_counts)
+        _counts.clear()
+        _counts_flushed_at = time.monotonic()
+    cache = shared_cache()
+    for (name, event), delta in pending.items():
+        key = counter_key(name, event)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, None):
+                cache.incr(key, delta)
+
+
+def cache_counters(names):
+    """
+    {name: {event: 回数}}（全プロセスの合計の概数）
+    他のプロセスの直近 COUNTER_FLUSH_INTERVAL 秒分は含まず、原子的な incr がないバックエンドでは同時の加算が失われることがある
+    """
+    flush_counters()
+    keys = {counter_key(name, event): (name, event) for name in names for event in COUNTER_EVENTS}
+    found = shared_cache().get_many(list(keys))
+    counters = {name: dict.fromkeys(COUNTER_EVENTS, 0) for name in names}
+    for key, (name, event) in keys.items():
+        counters[name][event] = found.get(key, 0)
+    return counters
+
+
+def _is_fresh(entry, now):
+    # XFetch: 期限までの残りが計算時間 x beta x (-log(乱数)) を下回ったら再計算する
+    _, _, expires_at, duration, _ = entry
+    return now - duration * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) < expires_at
+
+
+def _store(owner_id, name, version, compute, timeout):
+    started = time.monotonic()
+    value = compute()
+    duration = time.monotonic() - started
+    # 期限切れ後も同じ期間だけ残しておき、再計算中は古い値として返す
+    return store_entry(value_key(owner_id, name), version, value, time.time() + timeout, duration, timeout * 2)[1]
+
+
+def _wait_for_value(owner_id, name, version):
+    """他のリクエストの計算完了を待つ: (値があったか, 値)"""
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = load_entry(value_key(owner_id, name))
+        if entry is not None and entry[0] == version:
+            return True, entry[1]
+        if shared_cache().get(lock_key(value_key(owner_id, name))) is None:
+            break
+    return False, None
+
+
+def get_or_compute(owner_id, name, compute, version=None, timeout=None):
+    """
+    version（省略時は owner_id のデータバージョン）時点の集計結果を返す。なければ compute() で計算して保存する
+    同じ値の再計算は同時に1つだけ（他のリクエストは古い値を返すか、値がない場合は完了を待つ）
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+    key = value_key(owner_id, name)
+    if version is None:
+        version = get_data_version(owner_id)
+
+    now = time.time()
+    # L1（プロセス内）にバージョンの一致する有効な値があれば、L2からは大きな値を読まない
+    local = local_entry(key)
+    if local is not None and local[0] == version and _is_fresh(local, now):
+        count(name, 'hit')
+        return local[1]
+    # L2には他のプロセスが計算した新しい値があるかもしれない
+    entry = load_entry(key) or local
+    current = entry is not None and entry[0] == version
+    if current and (local is None or entry[2] != local[2]) and _is_fresh(entry, now):
+        count(name, 'hit')
+        return entry[1]
+
+    token = acquire_lock(key)
+    if token is None:
+        if entry is not None:
+            # 他のリクエストが再計算中: 古い値（期限切れ・前のバージョン）を返す
+            count(name, 'stale')
+            return entry[1]
+        count(name, 'wait')
+        ready, value = _wait_for_value(owner_id, name, version)
+        if ready:
+            return value
+        token = acquire_lock(key)
+    try:
+        count(name, 'early' if current and now < entry[2] else 'miss')
+        return _store(owner_id, name, version, compute, timeout)
+    finally:
+        if token is not None:
+            release_lock(key, token)
@@ -0,0 +1,138 @@
+"""
+近似重複コメントのグループ化（MinHash/LSHの候補をJaccard係数で確認し、duplicate_of に代表コメントを設定）
+LSHバンドは代表コメントの分だけ CommentBand に保存するため、同じ文面が大量にあってもバケットは大きくならない
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .minhash import BANDS, band_keys, jaccard, shingles, signatures_from_shingles
+from .models import CommentBand, YouTubeComment
+
+# SQLiteのパラメータ数上限（バンド数 x バッチ件数）に収まる件数
+DEFAULT_BATCH_SIZE = 500
+
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+
+def _threshold():
+    return getattr(settings, 'DUPLICATE_THRESHOLD', 0.8)
+
+
+def _text(normalized_text, comment_text):
+    return normalized_text or comment_text or ''
+
+
+def _scope_lock(owner_id):
+    with _index_locks_guard:
+        return _index_locks.setdefault(owner_id, threading.Lock())
+
+
+def index_duplicates(batch_size=DEFAULT_BATCH_SIZE, owner_id=None, all_owners=True):
+    """
+    未照合（lsh_indexed=False）のコメントをID順に照合・登録する。処理件数を返す
+    重複は同じ所有者のコメント同士でのみ判定するため、所有者ごとに独立して照合する
+    all_owners=False の場合は owner_id（Noneなら所有者なし）のコメントだけを対象にする
+    """
+    if not all_owners:
+        return _index_owner(owner_id, batch_size)
+    owner_ids = list(YouTubeComment.objects.filter(lsh_indexed=False).order_by().values_list('owner_id', flat=True).distinct())
+    return sum(_index_owner(pending_owner_id, batch_size) for pending_owner_id in owner_ids)
+
+
+def _index_owner(owner_id, batch_size):
+    with _scope_lock(owner_id):
+        total = 0
+        while True:
+            pending = list(
+                YouTubeComment.objects.filter(owner_id=owner_id, lsh_indexed=False)
+                .order_by('id')
+                .values_list('id', 'normalized_text', 'comment_text')[:batch_size]
+            )
+            if not pending:
+                return total
+            _index_batch(owner_id, pending)
+            total += len(pending)
+
+
+def rebuild_duplicates(batch_size=DEFAULT_BATCH_SIZE, owner_id=None, all_owners=True):
+    """LSHバンドと重複グループを作り直す（all_owners=False の場合は owner_id のコメントのみ）"""
+    comments = YouTubeComment.objects.all()
+    bands = CommentBand.objects.all()
+    if not all_owners:
+        comments = comments.filter(owner_id=owner_id)
+        bands = bands.filter(comment__owner_id=owner_id)
+    with transaction.atomic():
+        bands.delete()
+        comments.update(duplicate_of=None, lsh_indexed=False)
+    return index_duplicates(batch_size=batch_size, owner_id=owner_id, all_owners=all_owners)
+
+
+def _index_batch(owner_id, pending):
+    """1バッチ分（同じ所有者のコメント）: 候補をLSHで引き、Jaccard係数で確認して代表を決める"""
+    ids = [pk for pk, _, _ in pending]
+    shingle_sets = [shingles(_text(normalized, text)) for _, normalized, text in pending]
+    keys = band_keys(signatures_from_shingles(shingle_sets))
+    indexable = [i for i, sh in enumerate(shingle_sets) if sh]
+
+    # 既存の代表コメントのうち、いずれかのバンドでバケットが一致するもの（(band, bucket) インデックスで検索）
+    buckets = defaultdict(list)
+    if indexable:
+        query = Q()
+        for band in range(BANDS):
+            query |= Q(band=band, bucket__in={int(keys[i, band]) for i in indexable})
+        bands = CommentBand.objects.filter(query, comment__owner_id=owner_id).exclude(comment_id__in=ids)
+        for comment_id, band, bucket in bands.values_list('comment_id', 'band', 'bucket'):
+            buckets[(band, bucket)].append(comment_id)
+    candidate_ids = {pk for members in buckets.values() for pk in members}
+    candidates = {
+        pk: shingles(_text(normalized, text))
+        for pk, normalized, text in YouTubeComment.objects.filter(id__in=candidate_ids, owner_id=owner_id).values_list('id', 'normalized_text', 'comment_text')
+    }
+
+    threshold = _threshold()
+    duplicate_of = {}
+    new_bands = []
+    for i in indexable:
+        pk = pending[i][0]
+        matched = set()
+        for band in range(BANDS):
+            matched.update(buckets.get((band, int(keys[i, band])), ()))
+        canonical = None
+        for candidate in sorted(matched):
+            if candidate not in candidates:  # 照合中に削除された（所有者が変わった）
+                continue
+            if jaccard(shingle_sets[i], candidates[candidate]) >= threshold:
+                canonical = candidate
+                break
+        if canonical is not None:
+            duplicate_of[pk] = canonical
+            continue
+        # 代表として登録（同じバッチの後続コメントからも候補として引けるようにする）
+        candidates[pk] = shingle_sets[i]
+        for band in range(BANDS):
+            bucket = int(keys[i, band])
+            buckets[(band, bucket)].append(pk)
+            new_bands.append(CommentBand(comment_id=pk, band=band, bucket=bucket))
+
+    with transaction.atomic():
+        # 本文が変わったコメントの古いバンドを消してから登録し直す
+        CommentBand.objects.filter(comment_id__in=ids).delete()
+        CommentBand.objects.bulk_create(new_bands, batch_size=1000)
+        YouTubeComment.objects.filter(id__in=ids).update(duplicate_of=None, lsh_indexed=True)
+        by_canonical = defaultdict(list)
+        for pk, canonical in duplicate_of.items():
+            by_canonical[canonical].append(pk)
+        for canonical, members in by_canonical.items():
+            YouTubeComment.objects.filter(id__in=members).update(duplicate_of_id=canonical)
+
+
+def duplicate_stats(queryset=None):
+    """(重複グループ数, 重複として畳まれるコメント数)"""
+    queryset = queryset if queryset is not None else YouTubeComment.objects.all()
+    duplicates = queryset.filter(duplicate_of__isnull=False)
+    return duplicates.values('duplicate_of').distinct().count(), duplicates.count()
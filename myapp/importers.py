@@ -0,0 +1,435 @@
+"""
+コメントインポート用の共通サービス
+CSV/JSONのインポート（views / admin / import_comments コマンド）はすべてこのモジュールを経由する
+"""
+import codecs
+import csv
+import json
+import logging
+import time
+from io import StringIO, TextIOWrapper
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .models import YouTubeComment
+from .parsing import coerce_row
+from .rollups import refresh_rollups, rollup_keys
+from .signals import notify_comments_changed
+
+logger = logging.getLogger(__name__)
+
+# 1トランザクションあたりの件数（メモリ使用量はこの件数で頭打ちになる）
+DEFAULT_BATCH_SIZE = 1000
+# JSONストリーミング時の読み込みチャンクサイズ（バイト）
+JSON_CHUNK_SIZE = 64 * 1024
+# JSON値1つ（コメント1件）として許容する最大文字数。これを超えても値が完結しなければ不正な入力とみなす
+JSON_MAX_VALUE_CHARS = 4 * 1024 * 1024
+# NDJSONの1行をコメントとして扱うために必要なキー（いずれか1つ）
+COMMENT_KEYS = {"video_id", "comment_id", "comment_text", "author"}
+
+
+# upsertモードで既存行に反映するフィールド
+UPSERT_UPDATE_FIELDS = ["like_count", "reply_count", "engagement_score"]
+
+
+class ImportResult:
+    """インポート結果（読み込んだ件数・新規/更新/スキップ件数・所要時間・スループット）"""
+
+    def __init__(self, count=0, elapsed=0.0):
+        self.count = count
+        self.elapsed = elapsed
+        self.created = 0
+        self.updated = 0
+
+    def add(self, count, created, updated):
+        self.count += count
+        self.created += created
+        self.updated += updated
+
+    @property
+    def written(self):
+        """実際に書き込んだ件数（新規 + 更新）"""
+        return self.created + self.updated
+
+    @property
+    def skipped(self):
+        """既存コメントと重複したため書き込まなかった件数"""
+        return self.count - self.written
+
+    @property
+    def rows_per_sec(self):
+        if self.elapsed <= 0:
+            return float(self.count)
+        return self.count / self.elapsed
+
+    def summary(self):
+        detail = f"{self.elapsed:.1f}秒, {self.rows_per_sec:.0f}件/秒"
+        if self.updated:
+            detail = f"新規 {self.created} 件 / 更新 {self.updated} 件, " + detail
+        if self.skipped:
+            detail = f"重複 {self.skipped} 件をスキップ, " + detail
+        return f"{self.written} 件のコメントをインポートしました（{detail}）。"
+
+
+class ImportInterrupted(Exception):
+    """
+    入力の途中で形式エラーが起きたためインポートを中断した
+    それまでのバッチはコミット済みで、その件数は result に入っている
+    """
+
+    def __init__(self, error, result):
+        super().__init__(str(error))
+        self.error = error
+        self.result = result
+
+    def summary(self, file_type):
+        message = f"{file_type}ファイルの形式が正しくありません（{self.error}）。"
+        if self.result.written:
+            # エラーより前のバッチはコミット済みなので、その件数も伝える
+            message += f"エラーの手前までの {self.result.written} 件はインポート済みです。"
+        return message
+
+
+def build_comment(row, owner=None):
+    """CSV行/JSON要素（dict）からYouTubeCommentインスタンスを生成（保存はしない）"""
+    return YouTubeComment(owner=owner, **coerce_row(row))
+
+
+def iter_batches(iterable, batch_size):
+    """イテラブルを batch_size 件ずつのリストに分割して返す"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_csv_rows(uploaded_file, encoding="utf-8"):
+    """アップロードされたCSVを1行ずつdictで返す（ファイル全体は読み込まない）"""
+    return csv.DictReader(TextIOWrapper(uploaded_file.file, encoding=encoding))
+
+
+def iter_file_rows(path):
+    """ローカルファイルを拡張子（.csv / .json / .jsonl / .ndjson）に応じて1行ずつdictで返す"""
+    path = str(path)
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, "rb") as f:
+            yield from iter_json_items(f)
+
+
+class _JSONStream:
+    """
+    ファイルオブジェクトを一定サイズずつ読み込みながらJSON値を1つずつデコードする
+    保持するのは未処理のバッファのみなので、メモリ使用量は要素1件分+チャンクサイズで済む
+    """
+
+    def __init__(self, fileobj, chunk_size=JSON_CHUNK_SIZE, max_value_chars=JSON_MAX_VALUE_CHARS):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.max_value_chars = max_value_chars
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """チャンクを1つ読み足す。EOFならFalse"""
+        if self.eof:
+            return False
+        chunk = self.fileobj.read(self.chunk_size)
+        if isinstance(chunk, bytes):
+            text = self.text_decoder.decode(chunk, final=not chunk)
+        else:
+            text = chunk
+        if not chunk:
+            self.eof = True
+        # 処理済み部分を捨ててバッファを小さく保つ
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(chunk) or bool(text)
+
+    def peek(self):
+        """空白を読み飛ばして次の1文字を返す（EOFなら空文字）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def decode_value(self):
+        """
+        次のJSON値を1つデコードする。値がバッファ末尾で途切れている場合は読み足して再試行
+        max_value_chars を読み足しても値が完結しない場合は、不正な入力としてその時点で例外にする
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if len(self.buffer) - self.pos > self.max_value_chars or not self._fill():
+                    raise
+                continue
+            # 数値などはバッファ末尾で途切れていても成功してしまうため、続きがあれば読み直す
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """'[' の直後から配列要素を1件ずつ返す"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.pos - 1)
+
+
+def iter_json_items(fileobj, chunk_size=JSON_CHUNK_SIZE, max_value_chars=JSON_MAX_VALUE_CHARS):
+    """
+    JSONファイルからコメント要素（dict）を1件ずつ返す
+    対応形式: トップレベル配列 / {"comments": [...]} / 改行区切りJSON（NDJSON）
+    "comments" キーもコメントのキー（COMMENT_KEYS）も持たないオブジェクト（{} など）は何も返さない
+    """
+    stream = _JSONStream(fileobj, chunk_size=chunk_size, max_value_chars=max_value_chars)
+    first = stream.peek()
+    if first == "[":
+        items = stream.iter_array()
+    elif first == "{":
+        items = _iter_object_stream(stream)
+    elif first == "":
+        return
+    else:
+        raise json.JSONDecodeError("Expecting '[' or '{'", stream.buffer, stream.pos)
+    for item in items:
+        if isinstance(item, dict):
+            yield item
+
+
+def _iter_object_stream(stream):
+    """
+    先頭がオブジェクトの場合の処理
+    "comments" キーの配列を見つけたらストリーミングで返し、
+    そうでなければオブジェクト自体をNDJSONの1行として扱う（コメントのキーを持つものだけ）
+    """
+    while stream.peek() == "{":
+        stream.expect("{")
+        obj = {}
+        if stream.peek() == "}":
+            stream.pos += 1
+        else:
+            while True:
+                key = stream.decode_value()
+                stream.expect(":")
+                if key == "comments" and stream.peek() == "[":
+                    yield from stream.iter_array()
+                    obj = None
+                else:
+                    value = stream.decode_value()
+                    if obj is not None:
+                        obj[key] = value
+                char = stream.peek()
+                stream.pos += 1
+                if char == "}":
+                    break
+                if char != ",":
+                    raise json.JSONDecodeError("Expecting ',' delimiter", stream.buffer, stream.pos - 1)
+        if obj is not None and COMMENT_KEYS & obj.keys():
+            yield obj
+    if stream.peek() != "":
+        raise json.JSONDecodeError("Extra data", stream.buffer, stream.pos)
+
+
+def _upsert_batch(batch, owner, batch_size):
+    """
+    (video_id, comment_id) が既存の行はカウント類のみ更新し、それ以外は新規作成する
+    1バッチあたり SELECT 1回 + bulk_update + bulk_create で済む
+    戻り値: (新規件数, 更新件数)
+    """
+    keyed = {}
+    unkeyed = []
+    for comment in batch:
+        if comment.comment_id:
+            # バッチ内の重複は後勝ち
+            keyed[(comment.video_id, comment.comment_id)] = comment
+        else:
+            unkeyed.append(comment)
+
+    to_update = []
+    if keyed:
+        existing = YouTubeComment.objects.filter(
+            owner=owner,
+            video_id__in={video_id for video_id, _ in keyed},
+            comment_id__in={comment_id for _, comment_id in keyed},
+        ).only("id", "video_id", "comment_id", *UPSERT_UPDATE_FIELDS)
+        for row in existing:
+            incoming = keyed.pop((row.video_id, row.comment_id), None)
+            if incoming is None:
+                continue
+            for field in UPSERT_UPDATE_FIELDS:
+                setattr(row, field, getattr(incoming, field))
+            to_update.append(row)
+
+    to_create = list(keyed.values()) + unkeyed
+    if to_update:
+        YouTubeComment.objects.bulk_update(to_update, UPSERT_UPDATE_FIELDS, batch_size=batch_size)
+    if to_create:
+        YouTubeComment.objects.bulk_create(to_create, batch_size=batch_size)
+    return len(to_create), len(to_update)
+
+
+def _insert_batch(batch, owner, batch_size):
+    """
+    既存コメントと (video_id, comment_id) が重複する行はスキップして新規作成する
+    ignore_conflicts ではスキップした件数が分からないため、バッチのキーに一致する行数の増分で数える
+    戻り値: 新規件数
+    """
+    keyed = YouTubeComment.objects.filter(
+        owner=owner,
+        video_id__in={comment.video_id for comment in batch if comment.comment_id},
+        comment_id__in={comment.comment_id for comment in batch if comment.comment_id},
+    )
+    before = keyed.count()
+    YouTubeComment.objects.bulk_create(batch, batch_size=batch_size, ignore_conflicts=True)
+    # comment_id が空の行は一意制約の対象外のため常に作成される
+    return keyed.count() - before + sum(1 for comment in batch if not comment.comment_id)
+
+
+def _copy_value(field, value):
+    """COPY (text形式) 用に1値をエスケープ"""
+    value = field.get_prep_value(value)
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, (bytes, memoryview)):
+        value = "\\x" + bytes(value).hex()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_batch(batch):
+    """
+    PostgreSQL COPY FROM STDIN で一時テーブルに流し込み、INSERT ... ON CONFLICT DO NOTHING で本テーブルへ移す
+    （COPYは重複を扱えないため一時テーブルを経由する）
+    """
+    fields = [f for f in YouTubeComment._meta.concrete_fields if not f.primary_key]
+    columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+    table = connection.ops.quote_name(YouTubeComment._meta.db_table)
+
+    buffer = StringIO()
+    for obj in batch:
+        buffer.write("\t".join(_copy_value(f, getattr(obj, f.attname)) for f in fields))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE _comment_import ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        copy_sql = f"COPY _comment_import ({columns}) FROM STDIN"
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, "copy_expert"):
+            # psycopg2
+            raw_cursor.copy_expert(copy_sql, buffer)
+        else:
+            # psycopg (3)
+            with raw_cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM _comment_import ON CONFLICT DO NOTHING"
+        )
+        return cursor.rowcount
+
+
+def copy_supported():
+    """COPY による高速ロードが使えるか（DB_TYPE が local / rds の PostgreSQL）"""
+    from django.conf import settings
+    return getattr(settings, "DB_TYPE", "sqlite") in ("local", "rds") and connection.vendor == "postgresql"
+
+
+def write_batch(batch, owner=None, upsert=False, use_copy=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    YouTubeCommentインスタンスのバッチを1トランザクションで書き込む
+    upsert=True の場合、既存コメントは like_count / reply_count / engagement_score を更新する
+    upsert=False の場合、既存コメントと重複する行はスキップする
+    戻り値: (新規件数, 更新件数)
+    """
+    with transaction.atomic():
+        if upsert:
+            counts = _upsert_batch(batch, owner, batch_size)
+        elif use_copy:
+            counts = _copy_batch(batch), 0
+        else:
+            counts = _insert_batch(batch, owner, batch_size), 0
+        # 動画・日付ごとの集計を、このバッチに含まれるキーだけ同じトランザクションで再集計
+        refresh_rollups(rollup_keys(batch))
+        return counts
+
+
+def import_rows(rows, owner=None, batch_size=DEFAULT_BATCH_SIZE, upsert=False):
+    """
+    dictのイテラブルをバッチ単位で書き込む
+    1バッチ = 1トランザクション。入力の形式エラー（ValueError）で中断した場合、それまでのバッチは
+    コミット済みのまま ImportInterrupted（result に書き込み済みの件数）を送出する
+    """
+    result = ImportResult()
+    started = time.monotonic()
+    comments = (build_comment(row, owner=owner) for row in rows)
+    error = None
+    try:
+        for batch in iter_batches(comments, batch_size):
+            created, updated = write_batch(batch, owner=owner, upsert=upsert, batch_size=batch_size)
+            result.add(len(batch), created, updated)
+    except ValueError as exc:
+        error = exc
+    result.elapsed = time.monotonic() - started
+    logger.info(
+        "Imported %d of %d comments (%d duplicates skipped) in %.2fs (%.0f rows/sec)",
+        result.written, result.count, result.skipped, result.elapsed, result.rows_per_sec,
+    )
+    if result.written:
+        notify_comments_changed(owner.pk if owner else None)
+    if error is not None:
+        logger.warning("Import interrupted after %d comments: %s", result.written, error)
+        raise ImportInterrupted(error, result) from error
+    return result
+
+
+def import_csv_file(uploaded_file, owner=None, batch_size=DEFAULT_BATCH_SIZE, upsert=False):
+    """アップロードされたCSVファイルをインポート"""
+    return import_rows(iter_csv_rows(uploaded_file), owner=owner, batch_size=batch_size, upsert=upsert)
+
+
+def import_json_file(uploaded_file, owner=None, batch_size=DEFAULT_BATCH_SIZE, upsert=False):
+    """アップロードされたJSON/NDJSONファイルをストリーミングでインポート"""
+    return import_rows(iter_json_items(uploaded_file), owner=owner, batch_size=batch_size, upsert=upsert)
@@ -0,0 +1,75 @@
+"""
+クラスタ数（k）の自動選択
+候補のkごとにKMeansを学習し、上限件数のサンプルで計算したシルエット係数が最大のkを選ぶ
+候補はプロセスプールで並列に評価する（ワーカーはこのモジュールだけを読み込むため、Djangoには依存させない）
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+# シルエット係数は O(n^2) のため、この件数のサンプルで計算する
+DEFAULT_SAMPLE_SIZE = 2000
+# これより少ない点数ではプロセスの起動コスト（1〜2秒）の方が大きいため、同じプロセスで順に評価する
+# ダッシュボード（CLUSTERING_MAX_COMMENTS 件まで）は既定ではこれに届かず、プールを使うのは scripts/cluster_3d.py の大きな入力
+PARALLEL_MIN_POINTS = 50000
+
+
+def candidate_ks(n_points, k_min=2, k_max=10):
+    """Candidate cluster counts for n_points (each cluster needs at least two points on average)."""
+    k_max = min(k_max, n_points // 2)
+    return list(range(max(2, k_min), k_max + 1))
+
+
+def score_k(points, k, weights=None, sample_size=DEFAULT_SAMPLE_SIZE, seed=42):
+    """Fit KMeans with k clusters and return (k, silhouette on a bounded sample)."""
+    # 1ワーカー1スレッド（プロセス数 = CPU予算）。BLAS/OpenMPのスレッドで予算を超えないようにする
+    with threadpool_limits(limits=1):
+        labels = KMeans(n_clusters=k, random_state=seed, n_init=3).fit_predict(points, sample_weight=weights)
+        if len(np.unique(labels)) < 2:
+            return k, -1.0
+        size = min(sample_size, len(points))
+        score = silhouette_score(points, labels, sample_size=size if size < len(points) else None, random_state=seed)
+    return k, float(score)
+
+
+def _score_k(args):
+    return score_k(*args)
+
+
+def _pool_context():
+    """
+    Webプロセスのバックグラウンドスレッドからも呼ばれるため fork は使わない
+    forkserver（sklearnを読み込み済みのサーバーからfork）が使えればそれを、なければ spawn
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def select_k(points, candidates, weights=None, max_workers=1, sample_size=DEFAULT_SAMPLE_SIZE, seed=42,
+             parallel_min_points=PARALLEL_MIN_POINTS):
+    """
+    Best k among candidates by silhouette score: (k, {k: score}).
+
+    Candidates are fitted concurrently in at most max_workers worker processes (one thread each)
+    once there are at least parallel_min_points points; smaller inputs are scored in this process.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if not candidates:
+        raise ValueError("no candidate k")
+    jobs = [(points, k, weights, sample_size, seed) for k in candidates]
+    workers = min(max_workers, len(candidates))
+    if workers > 1 and len(points) >= parallel_min_points:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as executor:
+            scores = dict(executor.map(_score_k, jobs))
+    else:
+        scores = dict(map(_score_k, jobs))
+    # 同点なら小さいk
+    best = max(candidates, key=lambda k: (scores[k], -k))
+    return best, scores
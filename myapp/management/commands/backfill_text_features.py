@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from myapp.models import YouTubeComment
+from myapp.nlp import text_features_batch
+
+
+class Command(BaseCommand):
+    help = '既存コメントの正規化テキストとトークン（normalized_text / tokens）を計算して保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回のbulk_updateで更新する件数（デフォルト: 1000）')
+        parser.add_argument('--all', action='store_true', help='計算済みのコメントも再計算する')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = YouTubeComment.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(tokens__isnull=True)
+
+        total = queryset.count()
+        self.stdout.write(f'対象: {total} 件')
+
+        # idの昇順にキーセットで走査（更新済みの行が対象から外れてもページがずれないように）
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(
+                queryset.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'comment_text')[:batch_size]
+            )
+            if not batch:
+                break
+            features = text_features_batch([comment.comment_text for comment in batch])
+            for comment, (normalized_text, tokens) in zip(batch, features):
+                comment.normalized_text, comment.tokens = normalized_text, tokens
+            YouTubeComment.objects.bulk_update(batch, ['normalized_text', 'tokens'], batch_size=batch_size)
+            updated += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'  {updated} / {total} 件', ending='\r')
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'{updated} 件のコメントを更新しました。'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from myapp.duplicates import DEFAULT_BATCH_SIZE, duplicate_stats, index_duplicates, rebuild_duplicates
+
+
+class Command(BaseCommand):
+    help = '近似重複コメント（MinHash/LSH）を照合してグループ化します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help=f'1回に照合する件数（デフォルト: {DEFAULT_BATCH_SIZE}）')
+        parser.add_argument('--rebuild', action='store_true', help='登録済みのバンドと重複グループを破棄して全件を照合し直す')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['rebuild']:
+            processed = rebuild_duplicates(batch_size=options['batch_size'])
+        else:
+            processed = index_duplicates(batch_size=options['batch_size'])
+        groups, duplicates = duplicate_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'{processed} 件を {time.monotonic() - started:.1f} 秒で照合しました。'
+            f'重複グループ: {groups} / 重複コメント: {duplicates} 件'
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from myapp.similarity import VectorIndex
+
+
+class Command(BaseCommand):
+    help = '類似コメント検索用の埋め込みインデックスを作成・更新します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', type=str, default=None, help='対象ユーザー名（省略時は所有者のないコメント）')
+        parser.add_argument('--all-owners', action='store_true', help='所有者のないコメントに加えてコメントを持つ全ユーザー分を作成する')
+        parser.add_argument('--rebuild', action='store_true', help='追記ではなくDBから作り直す')
+
+    def handle(self, *args, **options):
+        scopes = [None]
+        if options['owner']:
+            try:
+                scopes = [User.objects.get(username=options['owner']).pk]
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'ユーザー "{options["owner"]}" が見つかりません。'))
+                return
+        elif options['all_owners']:
+            scopes += list(User.objects.filter(youtube_comments__isnull=False).distinct().values_list('pk', flat=True))
+
+        for owner_id in scopes:
+            index = VectorIndex(owner_id)
+            started = time.monotonic()
+            meta = index.rebuild() if options['rebuild'] else index.update()
+            label = '所有者なし' if owner_id is None else f'owner_id={owner_id}'
+            mode = f'IVF {meta["nlist"]} リスト' if meta['nlist'] else '全件探索'
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: {meta["count"]} 件（{meta["dim"] or "-"} 次元, {mode}）を {time.monotonic() - started:.1f} 秒で更新しました。'
+            ))
@@ -0,0 +1,108 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from myapp.clustering import wait_for_background_clustering
+from myapp.importers import (
+    DEFAULT_BATCH_SIZE,
+    ImportResult,
+    copy_supported,
+    iter_batches,
+    iter_file_rows,
+    write_batch,
+)
+from myapp.models import YouTubeComment
+from myapp.parsing import coerce_rows
+from myapp.signals import notify_comments_changed
+from myapp.similarity import wait_for_background_index_updates
+
+
+class Command(BaseCommand):
+    help = 'CSV/JSON/NDJSONファイルからコメントを一括インポートします（PostgreSQLではCOPYで高速ロード）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', type=str, help='インポートするファイル (.csv / .json / .jsonl / .ndjson)')
+        parser.add_argument('--owner', type=str, default=None, help='コメントの所有者にするユーザー名')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help=f'1トランザクションあたりの件数（デフォルト: {DEFAULT_BATCH_SIZE}）')
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='行の変換に使うプロセス数（1以下でプロセスプールを使わない）')
+        parser.add_argument('--upsert', action='store_true', help='既存コメントは重複させずにカウント類を更新する')
+        parser.add_argument('--no-copy', action='store_true', help='PostgreSQLでもCOPYを使わずbulk_createで書き込む')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'ユーザー "{options["owner"]}" が見つかりません。'))
+                return
+
+        missing = [path for path in options['paths'] if not os.path.isfile(path)]
+        if missing:
+            self.stdout.write(self.style.ERROR(f'ファイルが見つかりません: {", ".join(missing)}'))
+            return
+
+        # upsertは既存行の参照が必要なためCOPYは使わない
+        use_copy = copy_supported() and not options['no_copy'] and not options['upsert']
+        self.stdout.write(f'書き込み方式: {"COPY FROM STDIN" if use_copy else "bulk_create"} / ワーカー数: {options["workers"]}')
+
+        executor = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 1 else None
+        total = ImportResult()
+        started = time.monotonic()
+        try:
+            for path in options['paths']:
+                result = self.import_file(path, owner, executor, use_copy, options)
+                total.add(result.count, result.created, result.updated)
+                self.stdout.write(self.style.SUCCESS(f'{path}: {result.summary()}'))
+        finally:
+            if executor:
+                executor.shutdown()
+        total.elapsed = time.monotonic() - started
+
+        if len(options['paths']) > 1:
+            self.stdout.write(self.style.SUCCESS(f'合計: {total.summary()}'))
+
+        # インポート後に予約されたクラスタリングの再計算を、プロセス終了前に完了させる
+        self.stdout.write('クラスタリング結果・類似検索のインデックスを更新しています...')
+        wait_for_background_clustering()
+        wait_for_background_index_updates()
+
+    def import_file(self, path, owner, executor, use_copy, options):
+        """1ファイル分をバッチ単位で変換・書き込み"""
+        batch_size = options['batch_size']
+        result = ImportResult()
+        started = time.monotonic()
+        for fields_batch in self.iter_coerced_batches(iter_file_rows(path), batch_size, executor, options['workers']):
+            batch = [YouTubeComment(owner=owner, **fields) for fields in fields_batch]
+            created, updated = write_batch(batch, owner=owner, upsert=options['upsert'], use_copy=use_copy, batch_size=batch_size)
+            result.add(len(batch), created, updated)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'  {result.count} 件 ({result.count / elapsed if elapsed else 0:.0f}件/秒)', ending='\r')
+        result.elapsed = time.monotonic() - started
+        self.stdout.write('')
+        if result.written:
+            notify_comments_changed(owner.pk if owner else None)
+        return result
+
+    def iter_coerced_batches(self, rows, batch_size, executor, workers):
+        """
+        読み込んだ行をバッチ単位でプロセスプールに渡して変換する
+        処理中のバッチ数を workers * 2 に制限し、メモリ使用量がファイルサイズに比例しないようにする
+        """
+        raw_batches = iter_batches(rows, batch_size)
+        if executor is None:
+            for raw_batch in raw_batches:
+                yield coerce_rows(raw_batch)
+            return
+
+        pending = deque()
+        for raw_batch in raw_batches:
+            pending.append(executor.submit(coerce_rows, raw_batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
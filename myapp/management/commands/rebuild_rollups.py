@@ -0,0 +1,25 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from myapp.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = '動画・日付ごとのエンゲージメント集計（EngagementRollup）をコメントから作り直します（修復用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', type=str, default=None, help='対象ユーザー名（省略時は全コメント）')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'ユーザー "{options["owner"]}" が見つかりません。'))
+                return
+            created = rebuild_rollups(owner.pk, all_owners=False)
+        else:
+            created = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'{created} 件の集計行を {time.monotonic() - started:.1f} 秒で作成しました。'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from myapp.clustering import compute_clustering
+from myapp.models import ClusteringResult
+
+
+class Command(BaseCommand):
+    help = 'クラスタリング結果を再計算して保存します（cronなどリクエスト外での実行用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', type=str, default=None, help='対象ユーザー名（省略時は所有者のないコメント）')
+        parser.add_argument('--all-owners', action='store_true', help='所有者のないコメントに加えてコメントを持つ全ユーザー分を再計算する')
+        parser.add_argument('--full', action='store_true', help='前回の学習結果を使わずに全体を再学習する')
+        parser.add_argument('--clusters', type=str, default=None, help='クラスタ数または auto（省略時は設定値 CLUSTERING_N_CLUSTERS）')
+
+    def handle(self, *args, **options):
+        n_clusters = options['clusters']
+        if n_clusters is not None and n_clusters != 'auto':
+            if not n_clusters.isdigit() or int(n_clusters) < 2:
+                self.stdout.write(self.style.ERROR('--clusters には2以上の数値または auto を指定してください。'))
+                return
+            n_clusters = int(n_clusters)
+
+        scopes = [None]
+        if options['owner']:
+            try:
+                scopes = [User.objects.get(username=options['owner']).pk]
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'ユーザー "{options["owner"]}" が見つかりません。'))
+                return
+        elif options['all_owners']:
+            scopes += list(User.objects.filter(youtube_comments__isnull=False).distinct().values_list('pk', flat=True))
+
+        for owner_id in scopes:
+            result = compute_clustering(owner_id, full=options['full'], n_clusters=n_clusters)
+            label = '所有者なし' if owner_id is None else f'owner_id={owner_id}'
+            if result.status == ClusteringResult.STATUS_DONE:
+                k = result.payload['n_clusters'] if result.payload else 0
+                self.stdout.write(self.style.SUCCESS(f'{label}: {result.comment_count} 件のコメントを {k} クラスタに分類しました（{result.mode}）。'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{label}: クラスタリングに失敗しました。'))
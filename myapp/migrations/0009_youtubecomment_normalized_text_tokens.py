@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-16 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0008_youtubecomment_unique_comment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="normalized_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="tokens",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
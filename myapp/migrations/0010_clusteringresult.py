@@ -0,0 +1,81 @@
+# Generated by Django 4.2.11 on 2026-10-16 23:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0009_youtubecomment_normalized_text_tokens"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClusteringResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "計算中"),
+                            ("done", "完了"),
+                            ("failed", "失敗"),
+                        ],
+                        default="running",
+                        max_length=20,
+                        verbose_name="状態",
+                    ),
+                ),
+                (
+                    "comment_count",
+                    models.IntegerField(default=0, verbose_name="対象コメント数"),
+                ),
+                ("payload", models.JSONField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, default="")),
+                (
+                    "started_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="開始日時"),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="完了日時"
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="clustering_results",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="所有者",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "クラスタリング結果",
+                "verbose_name_plural": "クラスタリング結果",
+                "ordering": ["-started_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "status", "-finished_at"],
+                        name="clustering_latest_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0010_clusteringresult"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="clusteringresult",
+            name="drift",
+            field=models.FloatField(blank=True, null=True, verbose_name="ドリフト"),
+        ),
+        migrations.AddField(
+            model_name="clusteringresult",
+            name="mode",
+            field=models.CharField(
+                blank=True, default="", max_length=20, verbose_name="計算方式"
+            ),
+        ),
+        migrations.AddField(
+            model_name="clusteringresult",
+            name="model_state",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
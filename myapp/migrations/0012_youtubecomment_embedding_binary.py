@@ -0,0 +1,116 @@
+# Generated by Django 4.2.11 on 2026-10-17 00:40
+
+import json
+import struct
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# このマイグレーション時点のバイナリ形式（myapp.vectors の FORMAT_VERSION 1）を固定したコピー
+# 後からコーデックが変わってもマイグレーションの結果が変わらないよう、アプリのコードは参照しない
+_HEADER = struct.Struct("<BBH")
+_FORMAT_VERSION = 1
+_FLOAT32 = 1
+# 型コード -> (structの書式, 1値のバイト数)
+_CODES = {1: ("f", 4), 2: ("e", 2), 3: ("b", 1)}
+_INT8 = 3
+
+
+def encode_embedding(text):
+    """テキストの埋め込みをfloat32のバイト列に変換（空ならNone、解析できなければValueError）"""
+    text = text.strip()
+    if not text or text == "null":
+        return None
+    if text.startswith("["):
+        values = json.loads(text)
+        if not isinstance(values, list):
+            raise ValueError("Embedding is not a list")
+    else:
+        values = text.replace(",", " ").split()
+    values = [float(value) for value in values]
+    if not values:
+        return None
+    if len(values) > 0xFFFF:
+        raise ValueError(f"Embedding has too many dimensions: {len(values)}")
+    return _HEADER.pack(_FORMAT_VERSION, _FLOAT32, len(values)) + struct.pack(
+        f"<{len(values)}f", *values
+    )
+
+
+def decode_embedding(blob):
+    """バイト列（float32 / float16 / int8）をfloatのリストに戻す"""
+    blob = bytes(blob)
+    version, code, dim = _HEADER.unpack_from(blob)
+    if version != _FORMAT_VERSION or code not in _CODES:
+        raise ValueError("Unknown embedding format")
+    offset = _HEADER.size
+    scale = 1.0
+    if code == _INT8:
+        (scale,) = struct.unpack_from("<f", blob, offset)
+        offset += 4
+    fmt, _ = _CODES[code]
+    values = struct.unpack_from(f"<{dim}{fmt}", blob, offset)
+    return [value * scale for value in values]
+
+
+def embeddings_to_binary(apps, schema_editor):
+    """テキストの埋め込み（"[0.1, ...]" など）をfloat32のバイト列に変換（解析できない値はNULL）"""
+    YouTubeComment = apps.get_model("myapp", "YouTubeComment")
+    queryset = YouTubeComment.objects.exclude(embedding__isnull=True).exclude(
+        embedding=""
+    )
+    batch = []
+    for comment in queryset.only("id", "embedding").iterator(chunk_size=BATCH_SIZE):
+        try:
+            comment.embedding_vector = encode_embedding(comment.embedding)
+        except (ValueError, TypeError, OverflowError):
+            comment.embedding_vector = None
+        batch.append(comment)
+        if len(batch) >= BATCH_SIZE:
+            YouTubeComment.objects.bulk_update(batch, ["embedding_vector"])
+            batch = []
+    if batch:
+        YouTubeComment.objects.bulk_update(batch, ["embedding_vector"])
+
+
+def embeddings_to_text(apps, schema_editor):
+    """逆変換: バイト列をJSON配列のテキストに戻す"""
+    YouTubeComment = apps.get_model("myapp", "YouTubeComment")
+    queryset = YouTubeComment.objects.exclude(embedding_vector__isnull=True)
+    batch = []
+    for comment in queryset.only("id", "embedding_vector").iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        comment.embedding = json.dumps(decode_embedding(comment.embedding_vector))
+        batch.append(comment)
+        if len(batch) >= BATCH_SIZE:
+            YouTubeComment.objects.bulk_update(batch, ["embedding"])
+            batch = []
+    if batch:
+        YouTubeComment.objects.bulk_update(batch, ["embedding"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0011_clusteringresult_model_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="embedding_vector",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(embeddings_to_binary, embeddings_to_text),
+        migrations.RemoveField(
+            model_name="youtubecomment",
+            name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="youtubecomment",
+            old_name="embedding_vector",
+            new_name="embedding",
+        ),
+    ]
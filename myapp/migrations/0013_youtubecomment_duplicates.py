@@ -0,0 +1,60 @@
+# Generated by Django 4.2.11 on 2026-10-17 01:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0012_youtubecomment_embedding_binary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="myapp.youtubecomment",
+            ),
+        ),
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="lsh_indexed",
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name="CommentBand",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("band", models.PositiveSmallIntegerField()),
+                ("bucket", models.BigIntegerField()),
+                (
+                    "comment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lsh_bands",
+                        to="myapp.youtubecomment",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["band", "bucket"], name="lsh_band_bucket_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-17 01:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0013_youtubecomment_duplicates"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="youtubecomment",
+            index=models.Index(
+                fields=["owner", "like_count", "reply_count"],
+                name="comment_engagement_idx",
+            ),
+        ),
+    ]
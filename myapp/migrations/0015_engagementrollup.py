@@ -0,0 +1,132 @@
+# Generated by Django 4.2.11 on 2026-10-17 02:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 1000
+
+
+def populate_rollups(apps, schema_editor):
+    """既存コメントから (所有者, 動画ID, 日付) ごとの集計を作成"""
+    YouTubeComment = apps.get_model("myapp", "YouTubeComment")
+    EngagementRollup = apps.get_model("myapp", "EngagementRollup")
+    rows = (
+        YouTubeComment.objects.filter(created_at__isnull=False)
+        .order_by()
+        .annotate(day=TruncDate("created_at"))
+        .values("owner_id", "video_id", "day")
+        .annotate(
+            comment_count=Count("id"),
+            like_sum=Sum("like_count"),
+            reply_sum=Sum("reply_count"),
+            engagement_sum=Sum("engagement_score"),
+        )
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(
+            EngagementRollup(
+                owner_id=row["owner_id"],
+                video_id=row["video_id"],
+                day=row["day"],
+                comment_count=row["comment_count"],
+                like_sum=row["like_sum"] or 0,
+                reply_sum=row["reply_sum"] or 0,
+                engagement_sum=row["engagement_sum"] or 0,
+            )
+        )
+        if len(batch) >= BATCH_SIZE:
+            EngagementRollup.objects.bulk_create(batch)
+            batch = []
+    EngagementRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0014_youtubecomment_engagement_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EngagementRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("video_id", models.CharField(max_length=50, verbose_name="動画ID")),
+                ("day", models.DateField(verbose_name="日付")),
+                (
+                    "comment_count",
+                    models.IntegerField(default=0, verbose_name="コメント数"),
+                ),
+                (
+                    "like_sum",
+                    models.BigIntegerField(default=0, verbose_name="いいね数合計"),
+                ),
+                (
+                    "reply_sum",
+                    models.BigIntegerField(default=0, verbose_name="返信数合計"),
+                ),
+                (
+                    "engagement_sum",
+                    models.FloatField(
+                        default=0, verbose_name="エンゲージメントスコア合計"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "エンゲージメント集計",
+                "verbose_name_plural": "エンゲージメント集計",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="youtubecomment",
+            index=models.Index(
+                fields=["owner", "video_id", "created_at"], name="comment_video_day_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="engagementrollup",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="engagement_rollups",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="所有者",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="engagementrollup",
+            index=models.Index(fields=["owner", "day"], name="rollup_owner_day_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="engagementrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("owner__isnull", False)),
+                fields=("owner", "video_id", "day"),
+                name="uniq_rollup_per_owner",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="engagementrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("owner__isnull", True)),
+                fields=("video_id", "day"),
+                name="uniq_rollup_without_owner",
+            ),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
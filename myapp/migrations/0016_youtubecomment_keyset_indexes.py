@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-17 02:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0015_engagementrollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="youtubecomment",
+            index=models.Index(fields=["created_at", "id"], name="comment_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="youtubecomment",
+            index=models.Index(
+                fields=["owner", "created_at", "id"], name="comment_owner_created_idx"
+            ),
+        ),
+    ]
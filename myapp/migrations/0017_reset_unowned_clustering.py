@@ -0,0 +1,20 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:20
+
+from django.db import migrations
+
+
+def delete_unowned_results(apps, schema_editor):
+    # 所有者なし（owner=NULL）の結果はこれまで全コメントを対象にしていたため、所有者のないコメントだけで計算し直す
+    ClusteringResult = apps.get_model("myapp", "ClusteringResult")
+    ClusteringResult.objects.filter(owner__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0016_youtubecomment_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_unowned_results, migrations.RunPython.noop),
+    ]
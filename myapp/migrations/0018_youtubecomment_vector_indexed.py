@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0017_reset_unowned_clustering"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="youtubecomment",
+            name="vector_indexed",
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
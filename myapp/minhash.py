@@ -0,0 +1,73 @@
+"""
+MinHash / LSH による近似重複コメントの検出
+文字n-gram（シングル）の集合からMinHash署名を作り、バンドごとのハッシュ（バケット）で候補を絞る
+インポート時（プロセスプールのワーカーを含む）にも使えるよう、Djangoには依存させない
+"""
+import re
+import zlib
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+_MASK_63 = np.uint64(0x7FFFFFFFFFFFFFFF)
+_rng = np.random.default_rng(20240601)
+# multiply-shift hashing: h_i(x) = (a_i * x + b_i) mod 2^64 >> 32 （aは奇数）
+_A = _rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+# バンド内の値を1つの64bitキーにまとめる係数
+_BAND_WEIGHTS = _rng.integers(1, 2 ** 63, size=ROWS_PER_BAND, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Character n-grams of text with whitespace removed and case folded."""
+    text = re.sub(r'\s+', '', text or '').lower()
+    if not text:
+        return set()
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a, b):
+    """Exact Jaccard similarity of two shingle sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def signatures(texts):
+    """MinHash signatures for many texts at once: (len(texts) x NUM_PERM) uint32."""
+    return signatures_from_shingles([shingles(t) for t in texts])
+
+
+def signatures_from_shingles(shingle_sets):
+    """
+    MinHash signatures from precomputed shingle sets.
+
+    Shingle hashes of all texts are concatenated and reduced per text with np.minimum.reduceat;
+    sets without shingles get an all-max signature and should not be put in the LSH index.
+    """
+    hashed = [np.fromiter((zlib.crc32(s.encode('utf-8')) for s in sh), dtype=np.uint64) for sh in shingle_sets]
+    lengths = np.fromiter((len(h) for h in hashed), dtype=np.int64, count=len(hashed))
+    result = np.full((len(hashed), NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint32)
+    present = lengths > 0
+    if not present.any():
+        return result
+    values = np.concatenate([h for h in hashed if len(h)])
+    with np.errstate(over='ignore'):
+        permuted = (_A[:, None] * values[None, :] + _B[:, None]) >> np.uint64(32)
+    starts = np.concatenate([[0], np.cumsum(lengths[present])[:-1]])
+    result[present] = np.minimum.reduceat(permuted, starts, axis=1).T.astype(np.uint32)
+    return result
+
+
+def band_keys(sigs):
+    """LSH bucket per band: (n x BANDS) int64 keys (non-negative, fit a signed 64-bit column)."""
+    banded = sigs.astype(np.uint64).reshape(len(sigs), BANDS, ROWS_PER_BAND)
+    with np.errstate(over='ignore'):
+        keys = (banded * _BAND_WEIGHTS).sum(axis=2)
+    return (keys & _MASK_63).astype(np.int64)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 
 class YouTubeComment(models.Model):
@@ -12,7 +13,17 @@ class YouTubeComment(models.Model):
     reply_depth_potential = models.IntegerField(default=0)
     engagement_score = models.FloatField(default=0)
     ai_reply = models.TextField(null=True, blank=True)
-    embedding = models.TextField(null=True, blank=True)
+    # 埋め込みベクトル（myapp.vectors の形式でパックしたfloat32/float16/int8のバイト列）
+    embedding = models.BinaryField(null=True, blank=True)
+    # 分析用: clean_text済みの本文と形態素解析結果（保存時に計算し、ダッシュボードで再利用する）
+    normalized_text = models.TextField(blank=True, default="", editable=False)
+    tokens = models.JSONField(null=True, blank=True, editable=False)
+    # 近似重複（MinHash/LSH）: 同じグループの代表コメント（最も古いもの）。代表自身・重複のないコメントはNULL
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, related_name='duplicates', null=True, blank=True, editable=False)
+    # LSHバンドを登録・照合済みか（本文が変わった場合はFalseに戻し、次回の照合で登録し直す）
+    lsh_indexed = models.BooleanField(default=False, db_index=True, editable=False)
+    # 類似コメント検索のインデックスに現在の埋め込みを登録済みか（埋め込み・所有者が変わった場合はFalseに戻す）
+    vector_indexed = models.BooleanField(default=False, db_index=True, editable=False)
     # ポータル用: コメントの所有者（ユーザーが自分のデータのみ操作可能にするため）
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='youtube_comments', null=True, blank=True, verbose_name="所有者")
 
@@ -20,10 +31,161 @@ class YouTubeComment(models.Model):
         ordering = ['-created_at']
         verbose_name = "YouTube Comment"
         verbose_name_plural = "YouTube Comments"
+        # 再インポート時に重複しないよう (所有者, 動画ID, コメントID) で一意にする
+        # ownerがNULLの行はNULL同士が重複とみなされないため、別の部分インデックスで担保する
+        # comment_idが空の行はキーにならないため対象外
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'video_id', 'comment_id'],
+                condition=Q(owner__isnull=False) & ~Q(comment_id=''),
+                name='uniq_comment_per_owner',
+            ),
+            models.UniqueConstraint(
+                fields=['video_id', 'comment_id'],
+                condition=Q(owner__isnull=True) & ~Q(comment_id=''),
+                name='uniq_comment_without_owner',
+            ),
+        ]
+        indexes = [
+            # ダッシュボード集計用: 所有者ごとのいいね数順（トップコメント）と、本文を読まずにインデックスだけで平均・合計を計算
+            models.Index(fields=['owner', 'like_count', 'reply_count'], name='comment_engagement_idx'),
+            # 集計の再計算用: (所有者, 動画ID) ごとの日付範囲
+            models.Index(fields=['owner', 'video_id', 'created_at'], name='comment_video_day_idx'),
+            # 一覧のキーセットページネーション用: (created_at, id) の範囲検索（全件・所有者ごと）
+            models.Index(fields=['created_at', 'id'], name='comment_created_idx'),
+            models.Index(fields=['owner', 'created_at', 'id'], name='comment_owner_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author}: {self.comment_text[:40]}..."
 
+    def refresh_text_features(self):
+        """comment_textから正規化テキストとトークンを再計算（近似重複の照合もやり直す）"""
+        from .nlp import text_features
+        normalized_text, self.tokens = text_features(self.comment_text)
+        if normalized_text != self.normalized_text:
+            self.lsh_indexed = False
+        self.normalized_text = normalized_text
+
+    def get_embedding(self):
+        """埋め込みベクトルをfloat32のnumpy配列で返す（未設定ならNone）"""
+        from .vectors import decode_embedding
+        return decode_embedding(self.embedding)
+
+    def set_embedding(self, vector, dtype=None):
+        """埋め込みベクトルをバイト列にパックして設定"""
+        from .vectors import encode_embedding
+        self.embedding = encode_embedding(vector, dtype=dtype)
+        self.vector_indexed = False
+
+    def save(self, *args, **kwargs):
+        # 本文が保存対象の場合のみ再計算（update_fieldsで他フィールドのみ更新する場合は不要）
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.refresh_text_features()
+            # 埋め込み・所有者が変わった可能性があるため、類似コメント検索のインデックスに登録し直す
+            self.vector_indexed = False
+        else:
+            extra_fields = set()
+            if 'comment_text' in update_fields:
+                self.refresh_text_features()
+                extra_fields |= {'normalized_text', 'tokens', 'lsh_indexed'}
+            if {'embedding', 'owner', 'owner_id'} & set(update_fields):
+                self.vector_indexed = False
+                extra_fields.add('vector_indexed')
+            if extra_fields:
+                kwargs['update_fields'] = set(update_fields) | extra_fields
+        super().save(*args, **kwargs)
+
+
+class CommentBand(models.Model):
+    """近似重複検出用のLSHバンド（代表コメントのみ登録し、(band, bucket) のインデックスで候補を引く）"""
+    comment = models.ForeignKey(YouTubeComment, on_delete=models.CASCADE, related_name='lsh_bands')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket'], name='lsh_band_bucket_idx'),
+        ]
+
+
+class EngagementRollup(models.Model):
+    """
+    (所有者, 動画ID, 日付) ごとのコメント数・いいね数・返信数・エンゲージメントスコアの集計
+    インポート・シグナルで変更のあったキーだけ再集計する（修復は rebuild_rollups コマンド）
+    投稿日時のないコメントは日付で集計できないため含めない
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='engagement_rollups', null=True, blank=True, verbose_name="所有者")
+    video_id = models.CharField(max_length=50, verbose_name="動画ID")
+    day = models.DateField(verbose_name="日付")
+    comment_count = models.IntegerField(default=0, verbose_name="コメント数")
+    like_sum = models.BigIntegerField(default=0, verbose_name="いいね数合計")
+    reply_sum = models.BigIntegerField(default=0, verbose_name="返信数合計")
+    engagement_sum = models.FloatField(default=0, verbose_name="エンゲージメントスコア合計")
+
+    class Meta:
+        # YouTubeComment と同様、ownerがNULLの行は部分インデックスで一意にする
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'video_id', 'day'],
+                condition=Q(owner__isnull=False),
+                name='uniq_rollup_per_owner',
+            ),
+            models.UniqueConstraint(
+                fields=['video_id', 'day'],
+                condition=Q(owner__isnull=True),
+                name='uniq_rollup_without_owner',
+            ),
+        ]
+        indexes = [
+            # 日別の推移（所有者ごとに日付順）
+            models.Index(fields=['owner', 'day'], name='rollup_owner_day_idx'),
+        ]
+        verbose_name = "エンゲージメント集計"
+        verbose_name_plural = "エンゲージメント集計"
+
+    def __str__(self):
+        return f"{self.owner or '所有者なし'} - {self.video_id} ({self.day})"
+
+
+class ClusteringResult(models.Model):
+    """クラスタリング結果 - バックグラウンドで計算し、ダッシュボードはこれを読むだけにする"""
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, '計算中'),
+        (STATUS_DONE, '完了'),
+        (STATUS_FAILED, '失敗'),
+    ]
+
+    # NULLの場合は所有者のないコメントが対象
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='clustering_results', null=True, blank=True, verbose_name="所有者")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING, verbose_name="状態")
+    comment_count = models.IntegerField(default=0, verbose_name="対象コメント数")
+    # perform_clustering の結果（座標・ラベル・中心・半径・cluster_analyses）
+    payload = models.JSONField(null=True, blank=True)
+    # 追加学習用の状態（ベクトライザ・射影・MiniBatchKMeans・座標）をpickleしたもの
+    model_state = models.BinaryField(null=True, blank=True)
+    # full: 全体を再学習 / incremental: 新規コメントのみ追加学習
+    mode = models.CharField(max_length=20, blank=True, default="", verbose_name="計算方式")
+    drift = models.FloatField(null=True, blank=True, verbose_name="ドリフト")
+    error = models.TextField(blank=True, default="")
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name="開始日時")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完了日時")
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['owner', 'status', '-finished_at'], name='clustering_latest_idx'),
+        ]
+        verbose_name = "クラスタリング結果"
+        verbose_name_plural = "クラスタリング結果"
+
+    def __str__(self):
+        return f"{self.owner or '所有者なし'} - {self.get_status_display()} ({self.started_at:%Y-%m-%d %H:%M})"
+
 
 class Plan(models.Model):
     """プランモデル - プランの種類を定義"""
@@ -0,0 +1,191 @@
+"""
+コメント本文の正規化・形態素解析
+インポート時（プロセスプールのワーカーを含む）とダッシュボードの両方から使うため、Djangoには依存させない
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    from janome.tokenizer import Tokenizer
+    JANOME_AVAILABLE = True
+except ImportError:
+    JANOME_AVAILABLE = False
+
+# トークン列のLRUキャッシュの最大件数（同一コメントの再解析を避ける）
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+
+STOP_WORDS = {'の', 'に', 'は', 'を', 'が', 'で', 'と', 'も', 'か', 'な', 'だ', 'です', 'ます', 'ました', 'て', 'た', 'する', 'した', 'ある', 'いる', 'なる', 'れる', 'られる', 'でした'}
+STOP_POS = ['助詞', '助動詞', '記号']
+
+# Janomeのトークナイザはスレッドセーフではないため、スレッドごとに1つ持つ（ロックで直列化しない）
+_local = threading.local()
+
+
+def get_tokenizer():
+    """Per-thread Janome tokenizer (built once per thread; the system dictionary is shared by the module)."""
+    tokenizer = getattr(_local, 'tokenizer', None)
+    if tokenizer is None:
+        tokenizer = _local.tokenizer = Tokenizer()
+    return tokenizer
+
+
+class TokenCache:
+    """Bounded LRU cache of token lists keyed by a hash of the text, with hit/miss counters."""
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            words = self._entries.get(key)
+            if words is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(words)
+
+    def put(self, key, words):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tuple(words)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = TokenCache()
+
+
+def clean_text(text):
+    """Basic text cleaning: URLs, mentions, excessive symbols."""
+    if pd.isna(text):
+        return ""
+    
+    text = str(text)
+    # Remove URLs
+    text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', text)
+    # Remove mentions (e.g., @username)
+    text = re.sub(r'@\w+', '', text)
+    # Remove excessive whitespace
+    text = re.sub(r'\s+', ' ', text)
+    # Remove excessive symbols (keep basic punctuation)
+    text = re.sub(r'[^\w\s.,!?;:()\-]', '', text)
+    return text.strip()
+
+
+def _tokenize(text):
+    """Extract meaningful Japanese words using morphological analysis (uncached)."""
+    # Remove URLs, mentions, and clean text
+    text = re.sub(r'http[s]?://\S+', '', text)
+    text = re.sub(r'@\w+', '', text)
+    
+    words = []
+    
+    if JANOME_AVAILABLE:
+        try:
+            tokens = list(get_tokenizer().tokenize(text))
+            
+            for token in tokens:
+                surface = token.surface
+                pos = token.part_of_speech.split(',')[0]
+                
+                # Skip stop words and stop parts of speech
+                if surface not in STOP_WORDS and pos not in STOP_POS:
+                    # Keep nouns, verbs, adjectives, and meaningful words
+                    if pos in ['名詞', '動詞', '形容詞'] or len(surface) >= 2:
+                        if len(surface) >= 2 and len(surface) <= 10:
+                            words.append(surface)
+        except Exception:
+            # Fallback to simple extraction if tokenization fails
+            pass
+    
+    # Fallback: simple character-based extraction
+    if not words:
+        japanese_pattern = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\w]+'
+        phrases = re.findall(japanese_pattern, text)
+        words = [p for p in phrases if 2 <= len(p) <= 10 and p not in STOP_WORDS]
+    
+    return words
+
+
+def extract_japanese_words(text):
+    """Extract meaningful Japanese words, reusing cached results for identical texts."""
+    if not text:
+        return []
+    key = TokenCache.key(text)
+    words = token_cache.get(key)
+    if words is None:
+        words = _tokenize(text)
+        token_cache.put(key, words)
+    return words
+
+
+def extract_japanese_words_many(texts):
+    """
+    extract_japanese_words for a list of texts.
+
+    Each text is still tokenized on its own; this only skips cached texts and analyzes duplicates in the list once.
+    """
+    results = [None] * len(texts)
+    pending = {}
+    for i, text in enumerate(texts):
+        if not text:
+            results[i] = []
+            continue
+        key = TokenCache.key(text)
+        if key in pending:
+            pending[key][1].append(i)
+            continue
+        words = token_cache.get(key)
+        if words is None:
+            pending[key] = (text, [i])
+        else:
+            results[i] = words
+    for key, (text, positions) in pending.items():
+        words = _tokenize(text)
+        token_cache.put(key, words)
+        for i in positions:
+            results[i] = list(words)
+    return results
+
+
+def token_cache_info():
+    """Hit/miss counters and size of the token cache."""
+    return token_cache.info()
+
+
+def text_features(comment_text):
+    """保存用の正規化テキストとトークン列を返す: (normalized_text, tokens)"""
+    normalized = clean_text(comment_text)
+    return normalized, extract_japanese_words(normalized)
+
+
+def text_features_batch(comment_texts):
+    """text_features を複数件まとめて: [(normalized_text, tokens), ...]（同じ本文は1回だけ解析）"""
+    normalized = [clean_text(text) for text in comment_texts]
+    return list(zip(normalized, extract_japanese_words_many(normalized)))
@@ -0,0 +1,187 @@
+"""
+コメント一覧のキーセット（カーソル）ページネーション
+(created_at, id) の新しい順に並べ、前のページの最後の行より後ろを LIMIT で読む（OFFSET・全件COUNTなし）
+どのページでもインデックスの範囲検索になるため、ページの深さによらず1ページあたりの時間は一定
+
+カーソルは向きと行の位置 (created_at, id) をエンコードした文字列（クライアントは中身を解釈しない）
+投稿日時のない行は最後（id の新しい順）に並べる。NULLを含む範囲条件はインデックスを使えないため、
+投稿日時あり・なしの区間を別々のクエリで読んでつなげる
+"""
+import base64
+import binascii
+import json
+from math import ceil
+
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+NEXT = 'next'
+PREVIOUS = 'prev'
+LAST = 'last'
+
+
+def encode_cursor(direction, created_at=None, pk=None):
+    payload = [direction, created_at.isoformat() if created_at else None, pk]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソル -> (向き, (created_at, id) または None)。不正・期限切れの形式は先頭ページとして扱う"""
+    if not cursor:
+        return NEXT, None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, created_at, pk = json.loads(raw)
+        if direction == LAST:
+            return LAST, None
+        if direction not in (NEXT, PREVIOUS) or not isinstance(pk, int):
+            return NEXT, None
+        if created_at is not None:
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                return NEXT, None
+        return direction, (created_at, pk)
+    except (binascii.Error, ValueError, TypeError):
+        return NEXT, None
+
+
+LAST_CURSOR = encode_cursor(LAST)
+
+
+def _forward(queryset, position):
+    """position より後ろ（新しい順）を読むクエリの列"""
+    dated = queryset.filter(created_at__isnull=False).order_by('-created_at', '-id')
+    undated = queryset.filter(created_at__isnull=True).order_by('-id')
+    if position is None:
+        return [dated, undated]
+    created_at, pk = position
+    if created_at is None:
+        return [undated.filter(id__lt=pk)]
+    # (created_at, id) < position。created_at の範囲条件にしてインデックスを範囲検索させる
+    return [dated.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk), undated]
+
+
+def _backward(queryset, position):
+    """position より前（古い順。最後のページから逆向き）を読むクエリの列"""
+    dated = queryset.filter(created_at__isnull=False).order_by('created_at', 'id')
+    undated = queryset.filter(created_at__isnull=True).order_by('id')
+    if position is None:
+        return [undated, dated]
+    created_at, pk = position
+    if created_at is None:
+        return [undated.filter(id__gt=pk), dated]
+    return [dated.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=pk)]
+
+
+def _take(querysets, limit):
+    rows = []
+    for queryset in querysets:
+        rows.extend(queryset[:limit - len(rows)])
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+class KeysetPaginator:
+    """
+    ListView の paginator / page_obj.paginator の代わり
+    ページ番号はないため、件数（count / num_pages / page_range）はテンプレートなどで参照された場合だけCOUNTで求める
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @cached_property
+    def count(self):
+        return self.queryset.count()
+
+    @cached_property
+    def num_pages(self):
+        # Django の Paginator と同じく、0件でも1ページ
+        return max(1, ceil(self.count / self.per_page))
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+
+class KeysetPage:
+    """1ページ分の行と前後のカーソル（テンプレートでは Django の Page と同じく has_next/has_previous を使える）"""
+
+    last_cursor = LAST_CURSOR
+
+    def __init__(self, object_list, per_page, has_next, has_previous, paginator=None):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(NEXT, last.created_at, last.pk)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        first = self.object_list[0]
+        return encode_cursor(PREVIOUS, first.created_at, first.pk)
+
+
+def keyset_page(queryset, cursor=None, per_page=30):
+    """
+    queryset を (created_at, id) の新しい順に並べたときの cursor のページ
+    queryset の並び順は無視する。1件多く読んで次（前）のページの有無を判定する
+    """
+    paginator = KeysetPaginator(queryset, per_page)
+    direction, position = decode_cursor(cursor)
+    if direction == NEXT:
+        rows = _take(_forward(queryset, position), per_page + 1)
+        if not rows and position is not None:
+            # 以降の行が削除された場合は最後のページを返す
+            return keyset_page(queryset, LAST_CURSOR, per_page)
+        return KeysetPage(rows[:per_page], per_page, len(rows) > per_page, position is not None, paginator)
+
+    rows = _take(_backward(queryset, position), per_page + 1)
+    has_previous = len(rows) > per_page
+    if direction == PREVIOUS and not has_previous:
+        # 先頭に達した場合は先頭ページとして読み直す（行が削除されて件数が足りないページを作らない）
+        return keyset_page(queryset, None, per_page)
+    return KeysetPage(rows[:per_page][::-1], per_page, direction == PREVIOUS, has_previous, paginator)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView用: paginate_by 件ずつのキーセットページネーション（?cursor=...）
+    コンテキストの paginator は KeysetPaginator（ページ番号の代わりに page_obj の前後のカーソルを使う）
+    """
+
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        page = keyset_page(queryset, self.request.GET.get(self.cursor_kwarg), page_size)
+        return page.paginator, page, page.object_list, page.has_other_pages()
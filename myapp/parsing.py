@@ -0,0 +1,35 @@
+"""
+インポート行（CSV行/JSON要素）をモデルのフィールド値に変換する処理
+管理コマンドのプロセスプールからも呼ばれるため、Django（ORM）には依存させない
+"""
+from .nlp import text_features, text_features_batch
+from .vectors import encode_embedding
+
+
+def coerce_row(row, features=None):
+    """CSV行/JSON要素（dict）をYouTubeCommentのフィールド値dictに変換（features: 計算済みの text_features の結果）"""
+    ai_reply = row.get("ai_reply")
+    comment_text = row.get("comment_text") or ""
+    # 正規化テキストとトークンはインポート時に1度だけ計算して保存する
+    normalized_text, tokens = features if features is not None else text_features(comment_text)
+    return {
+        "video_id": row.get("video_id") or "",
+        "comment_id": row.get("comment_id") or "",
+        "comment_text": comment_text,
+        "normalized_text": normalized_text,
+        "tokens": tokens,
+        "author": row.get("author") or "",
+        "like_count": int(row.get("like_count") or 0),
+        "reply_count": int(row.get("reply_count") or 0),
+        "reply_depth_potential": int(row.get("reply_depth_potential") or 0),
+        "engagement_score": float(row.get("engagement_score") or 0),
+        "created_at": row.get("created_at") or None,
+        "ai_reply": ai_reply if ai_reply and ai_reply != "null" else None,
+        "embedding": encode_embedding(row.get("embedding")),
+    }
+
+
+def coerce_rows(rows):
+    """複数行をまとめて変換（プロセスプールのワーカー用）。形態素解析はバッチ内でまとめて行う"""
+    features = text_features_batch([row.get("comment_text") or "" for row in rows])
+    return [coerce_row(row, row_features) for row, row_features in zip(rows, features)]
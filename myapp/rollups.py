@@ -0,0 +1,181 @@
+"""
+動画・日付ごとのエンゲージメント集計（EngagementRollup）の更新と参照
+変更のあったキー (所有者, 動画ID, 日付) だけを YouTubeComment から集計し直して置き換える（何度実行しても同じ結果）
+日別・動画別の推移はコメント本体ではなく集計行（動画数 x 日数）だけを読む
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import EngagementRollup, YouTubeComment
+
+# 1回の再集計で扱うキー数（条件句のパラメータ数を抑える）
+REFRESH_CHUNK_SIZE = 200
+REBUILD_BATCH_SIZE = 1000
+
+_pending = threading.local()
+
+
+def comment_day(created_at):
+    """コメントの集計日（タイムゾーン有効時は現在のタイムゾーンでの日付）"""
+    if created_at is None:
+        return None
+    if not isinstance(created_at, datetime):
+        # インポート直後のインスタンスは文字列のまま（保存時と同じ変換をする）
+        created_at = YouTubeComment._meta.get_field('created_at').to_python(created_at)
+        if created_at is None:
+            return None
+    if timezone.is_aware(created_at):
+        return timezone.localtime(created_at).date()
+    return created_at.date()
+
+
+def rollup_key(owner_id, video_id, created_at):
+    day = comment_day(created_at)
+    return None if day is None else (owner_id, video_id, day)
+
+
+def rollup_keys(comments):
+    """YouTubeCommentインスタンスの集計キー（投稿日時のないものは除く）"""
+    keys = {rollup_key(c.owner_id, c.video_id, c.created_at) for c in comments}
+    keys.discard(None)
+    return keys
+
+
+def _day_range(day):
+    start = datetime.combine(day, time.min)
+    end = datetime.combine(day + timedelta(days=1), time.min)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+def _aggregate(queryset):
+    """(動画ID, 日付) ごとの集計（1クエリ）"""
+    return (
+        queryset.filter(created_at__isnull=False)
+        .order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('owner_id', 'video_id', 'day')
+        .annotate(
+            comment_count=Count('id'),
+            like_sum=Sum('like_count'),
+            reply_sum=Sum('reply_count'),
+            engagement_sum=Sum('engagement_score'),
+        )
+    )
+
+
+def _rollup(row):
+    return EngagementRollup(
+        owner_id=row['owner_id'],
+        video_id=row['video_id'],
+        day=row['day'],
+        comment_count=row['comment_count'],
+        like_sum=row['like_sum'] or 0,
+        reply_sum=row['reply_sum'] or 0,
+        engagement_sum=row['engagement_sum'] or 0,
+    )
+
+
+def refresh_rollups(keys):
+    """指定したキーの集計行をコメントから作り直す（コメントがなくなったキーは削除）。更新したキー数を返す"""
+    keys = sorted({key for key in keys if key}, key=lambda k: (k[0] is not None, k[0] or 0, k[1], k[2]))
+    with transaction.atomic():
+        for start in range(0, len(keys), REFRESH_CHUNK_SIZE):
+            by_owner = defaultdict(list)
+            for owner_id, video_id, day in keys[start:start + REFRESH_CHUNK_SIZE]:
+                by_owner[owner_id].append((video_id, day))
+            for owner_id, pairs in by_owner.items():
+                comment_filter = Q()
+                rollup_filter = Q()
+                for video_id, day in pairs:
+                    # created_at の範囲条件にして comment_video_day_idx を使う
+                    day_start, day_end = _day_range(day)
+                    comment_filter |= Q(video_id=video_id, created_at__gte=day_start, created_at__lt=day_end)
+                    rollup_filter |= Q(video_id=video_id, day=day)
+                rows = _aggregate(YouTubeComment.objects.filter(owner_id=owner_id).filter(comment_filter))
+                EngagementRollup.objects.filter(owner_id=owner_id).filter(rollup_filter).delete()
+                EngagementRollup.objects.bulk_create([_rollup(row) for row in rows])
+    return len(keys)
+
+
+def schedule_rollup_refresh(keys):
+    """
+    シグナル用: キーを溜めてコミット後にまとめて再集計する（一括削除で1行ずつ再集計しないため）
+    ロールバックされた変更のキーが残っても、再集計は冪等なので次回まとめて処理して問題ない
+    """
+    pending = getattr(_pending, 'keys', None)
+    if pending is None:
+        pending = _pending.keys = set()
+    pending.update(key for key in keys if key)
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    keys = getattr(_pending, 'keys', None)
+    if keys:
+        _pending.keys = set()
+        refresh_rollups(keys)
+
+
+def rebuild_rollups(owner_id=None, all_owners=True):
+    """
+    集計を全件から作り直す（修復用）。作成した行数を返す
+    all_owners=False の場合は owner_id（Noneなら所有者なし）のコメントだけを対象にする
+    """
+    comments = YouTubeComment.objects.all()
+    rollups = EngagementRollup.objects.all()
+    if not all_owners:
+        comments = comments.filter(owner_id=owner_id)
+        rollups = rollups.filter(owner_id=owner_id)
+    created = 0
+    with transaction.atomic():
+        rollups.delete()
+        batch = []
+        for row in _aggregate(comments).iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(_rollup(row))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                EngagementRollup.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        EngagementRollup.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def _scoped(owner_id, start=None, end=None, video_id=None):
+    """集計行の絞り込み（owner_id=None の場合は所有者のないコメントの集計。owner_comments と同じ扱い）"""
+    queryset = EngagementRollup.objects.filter(owner_id=owner_id)
+    if start:
+        queryset = queryset.filter(day__gte=start)
+    if end:
+        queryset = queryset.filter(day__lte=end)
+    if video_id:
+        queryset = queryset.filter(video_id=video_id)
+    return queryset.order_by()
+
+
+def _totals():
+    return {
+        'comment_count': Sum('comment_count'),
+        'like_sum': Sum('like_sum'),
+        'reply_sum': Sum('reply_sum'),
+        'engagement_sum': Sum('engagement_sum'),
+    }
+
+
+def daily_engagement(owner_id=None, start=None, end=None, video_id=None):
+    """日別の推移: [{'day', 'comment_count', 'like_sum', 'reply_sum', 'engagement_sum'}, ...]（日付順）"""
+    return list(_scoped(owner_id, start, end, video_id).values('day').annotate(**_totals()).order_by('day'))
+
+
+def video_engagement(owner_id=None, start=None, end=None):
+    """動画別の合計: [{'video_id', 'comment_count', ...}, ...]（コメント数の多い順）"""
+    return list(_scoped(owner_id, start, end).values('video_id').annotate(**_totals()).order_by('-comment_count', 'video_id'))
@@ -0,0 +1,125 @@
+"""
+YouTubeCommentの変更を検知して、集計結果の再計算を予約する
+bulk_create / bulk_update / QuerySet.update はシグナルを送らないため、
+インポート・一括削除の経路では notify_comments_changed を直接呼ぶ
+（動画・日付ごとの集計は、インポートでは write_batch が同じトランザクションで更新する）
+通知はトランザクションごとにまとめ、コミット後に所有者ごとに1回だけデータバージョンを上げる
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .dataversion import bump_data_version
+from .models import YouTubeComment
+from .rollups import rollup_key, schedule_rollup_refresh
+
+_state = threading.local()
+
+
+class _ChangedOwners:
+    """1トランザクション内で変更のあった所有者（コミット後に1回だけ通知する）"""
+
+    def __init__(self, hooks):
+        # 登録先の on_commit の一覧（コミット・ロールバックで Django が作り直すため、トランザクションの識別に使う）
+        self.hooks = hooks
+        self.owner_ids = set()
+        self.flushed = False
+
+    def flush(self):
+        self.flushed = True
+        for owner_id in self.owner_ids:
+            _comments_changed(owner_id)
+
+
+def _comments_changed(owner_id):
+    from .clustering import schedule_clustering
+    from .similarity import schedule_vector_index_update
+
+    # 集計は所有者ごと。他の所有者のキャッシュ・クラスタリング結果・類似検索のインデックスには影響しない
+    bump_data_version(owner_id)
+    schedule_clustering(owner_id)
+    schedule_vector_index_update(owner_id)
+
+
+def notify_comments_changed(owner_id):
+    """
+    コメントの追加・更新・削除後に呼ぶ
+    コミット後にデータバージョンを上げ（集計キャッシュの無効化）、クラスタリングの再計算と類似検索のインデックスの更新を予約する
+    同じトランザクション内で何度呼んでも、所有者ごとに1回だけ実行する（トランザクション外では即時）
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        _comments_changed(owner_id)
+        return
+    batch = getattr(_state, 'batch', None)
+    if batch is None or batch.flushed or batch.hooks is not connection.run_on_commit:
+        # 新しいトランザクション（前のトランザクションはコミット済み、またはロールバックで破棄された）
+        batch = _state.batch = _ChangedOwners(connection.run_on_commit)
+        transaction.on_commit(batch.flush)
+    batch.owner_ids.add(owner_id)
+
+
+@contextmanager
+def muted_comment_signals():
+    """
+    一括処理用: この中の保存・削除ではコメントごとの集計・通知をしない
+    呼び出し側で動画・日付ごとの集計を更新し、notify_comments_changed を所有者ごとに呼ぶこと
+    """
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def _muted():
+    return getattr(_state, 'muted', False)
+
+
+# 動画・日付ごとの集計（EngagementRollup）に影響するフィールド
+ROLLUP_FIELDS = {'owner', 'owner_id', 'video_id', 'created_at', 'like_count', 'reply_count', 'engagement_score'}
+
+
+def _affects_rollups(update_fields):
+    return update_fields is None or bool(ROLLUP_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=YouTubeComment)
+def comment_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    if _muted():
+        return
+    # 所有者・動画・投稿日時が変わる場合に古いキー（所有者）も再集計できるよう、保存前の値を控えておく
+    instance._previous_rollup_key = None
+    instance._previous_owner_id = instance.owner_id
+    if raw or instance.pk is None or not _affects_rollups(update_fields):
+        return
+    previous = YouTubeComment.objects.filter(pk=instance.pk).values_list('owner_id', 'video_id', 'created_at').first()
+    if previous:
+        instance._previous_owner_id = previous[0]
+        instance._previous_rollup_key = rollup_key(*previous)
+
+
+@receiver(post_save, sender=YouTubeComment)
+def comment_saved(sender, instance, update_fields=None, **kwargs):
+    if _muted():
+        return
+    if _affects_rollups(update_fields):
+        schedule_rollup_refresh({
+            getattr(instance, '_previous_rollup_key', None),
+            rollup_key(instance.owner_id, instance.video_id, instance.created_at),
+        })
+    # 所有者が変わった場合は元の所有者の集計も変わる
+    for owner_id in {getattr(instance, '_previous_owner_id', instance.owner_id), instance.owner_id}:
+        notify_comments_changed(owner_id)
+
+
+@receiver(post_delete, sender=YouTubeComment)
+def comment_deleted(sender, instance, **kwargs):
+    if _muted():
+        return
+    schedule_rollup_refresh({rollup_key(instance.owner_id, instance.video_id, instance.created_at)})
+    notify_comments_changed(instance.owner_id)
@@ -0,0 +1,390 @@
+"""
+埋め込みベクトルによる類似コメント検索
+所有者ごとに正規化済みfloat32行列をファイルに保存し、メモリマップして内積（コサイン類似度）で上位k件を返す
+件数が多い場合は粗量子化（IVF: k-meansのリスト）で探索対象を絞る
+インデックスの作成・更新はコメント変更の通知後のバックグラウンドスレッドか build_vector_index コマンドで行い、
+リクエスト内では行わない（インデックスがなければ少数の場合のみ全件探索する）
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from sklearn.cluster import MiniBatchKMeans
+
+from .clustering import owner_comments, top_k_indices
+from .dataversion import scope_name
+from .models import YouTubeComment
+from .vectors import decode_matrix, embedding_info
+
+logger = logging.getLogger(__name__)
+
+BUILD_BATCH_SIZE = 10000
+# インデックスがない場合に全件探索する件数の上限（超える場合はインデックスの作成を待つ）
+BRUTE_FORCE_MAX = 5000
+
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+_snapshots = {}
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス間ロックなし（スレッド間のみ）
+    fcntl = None
+
+
+def index_dir():
+    return Path(getattr(settings, 'VECTOR_INDEX_DIR', settings.BASE_DIR / 'vector_index'))
+
+
+def _scope_lock(owner_id):
+    with _index_locks_guard:
+        return _index_locks.setdefault(owner_id, threading.Lock())
+
+
+class _FileLock:
+    """同じインデックスを複数プロセス（Webと管理コマンド）が同時に更新しないためのロック"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def _decode_rows(rows, dim):
+    """[(id, blob), ...] -> (ids, matrix); 次元数や型が違う行は除外する"""
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+    try:
+        matrix = decode_matrix([blob for _, blob in rows], dim=dim)
+        return np.fromiter((pk for pk, _ in rows), dtype=np.int64, count=len(rows)), matrix
+    except ValueError:
+        kept = [(pk, blob) for pk, blob in rows if embedding_info(blob)[1] == dim]
+        ids = np.fromiter((pk for pk, _ in kept), dtype=np.int64, count=len(kept))
+        return ids, np.vstack([decode_matrix([blob]) for _, blob in kept]) if kept else np.zeros((0, dim), dtype=np.float32)
+
+
+class VectorIndex:
+    """
+    1スコープ（所有者）分のインデックス
+    ファイル: <scope>.meta.json と世代ごとの <scope>.<gen>.f32 / .ids / .lists / .centroids.npy
+    再構築は新しい世代に書いてからmetaを置き換えるため、検索中のメモリマップは壊れない
+    """
+
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+        self.name = scope_name(owner_id)
+        self.dir = index_dir()
+
+    @property
+    def meta_path(self):
+        return self.dir / f'{self.name}.meta.json'
+
+    def path(self, gen, suffix):
+        return self.dir / f'{self.name}.{gen}.{suffix}'
+
+    def read_meta(self):
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        tmp = self.meta_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.meta_path)
+
+    def _append_files(self, meta, ids, matrix, lists):
+        """現在の世代のファイル末尾に追記（途中で失敗した書き込みはmetaの件数で切り詰める）"""
+        count, dim = meta['count'], meta['dim']
+        parts = [('f32', matrix.astype(np.float32), dim * 4), ('ids', ids.astype(np.int64), 8)]
+        if lists is not None:
+            parts.append(('lists', lists.astype(np.int32), 4))
+        for suffix, array, row_bytes in parts:
+            with open(self.path(meta['gen'], suffix), 'ab+') as f:
+                if f.tell() != count * row_bytes:
+                    f.truncate(count * row_bytes)
+                    f.seek(0, os.SEEK_END)
+                f.write(array.tobytes())
+
+    def _train(self, meta):
+        """IVF用のリスト（球面k-meansの中心）を学習し、全行を割り当て直す"""
+        n = meta['count']
+        matrix = np.memmap(self.path(meta['gen'], 'f32'), dtype=np.float32, mode='r', shape=(n, meta['dim']))
+        nlist = max(16, int(np.sqrt(n)))
+        sample_size = min(n, nlist * 50)
+        sample = matrix[np.sort(np.random.default_rng(42).choice(n, sample_size, replace=False))]
+        kmeans = MiniBatchKMeans(n_clusters=nlist, n_init=1, random_state=42, batch_size=4096).fit(sample)
+        centroids = _normalize(kmeans.cluster_centers_)
+        lists = np.concatenate([
+            np.argmax(matrix[start:start + BUILD_BATCH_SIZE] @ centroids.T, axis=1)
+            for start in range(0, n, BUILD_BATCH_SIZE)
+        ]).astype(np.int32)
+        np.save(self.path(meta['gen'], 'centroids.npy'), centroids)
+        lists.tofile(self.path(meta['gen'], 'lists'))
+        meta.update(nlist=nlist, trained_count=n)
+
+    def rebuild(self):
+        """DBの埋め込みからインデックスを作り直す（新しい世代に書いてから切り替える）"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with _scope_lock(self.owner_id), _FileLock(self.dir / f'{self.name}.lock'):
+            old = self.read_meta()
+            meta = {'gen': (old['gen'] + 1) if old else 1, 'dim': None, 'count': 0, 'nlist': 0, 'trained_count': 0}
+            comments = owner_comments(self.owner_id)
+            comments.filter(embedding__isnull=True, vector_indexed=False).update(vector_indexed=True)
+            queryset = comments.filter(embedding__isnull=False).order_by('id')
+            for suffix in ('f32', 'ids'):
+                self.path(meta['gen'], suffix).write_bytes(b'')
+            last_id = 0
+            while True:
+                rows = list(queryset.filter(id__gt=last_id).values_list('id', 'embedding')[:BUILD_BATCH_SIZE])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                _mark_indexed(rows)
+                if meta['dim'] is None:
+                    meta['dim'] = embedding_info(rows[0][1])[1]
+                ids, matrix = _decode_rows(rows, meta['dim'])
+                self._append_files(meta, ids, _normalize(matrix), None)
+                meta['count'] += len(ids)
+            if meta['count'] >= getattr(settings, 'VECTOR_INDEX_IVF_MIN', 50000):
+                self._train(meta)
+            self._write_meta(meta)
+            if old:
+                for suffix in ('f32', 'ids', 'lists', 'centroids.npy'):
+                    self.path(old['gen'], suffix).unlink(missing_ok=True)
+            return meta
+
+    def update(self):
+        """
+        埋め込みが追加・変更されたコメント（vector_indexed=False）を反映する
+        インデックスにある行はその場で書き換え（埋め込みがなくなった行は0にする）、ない行は末尾に追記する
+        古い行（削除・埋め込みなし）が多い場合や、件数が学習時から大きく増えた場合は再構築
+        """
+        meta = self.read_meta()
+        if meta is None or meta['dim'] is None:
+            return self.rebuild()
+        comments = owner_comments(self.owner_id)
+        current = comments.filter(embedding__isnull=False, vector_indexed=True).count()
+        if current < meta['count'] * 0.8 or (meta['nlist'] and meta['count'] > meta['trained_count'] * 4):
+            return self.rebuild()
+        if not meta['nlist'] and meta['count'] >= getattr(settings, 'VECTOR_INDEX_IVF_MIN', 50000):
+            return self.rebuild()
+
+        with _scope_lock(self.owner_id), _FileLock(self.dir / f'{self.name}.lock'):
+            meta = self.read_meta()
+            centroids = np.load(self.path(meta['gen'], 'centroids.npy')) if meta['nlist'] else None
+            indexed_ids = np.fromfile(self.path(meta['gen'], 'ids'), dtype=np.int64, count=meta['count'])
+            last_id = 0
+            while True:
+                rows = list(
+                    comments.filter(vector_indexed=False, id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'embedding')[:BUILD_BATCH_SIZE]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                positions = _positions(indexed_ids, [pk for pk, _ in rows])
+                ids, matrix = _decode_rows([(pk, blob) for pk, blob in rows if blob is not None], meta['dim'])
+                # 埋め込みがなくなった（次元数が変わった）行は検索に出ないよう0にする
+                kept = set(ids.tolist())
+                cleared = [positions[pk] for pk, _ in rows if pk in positions and pk not in kept]
+                matrix = _normalize(matrix)
+                lists = np.argmax(matrix @ centroids.T, axis=1) if centroids is not None else None
+                present = np.array([pk in positions for pk in ids.tolist()], dtype=bool)
+                if cleared or present.any():
+                    self._overwrite_rows(
+                        meta,
+                        cleared + [positions[pk] for pk in ids[present].tolist()],
+                        np.vstack([np.zeros((len(cleared), meta['dim']), dtype=np.float32), matrix[present]]),
+                        None if lists is None else np.concatenate([np.zeros(len(cleared), dtype=np.int64), lists[present]]),
+                    )
+                if (~present).any():
+                    self._append_files(meta, ids[~present], matrix[~present], None if lists is None else lists[~present])
+                    meta['count'] += int((~present).sum())
+                    indexed_ids = np.concatenate([indexed_ids, ids[~present]])
+                self._write_meta(meta)
+                _mark_indexed(rows)
+            return meta
+
+    def _overwrite_rows(self, meta, rows, matrix, lists):
+        """既存の行をその場で書き換える（検索中のメモリマップからは行単位で新旧どちらかが見える）"""
+        f32 = np.memmap(self.path(meta['gen'], 'f32'), dtype=np.float32, mode='r+', shape=(meta['count'], meta['dim']))
+        f32[rows] = matrix
+        f32.flush()
+        if lists is not None:
+            list_file = np.memmap(self.path(meta['gen'], 'lists'), dtype=np.int32, mode='r+', shape=(meta['count'],))
+            list_file[rows] = lists
+            list_file.flush()
+
+    def snapshot(self):
+        """検索用のメモリマップ（metaが変わるまでプロセス内で再利用）"""
+        try:
+            stamp = self.meta_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = _snapshots.get(self.name)
+        if cached and cached['stamp'] == stamp:
+            return cached
+        meta = self.read_meta()
+        if not meta or not meta['count']:
+            return None
+        n, gen = meta['count'], meta['gen']
+        snap = {
+            'stamp': stamp,
+            'meta': meta,
+            'matrix': np.memmap(self.path(gen, 'f32'), dtype=np.float32, mode='r', shape=(n, meta['dim'])),
+            'ids': np.memmap(self.path(gen, 'ids'), dtype=np.int64, mode='r', shape=(n,)),
+        }
+        if meta['nlist']:
+            lists = np.fromfile(self.path(gen, 'lists'), dtype=np.int32, count=n)
+            order = np.argsort(lists, kind='stable')
+            snap['centroids'] = np.load(self.path(gen, 'centroids.npy'))
+            snap['order'] = order
+            snap['offsets'] = np.searchsorted(lists[order], np.arange(meta['nlist'] + 1))
+        _snapshots[self.name] = snap
+        return snap
+
+    def search(self, vector, k=10, exclude_ids=()):
+        """正規化内積の上位k件: [(comment_id, score), ...]"""
+        snap = self.snapshot()
+        if snap is None or len(vector) != snap['meta']['dim']:
+            return []
+        query = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        if 'centroids' in snap:
+            nprobe = getattr(settings, 'VECTOR_INDEX_NPROBE', 8)
+            probe = top_k_indices(snap['centroids'] @ query, nprobe)
+            offsets = snap['offsets']
+            rows = np.sort(np.concatenate([snap['order'][offsets[l]:offsets[l + 1]] for l in probe]))
+            scores = snap['matrix'][rows] @ query
+        else:
+            rows = None
+            scores = snap['matrix'] @ query
+        top = top_k_indices(scores, k + len(exclude_ids))
+        top_rows = rows[top] if rows is not None else top
+        excluded = set(exclude_ids)
+        results = [(int(snap['ids'][r]), float(scores[t])) for r, t in zip(top_rows, top) if int(snap['ids'][r]) not in excluded]
+        return results[:k]
+
+
+def _positions(indexed_ids, ids):
+    """{comment_id: インデックス内の行番号}（インデックスにあるものだけ）"""
+    if not len(indexed_ids):
+        return {}
+    order = np.argsort(indexed_ids, kind='stable')
+    sorted_ids = indexed_ids[order]
+    wanted = np.asarray(ids, dtype=np.int64)
+    found = np.minimum(np.searchsorted(sorted_ids, wanted), len(sorted_ids) - 1)
+    hit = sorted_ids[found] == wanted
+    return dict(zip(wanted[hit].tolist(), order[found[hit]].tolist()))
+
+
+def _mark_indexed(rows):
+    # 読み込んだ時点の埋め込みを登録済みにする（その後に変わった行は保存時に再びFalseになる）
+    YouTubeComment.objects.filter(id__in=[pk for pk, _ in rows]).update(vector_indexed=True)
+
+
+def update_vector_index(owner_id):
+    """コメント変更後の追随（バックグラウンドスレッド・build_vector_index コマンドから呼ばれる）"""
+    try:
+        return VectorIndex(owner_id).update()
+    except Exception:
+        logger.exception("Vector index update failed for owner_id=%s", owner_id)
+        return None
+
+
+# ============================================
+# バックグラウンド実行
+# ============================================
+# 同じスコープの更新は同時に1つだけ。実行中に再度要求された場合は終了後にもう1回だけ実行する
+_schedule_lock = threading.Lock()
+_running_scopes = set()
+_dirty_scopes = set()
+_threads = []
+
+
+def schedule_vector_index_update(owner_id):
+    """インデックスの更新をバックグラウンドスレッドで予約する（VECTOR_INDEX_BACKGROUND=False の場合は build_vector_index コマンドで更新）"""
+    if not getattr(settings, 'VECTOR_INDEX_BACKGROUND', True):
+        return
+    with _schedule_lock:
+        if owner_id in _running_scopes:
+            _dirty_scopes.add(owner_id)
+            return
+        _running_scopes.add(owner_id)
+        thread = threading.Thread(target=_index_worker, args=(owner_id,), daemon=True)
+        _threads[:] = [t for t in _threads if t.is_alive()] + [thread]
+    thread.start()
+
+
+def wait_for_background_index_updates(timeout=None):
+    """実行中のバックグラウンド更新の完了を待つ（管理コマンドの終了前などに使う）"""
+    with _schedule_lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join(timeout)
+
+
+def _index_worker(owner_id):
+    try:
+        while True:
+            update_vector_index(owner_id)
+            with _schedule_lock:
+                if owner_id in _dirty_scopes:
+                    _dirty_scopes.discard(owner_id)
+                    continue
+                _running_scopes.discard(owner_id)
+                return
+    finally:
+        connection.close()
+
+
+def search_without_index(owner_id, vector, k=10, exclude_ids=()):
+    """インデックスを使わずDBの埋め込みを全件探索する（BRUTE_FORCE_MAX 件を超える場合は空）"""
+    rows = list(
+        owner_comments(owner_id).filter(embedding__isnull=False).exclude(id__in=exclude_ids)
+        .order_by().values_list('id', 'embedding')[:BRUTE_FORCE_MAX + 1]
+    )
+    if not rows or len(rows) > BRUTE_FORCE_MAX:
+        return []
+    ids, matrix = _decode_rows(rows, len(vector))
+    if not len(ids):
+        return []
+    scores = _normalize(matrix) @ _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+    return [(int(ids[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+def similar_comments(comment, k=10):
+    """commentに埋め込みが近いコメントを返す: [(YouTubeComment, score), ...]"""
+    if comment.embedding is None:
+        return []
+    index = VectorIndex(comment.owner_id)
+    # 削除済みのコメントがインデックスに残っている可能性があるため多めに取る
+    if index.read_meta() is None:
+        # インデックスの作成はリクエスト外で行う。それまでは件数が少なければ全件探索する
+        schedule_vector_index_update(comment.owner_id)
+        hits = search_without_index(comment.owner_id, comment.get_embedding(), k=k, exclude_ids=(comment.pk,))
+    else:
+        hits = index.search(comment.get_embedding(), k=k * 2 + 5, exclude_ids=(comment.pk,))
+    found = owner_comments(comment.owner_id).filter(embedding__isnull=False).in_bulk([pk for pk, _ in hits])
+    return [(found[pk], score) for pk, score in hits if pk in found][:k]
@@ -0,0 +1,65 @@
+"""
+ダッシュボードの統計（所有者ごとのコメントに対するSQLの集計）
+平均・最大・合計・高/低エンゲージメント件数・トップコメントを1回の aggregate（1クエリ）で計算する
+件数によらずクエリ数は一定。平均との比較やトップコメントはスカラーサブクエリで同じSQLに含める
+"""
+from django.db.models import Avg, Count, IntegerField, Max, Q, Subquery, Sum, Value
+
+
+def _scalar(queryset, aggregate):
+    """queryset 全体に対する集計値のスカラーサブクエリ（定数でグループ化して1行にする）"""
+    return Subquery(
+        queryset.annotate(_all=Value(1, output_field=IntegerField()))
+        .values('_all')
+        .annotate(value=aggregate)
+        .values('value')
+    )
+
+
+def engagement_stats(queryset):
+    """
+    統計サマリーと分析結果: (stats, analysis)。コメントがなければ (None, None)
+
+    高エンゲージメント: いいね数・返信数がともに平均より多いコメント（低エンゲージメントはともに平均未満）
+    """
+    queryset = queryset.order_by()
+    avg_likes = _scalar(queryset, Avg('like_count'))
+    avg_replies = _scalar(queryset, Avg('reply_count'))
+    # いいね数が最多のコメント（同数なら返信数が多いもの。comment_engagement_idx の逆順で1件だけ読む）
+    top_comment = Subquery(queryset.order_by('-like_count', '-reply_count', '-id').values('pk')[:1])
+
+    row = queryset.aggregate(
+        total_comments=Count('pk'),
+        avg_likes=Avg('like_count'),
+        avg_replies=Avg('reply_count'),
+        max_likes=Max('like_count'),
+        max_replies=Max('reply_count'),
+        total_likes=Sum('like_count'),
+        total_replies=Sum('reply_count'),
+        high_engagement_count=Count('pk', filter=Q(like_count__gt=avg_likes, reply_count__gt=avg_replies)),
+        low_engagement_count=Count('pk', filter=Q(like_count__lt=avg_likes, reply_count__lt=avg_replies)),
+        top_comment_reply_count=Max('reply_count', filter=Q(pk=top_comment)),
+    )
+    total = row['total_comments']
+    if not total:
+        return None, None
+
+    stats = {
+        "total_comments": total,
+        "avg_likes": float(row['avg_likes']),
+        "avg_replies": float(row['avg_replies']),
+        "max_likes": row['max_likes'],
+        "max_replies": row['max_replies'],
+        "total_likes": row['total_likes'],
+        "total_replies": row['total_replies'],
+    }
+    analysis = {
+        "high_engagement_count": row['high_engagement_count'],
+        "low_engagement_count": row['low_engagement_count'],
+        "engagement_ratio": round(row['high_engagement_count'] / total * 100, 1),
+        "top_comment_likes": row['max_likes'],
+        "top_comment_replies": row['max_replies'],
+        # アドバイス用: いいね数が最多のコメントの返信数
+        "top_liked_comment_replies": row['top_comment_reply_count'] or 0,
+    }
+    return stats, analysis
@@ -1,3 +1,1135 @@
-from django.test import TestCase
+import contextlib
+import importlib.util
+import io
+import json
+import shutil
+import threading
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+import numpy as np
+import pandas as pd
+
+from .clustering import compute_clustering
+from . import clustering, dataversion
+from .dataversion import cache_counters, get_data_version, get_or_compute
+from .duplicates import index_duplicates
+from . import kselection, nlp
+from .importers import DEFAULT_BATCH_SIZE, ImportInterrupted, _JSONStream, import_csv_file, import_json_file, iter_json_items
+from .models import EngagementRollup, YouTubeComment
+from .pagination import LAST_CURSOR, NEXT, decode_cursor, encode_cursor, keyset_page
+from .signals import bump_data_version, notify_comments_changed
+from .stats import engagement_stats
+from .similarity import VectorIndex, similar_comments
+from .vectors import decode_embedding, decode_matrix, embedding_info, encode_embedding
+from . import tiercache
+from .tiercache import local_cache
+
+# テストではファイル・Redisのキャッシュを使わない（集計キャッシュもプロセス内のみ）
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'dashboard': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-dashboard'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES, CLUSTERING_BACKGROUND=False, VECTOR_INDEX_BACKGROUND=False)
+class AnalyticsTestCase(TestCase):
+    """キャッシュ・L1・ベクトルインデックスのディレクトリをテストごとに空にする"""
+
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        local_cache.clear()
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        override = self.settings(VECTOR_INDEX_DIR=Path(index_dir))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_comment(self, owner=None, **fields):
+        values = {
+            'video_id': 'v1',
+            'comment_id': f'c{YouTubeComment.objects.count() + 1}',
+            'comment_text': 'テストのコメントです',
+            'author': 'author',
+        }
+        values.update(fields)
+        return YouTubeComment.objects.create(owner=owner, **values)
+
+
+def csv_upload(rows, name='comments.csv'):
+    header = 'video_id,comment_id,comment_text,author,like_count,reply_count,created_at\n'
+    body = ''.join(','.join(str(value) for value in row) + '\n' for row in rows)
+    return SimpleUploadedFile(name, (header + body).encode('utf-8'), content_type='text/csv')
+
+
+class OwnerScopingTests(AnalyticsTestCase):
+    """ダッシュボード・統計・クラスタリングはログインユーザーのコメントだけを対象にする"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        texts = ['動画の編集がとても上手です', '音楽の選曲が素晴らしい', '次の動画も楽しみにしています', '説明がわかりやすかった']
+        self.alice_ids = {
+            self.make_comment(self.alice, comment_text=text, like_count=i + 1).pk for i, text in enumerate(texts)
+        }
+        self.bob_ids = {
+            self.make_comment(self.bob, comment_text=f'{text}（別チャンネル）', like_count=100).pk for text in texts
+        }
+        self.make_comment(None, comment_text='所有者のないコメント', like_count=1000)
+
+    def test_dashboard_stats_exclude_other_owners(self):
+        self.client.login(username='alice', password='pw')
+        response = self.client.get('/')
+        stats = response.context['stats']
+        self.assertEqual(stats['total_comments'], 4)
+        self.assertEqual(stats['max_likes'], 4)
+        self.assertEqual({c.pk for c in response.context['comments']}, self.alice_ids)
+
+    def test_comment_rows_exclude_other_owners(self):
+        self.client.login(username='bob', password='pw')
+        data = self.client.get('/comments/rows/', {'fields': 'likes'}).json()
+        self.assertEqual({row[0] for row in data['rows']}, self.bob_ids)
+
+    def test_anonymous_dashboard_reads_unowned_comments_only(self):
+        stats = self.client.get('/').context['stats']
+        self.assertEqual(stats['total_comments'], 1)
+        self.assertEqual(stats['max_likes'], 1000)
+
+    def test_clustering_excludes_other_owners(self):
+        result = compute_clustering(self.alice.pk)
+        self.assertEqual(result.status, result.STATUS_DONE, result.error)
+        self.assertEqual(set(result.payload['comment_ids']), self.alice_ids)
+        self.assertEqual(result.comment_count, 4)
+
+    def test_admin_csv_import_is_owned_by_selected_user(self):
+        admin_user = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(admin_user)
+        upload = csv_upload([('v9', 'x1', 'インポートしたコメント', 'a', 1, 0, '2024-01-01T00:00:00Z')])
+        self.client.post('/admin/myapp/youtubecomment/import-csv/', {'csv_file': upload, 'owner': self.bob.pk})
+        self.assertEqual(YouTubeComment.objects.get(comment_id='x1').owner, self.bob)
+
+        # 所有者を選ばなかった場合はログイン中の管理者のコメントになる
+        upload = csv_upload([('v9', 'x2', 'インポートしたコメント', 'a', 1, 0, '2024-01-01T00:00:00Z')])
+        self.client.post('/admin/myapp/youtubecomment/import-csv/', {'csv_file': upload})
+        self.assertEqual(YouTubeComment.objects.get(comment_id='x2').owner, admin_user)
+
+
+class NotifyTests(AnalyticsTestCase):
+    """コメントの変更通知: コミット後に所有者ごとに1回だけデータバージョンを上げ、集計キャッシュを無効にする"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def bumps(self):
+        return mock.patch('myapp.signals.bump_data_version', side_effect=bump_data_version)
+
+    def test_one_bump_per_owner_per_transaction(self):
+        with self.bumps() as bump, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for i in range(5):
+                    self.make_comment(self.alice, comment_text=f'コメント{i}')
+                self.make_comment(self.bob)
+        self.assertEqual(sorted(call.args[0] for call in bump.call_args_list), [self.alice.pk, self.bob.pk])
+
+    def test_rolled_back_changes_do_not_block_later_notifications(self):
+        with self.bumps() as bump, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.make_comment(self.alice)
+                raise RuntimeError
+            with transaction.atomic():
+                self.make_comment(self.alice)
+        self.assertEqual([call.args[0] for call in bump.call_args_list], [self.alice.pk])
+
+    def test_notify_invalidates_cached_values(self):
+        compute = mock.Mock(side_effect=lambda: YouTubeComment.objects.filter(owner=self.alice).count())
+        self.assertEqual(get_or_compute(self.alice.pk, 'count', compute), 0)
+        self.assertEqual(get_or_compute(self.alice.pk, 'count', compute), 0)
+        self.assertEqual(compute.call_count, 1)
+
+        bob_version = get_data_version(self.bob.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_comment(self.alice)
+        self.assertEqual(get_or_compute(self.alice.pk, 'count', compute), 1)
+        self.assertEqual(compute.call_count, 2)
+        # 他の所有者のバージョンは変わらない
+        self.assertEqual(get_data_version(self.bob.pk), bob_version)
+
+    def test_admin_delete_all_notifies_each_owner_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                self.make_comment(self.alice, comment_text=f'コメント{i}', created_at='2024-01-01T00:00:00Z')
+            self.make_comment(None, created_at='2024-01-01T00:00:00Z')
+        self.assertTrue(EngagementRollup.objects.exists())
+        admin_user = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(admin_user)
+        with self.bumps() as bump, mock.patch('myapp.signals.schedule_rollup_refresh') as per_row, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/myapp/youtubecomment/delete-all/')
+        per_row.assert_not_called()
+        self.assertFalse(YouTubeComment.objects.exists())
+        self.assertFalse(EngagementRollup.objects.exists())
+        self.assertEqual(sorted(bump.call_args_list, key=str), sorted([mock.call(self.alice.pk), mock.call(None)], key=str))
+
+
+class GetOrComputeTests(AnalyticsTestCase):
+    """集計キャッシュ: 再計算は同時に1つだけ・再計算中は古い値を返す・期限前の確率的な再計算"""
+
+    def test_concurrent_miss_computes_once(self):
+        calls = []
+
+        def compute():
+            calls.append(threading.get_ident())
+            time.sleep(0.3)
+            return 'value'
+
+        results = []
+        start = threading.Barrier(4)
+
+        def worker():
+            start.wait()
+            results.append(get_or_compute(None, 'single_flight', compute, version=1))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 4)
+        counters = cache_counters(['single_flight'])['single_flight']
+        self.assertEqual((counters['miss'], counters['wait']), (1, 3))
+
+    def test_stale_value_is_served_while_locked(self):
+        get_or_compute(None, 'stale_value', lambda: 'old', version=1)
+        key = dataversion.value_key(None, 'stale_value')
+        token = dataversion.acquire_lock(key)
+        self.addCleanup(dataversion.release_lock, key, token)
+        compute = mock.Mock(return_value='new')
+        # 他のリクエストが新しいバージョンを計算中: 前のバージョンの値を返し、自分では計算しない
+        self.assertEqual(get_or_compute(None, 'stale_value', compute, version=2), 'old')
+        compute.assert_not_called()
+        self.assertEqual(cache_counters(['stale_value'])['stale_value']['stale'], 1)
+
+        dataversion.release_lock(key, token)
+        self.assertEqual(get_or_compute(None, 'stale_value', compute, version=2), 'new')
+        compute.assert_called_once()
+
+    def test_early_refresh_depends_on_compute_time(self):
+        now = time.time()
+        with mock.patch.object(dataversion.random, 'random', return_value=0.5):
+            # 期限まで10秒: 計算に1ミリ秒なら有効、30秒かかる値は早めに再計算する
+            self.assertTrue(dataversion._is_fresh((1, 'v', now + 10, 0.001, None), now))
+            self.assertFalse(dataversion._is_fresh((1, 'v', now + 10, 30.0, None), now))
+            self.assertFalse(dataversion._is_fresh((1, 'v', now - 1, 0.0, None), now))
+
+        get_or_compute(None, 'early_refresh', lambda: 'first', version=1)
+        with mock.patch.object(dataversion, '_is_fresh', return_value=False):
+            self.assertEqual(get_or_compute(None, 'early_refresh', lambda: 'second', version=1), 'second')
+        self.assertEqual(cache_counters(['early_refresh'])['early_refresh']['early'], 1)
+
+    def test_version_is_bumped_on_commit(self):
+        alice = User.objects.create_user('alice')
+        before = get_data_version(alice.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                notify_comments_changed(alice.pk)
+                # コミットまでは古いバージョンのまま（ロールバックされる変更でキャッシュを捨てない）
+                self.assertEqual(get_data_version(alice.pk), before)
+        self.assertNotEqual(get_data_version(alice.pk), before)
+
+
+class TierCacheTests(AnalyticsTestCase):
+    """2段キャッシュ: L1のLRU・L1にない場合のL2からの読み込み・大きな値の内容ハッシュでの共有"""
+
+    def test_local_cache_evicts_least_recently_used(self):
+        cache = tiercache.LocalCache(2)
+        cache.set('a', (1, 'A', 0, 0, None))
+        cache.set('b', (1, 'B', 0, 0, None))
+        cache.get('a')
+        cache.set('c', (1, 'C', 0, 0, None))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key)[1] for key in ('a', 'c')], ['A', 'C'])
+
+    def test_l1_miss_falls_through_to_l2(self):
+        tiercache.store_entry('small', 7, {'total': 3}, time.time() + 60, 0.1, 120)
+        local_cache.clear()
+        self.assertIsNone(tiercache.local_entry('small'))
+        entry = tiercache.load_entry('small')
+        self.assertEqual(entry[:2], (7, {'total': 3}))
+        # 読み込んだエントリはL1に入る
+        self.assertEqual(tiercache.local_entry('small'), entry)
+
+    def test_large_values_share_one_blob(self):
+        value = {'points': list(range(tiercache.BLOB_MIN_BYTES))}
+        first = tiercache.store_entry('graph_owner_1', 1, value, time.time() + 60, 0.1, 120)
+        second = tiercache.store_entry('graph_owner_2', 1, dict(value), time.time() + 60, 0.1, 120)
+        self.assertIsNotNone(first[4])
+        self.assertEqual(first[4], second[4])
+        # L2のエントリは値を持たず、同じblobを参照する
+        shared = tiercache.shared_cache()
+        self.assertIsNone(shared.get('graph_owner_1')[1])
+        self.assertIsNotNone(shared.get(tiercache.blob_key(first[4])))
+        local_cache.clear()
+        loaded = [tiercache.load_entry(key)[1] for key in ('graph_owner_1', 'graph_owner_2')]
+        self.assertEqual(loaded[0], value)
+        self.assertIs(loaded[0], loaded[1])
+
+    def test_dashboard_cache_stats_reports_hits_and_misses(self):
+        dataversion.flush_counters()
+        tiercache.shared_cache().clear()
+        get_or_compute(None, 'dashboard_summary', lambda: 'summary')
+        get_or_compute(None, 'dashboard_summary', lambda: 'summary')
+        get_or_compute(None, 'dashboard_summary', lambda: 'summary')
+
+        self.client.force_login(User.objects.create_user('viewer'))
+        self.assertEqual(self.client.get(reverse('dashboard_cache_stats')).status_code, 404)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        counters = self.client.get(reverse('dashboard_cache_stats')).json()['counters']
+        self.assertEqual(set(counters), {'dashboard_summary', 'graph_data', 'cluster_data'})
+        self.assertEqual((counters['dashboard_summary']['miss'], counters['dashboard_summary']['hit']), (1, 2))
+
+
+class RollupTests(AnalyticsTestCase):
+    """動画・日付ごとの集計行が、インポート・更新・削除の後もコメントから集計し直した値と一致する"""
+
+    rows = [
+        ('v1', 'a', '一日目のコメント', 'x', 3, 1, '2024-01-01T10:00:00Z'),
+        ('v1', 'b', '一日目のもう一つ', 'y', 5, 0, '2024-01-01T12:00:00Z'),
+        ('v1', 'c', '二日目のコメント', 'z', 1, 2, '2024-01-02T10:00:00Z'),
+        ('v2', 'a', '別の動画', 'x', 7, 4, '2024-01-01T10:00:00Z'),
+        ('v2', 'd', '投稿日時なし', 'x', 9, 9, ''),
+    ]
+
+    def assert_rollups_match(self):
+        comments = YouTubeComment.objects.filter(created_at__isnull=False)
+        keys = set(comments.values_list('owner_id', 'video_id', 'created_at__date').distinct())
+        rollups = {(r.owner_id, r.video_id, r.day): r for r in EngagementRollup.objects.all()}
+        self.assertEqual(set(rollups), keys)
+        for (owner_id, video_id, day), rollup in rollups.items():
+            expected = comments.filter(owner_id=owner_id, video_id=video_id, created_at__date=day).aggregate(
+                comment_count=Count('id'), like_sum=Sum('like_count'),
+                reply_sum=Sum('reply_count'), engagement_sum=Sum('engagement_score'),
+            )
+            actual = {field: getattr(rollup, field) for field in expected}
+            self.assertEqual(actual, expected, (owner_id, video_id, day))
+
+    def test_rollups_follow_imports_and_deletes(self):
+        alice = User.objects.create_user('alice')
+        with self.captureOnCommitCallbacks(execute=True):
+            import_csv_file(csv_upload(self.rows), batch_size=2)
+            import_csv_file(csv_upload(self.rows[:3]), owner=alice)
+        self.assertEqual(EngagementRollup.objects.count(), 5)
+        self.assert_rollups_match()
+
+        # upsert でカウントが変わった行
+        changed = [row[:4] + (100, 50) + row[6:] for row in self.rows[:2]]
+        with self.captureOnCommitCallbacks(execute=True):
+            import_csv_file(csv_upload(changed), upsert=True)
+        self.assert_rollups_match()
+
+        # 1件ずつの削除と、キーのコメントがすべてなくなる一括削除
+        with self.captureOnCommitCallbacks(execute=True):
+            YouTubeComment.objects.get(owner=None, video_id='v1', comment_id='a').delete()
+            YouTubeComment.objects.filter(owner=alice, video_id='v1', created_at__date=date(2024, 1, 1)).delete()
+        self.assert_rollups_match()
+        self.assertFalse(EngagementRollup.objects.filter(owner=alice, day=date(2024, 1, 1)).exists())
+
+
+class EngagementStatsTests(AnalyticsTestCase):
+    """SQLの集計が、以前の pandas での計算と同じ統計サマリー・分析結果になる"""
+
+    # (いいね数, 返信数)。平均ちょうどの行と、いいね数・返信数の最大が別のコメントになる行を含む
+    counts = [(0, 0), (2, 1), (4, 2), (4, 9), (10, 3), (3, 3), (1, 0), (6, 2)]
+
+    def pandas_summary(self, rows):
+        df = pd.DataFrame(rows, columns=['like_count', 'reply_count'])
+        stats = {
+            "total_comments": len(df),
+            "avg_likes": float(df["like_count"].mean()),
+            "avg_replies": float(df["reply_count"].mean()),
+            "max_likes": int(df["like_count"].max()),
+            "max_replies": int(df["reply_count"].max()),
+            "total_likes": int(df["like_count"].sum()),
+            "total_replies": int(df["reply_count"].sum()),
+        }
+        high = df[(df["like_count"] > stats["avg_likes"]) & (df["reply_count"] > stats["avg_replies"])]
+        low = df[(df["like_count"] < stats["avg_likes"]) & (df["reply_count"] < stats["avg_replies"])]
+        top = df.nlargest(1, "like_count").iloc[0]
+        analysis = {
+            "high_engagement_count": len(high),
+            "low_engagement_count": len(low),
+            "engagement_ratio": round(len(high) / len(df) * 100, 1),
+            "top_comment_likes": int(df.nlargest(1, "like_count")["like_count"].iloc[0]),
+            "top_comment_replies": int(df.nlargest(1, "reply_count")["reply_count"].iloc[0]),
+            "top_liked_comment_replies": int(top["reply_count"]),
+        }
+        return stats, analysis
+
+    def test_matches_pandas(self):
+        alice = User.objects.create_user('alice')
+        for likes, replies in self.counts:
+            self.make_comment(owner=alice, like_count=likes, reply_count=replies)
+        # 他の所有者のコメントは集計に入らない
+        self.make_comment(like_count=100, reply_count=100)
+
+        with self.assertNumQueries(1):
+            stats, analysis = engagement_stats(YouTubeComment.objects.filter(owner=alice))
+        expected_stats, expected_analysis = self.pandas_summary(self.counts)
+        self.assertEqual(stats, expected_stats)
+        self.assertEqual(analysis, expected_analysis)
+
+    def test_empty(self):
+        self.assertEqual(engagement_stats(YouTubeComment.objects.none()), (None, None))
+
+
+class EmbeddingCodecTests(SimpleTestCase):
+    """埋め込みのバイナリ形式: 保存した値を同じベクトルに戻せる"""
+
+    vector = [0.5, -1.25, 2.0, 0.0]
+
+    def test_round_trip_per_dtype(self):
+        for dtype, places in [('float32', 6), ('float16', 3), ('int8', 1)]:
+            with self.subTest(dtype=dtype):
+                blob = encode_embedding(self.vector, dtype=dtype, dim=0)
+                self.assertEqual(embedding_info(blob), (dtype, 4))
+                np.testing.assert_almost_equal(decode_embedding(blob), self.vector, decimal=places)
+
+    def test_text_forms_and_matrix(self):
+        for text in ['[0.5, -1.25, 2.0, 0.0]', '0.5,-1.25,2.0,0.0', '0.5 -1.25 2 0']:
+            self.assertEqual(encode_embedding(text, dtype='float32', dim=0), encode_embedding(self.vector, dtype='float32', dim=0))
+        self.assertIsNone(encode_embedding(''))
+        with self.assertRaises(ValueError):
+            encode_embedding(self.vector, dtype='float32', dim=3)
+        blob = encode_embedding(self.vector, dtype='float32', dim=0)
+        matrix = decode_matrix([blob, None, blob])
+        np.testing.assert_array_equal(matrix, [self.vector, [0, 0, 0, 0], self.vector])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class EmbeddingMigrationTests(TransactionTestCase):
+    """0012: テキストの埋め込みをバイナリに変換し、逆方向ではテキストに戻す"""
+
+    before = [('myapp', '0011_clusteringresult_model_state')]
+    after = [('myapp', '0012_youtubecomment_embedding_binary')]
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_text_embeddings_are_converted(self):
+        apps = self.migrate(self.before)
+        Comment = apps.get_model('myapp', 'YouTubeComment')
+        texts = {'json': '[0.5, -1.25, 2.0]', 'plain': '0.5 -1.25 2', 'empty': '', 'broken': '[1, "x"]'}
+        for comment_id, embedding in texts.items():
+            Comment.objects.create(video_id='v1', comment_id=comment_id, comment_text='本文', embedding=embedding)
+
+        apps = self.migrate(self.after)
+        Comment = apps.get_model('myapp', 'YouTubeComment')
+        stored = dict(Comment.objects.values_list('comment_id', 'embedding'))
+        # マイグレーション内のコーデックの結果は、アプリのコーデック（float32）と同じバイト列
+        expected = encode_embedding([0.5, -1.25, 2.0], dtype='float32', dim=0)
+        self.assertEqual(bytes(stored['json']), expected)
+        self.assertEqual(bytes(stored['plain']), expected)
+        self.assertIsNone(stored['empty'])
+        self.assertIsNone(stored['broken'])
+
+        apps = self.migrate(self.before)
+        Comment = apps.get_model('myapp', 'YouTubeComment')
+        restored = dict(Comment.objects.values_list('comment_id', 'embedding'))
+        self.assertEqual(json.loads(restored['json']), [0.5, -1.25, 2.0])
+        self.assertIsNone(restored['broken'])
+
+
+class IncrementalClusteringTests(AnalyticsTestCase):
+    """クラスタリング: 少しの追加は前回の学習状態に追加学習し、ドリフトが大きい場合は全体を再学習する"""
+
+    themes = {
+        'music': ['guitar', 'melody', 'song', 'chorus', 'lyrics', 'drums', 'bass', 'piano'],
+        'cooking': ['recipe', 'garlic', 'onion', 'oven', 'pasta', 'sauce', 'salt', 'butter'],
+        'travel': ['flight', 'hotel', 'beach', 'passport', 'train', 'island', 'museum', 'tour'],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+
+    def add_comments(self, theme, count, start=0):
+        words = self.themes[theme]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(start, start + count):
+                text = ' '.join(words[(i + j) % len(words)] for j in range(4)) + f' {theme}{i}'
+                self.make_comment(self.alice, comment_text=text)
+
+    def cluster(self):
+        return compute_clustering(self.alice.pk, n_clusters=3)
+
+    def test_small_append_is_incremental(self):
+        for theme in self.themes:
+            self.add_comments(theme, 12)
+        first = self.cluster()
+        self.assertEqual(first.mode, 'full')
+
+        self.add_comments('music', 2, start=12)
+        second = self.cluster()
+        self.assertEqual(second.status, second.STATUS_DONE)
+        self.assertEqual(second.mode, 'incremental')
+        self.assertLessEqual(second.drift, 0.5)
+        self.assertEqual(sum(second.payload['weights']), 38)
+
+    def test_large_drift_refits(self):
+        for theme in ('music', 'cooking'):
+            self.add_comments(theme, 15)
+        self.assertEqual(self.cluster().mode, 'full')
+        # 学習時の語彙にない新しい話題のコメント（件数は再学習の割合 CLUSTERING_REFIT_FRACTION 未満）
+        self.add_comments('travel', 12)
+        with mock.patch('myapp.clustering.fit_clustering', wraps=clustering.fit_clustering) as fit:
+            result = self.cluster()
+        fit.assert_called_once()
+        self.assertEqual(result.mode, 'full')
+        self.assertIsNone(result.drift)
+
+
+class DashboardJSONTests(AnalyticsTestCase):
+    """グラフ・クラスタのJSON: 列指向のデータと、ETagが一致する場合の304"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.client.force_login(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(6):
+                self.make_comment(self.alice, author='same' if i % 2 else f'author{i}', like_count=i, reply_count=1,
+                                  comment_text=f'コメント{i % 3}', created_at=f'2024-01-0{i + 1}T00:00:00Z')
+            self.make_comment(None, comment_text='他のスコープ')
+
+    def test_graph_data_shape_and_etag(self):
+        response = self.client.get(reverse('graph_data'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['graph_data']
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(sorted(data['likes']), [0, 1, 2, 3, 4, 5])
+        # 重複する投稿者・本文は一意な値と添字で返す
+        self.assertEqual(len(data['texts']), 3)
+        self.assertEqual([data['authors'][i] for i in data['author_index']].count('same'), 3)
+        for column in ('likes', 'replies', 'created_at', 'author_index', 'text_index'):
+            self.assertEqual(len(data[column]), 6, column)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('graph_data'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # コメントが変わるとETagも変わる
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_comment(self.alice)
+        response = self.client.get(reverse('graph_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['graph_data']['count'], 7)
+
+    def test_cluster_data_pending_then_etag(self):
+        response = self.client.get(reverse('cluster_data'))
+        self.assertEqual(response.json(), {'cluster_data': None, 'pending': True})
+
+        compute_clustering(self.alice.pk)
+        response = self.client.get(reverse('cluster_data'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['cluster_data']
+        self.assertEqual(len(data['x']), data['count'])
+        self.assertEqual(len(data['cluster_labels']), data['count'])
+        self.assertEqual(len(data['cluster_centers']), data['n_clusters'])
+        self.assertIsNotNone(response.json()['updated_at'])
+        self.assertEqual(self.client.get(reverse('cluster_data'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class CommentRowsJSONTests(AnalyticsTestCase):
+    """コメント行JSON: 選んだ列だけを返し、カーソルで前後のページへ移動できる"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(35):
+            self.make_comment(comment_text='長い本文' * 30 if i == 0 else f'コメント{i}', like_count=i,
+                              created_at=datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=i))
+
+    def get(self, **params):
+        response = self.client.get(reverse('comment_rows'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_selected_fields(self):
+        data = self.get(fields='likes,unknown,text,likes', limit=10)
+        # 先頭は常に id。未知の列・重複は無視する
+        self.assertEqual(data['fields'], ['id', 'likes', 'text'])
+        self.assertEqual(len(data['rows']), 10)
+        self.assertTrue(all(len(row) == 3 for row in data['rows']))
+        self.assertEqual([row[1] for row in data['rows']], list(range(34, 24, -1)))
+        default = self.get(limit=50)
+        self.assertEqual(default['fields'], ['id', 'author', 'text', 'likes', 'replies', 'created', 'similar'])
+        text = dict((row[0], row[2]) for row in default['rows'])[YouTubeComment.objects.get(like_count=0).pk]
+        self.assertEqual(len(text), 80)
+        self.assertTrue(text.endswith('…'))
+
+    def test_cursor_pages(self):
+        first = self.get(fields='likes', limit=30)
+        self.assertIsNone(first['prev'])
+        self.assertIsNotNone(first['last'])
+        second = self.get(fields='likes', limit=30, cursor=first['next'])
+        self.assertEqual([row[1] for row in second['rows']], [4, 3, 2, 1, 0])
+        self.assertIsNone(second['next'])
+        self.assertIsNone(second['last'])
+        back = self.get(fields='likes', limit=30, cursor=second['prev'])
+        self.assertEqual(back['rows'], first['rows'])
+        # 最後のページは末尾から数えた30件（件数の足りないページにはしない）
+        last = self.get(fields='likes', limit=30, cursor=first['last'])
+        self.assertEqual([row[1] for row in last['rows']], list(range(29, -1, -1)))
+        self.assertIsNone(last['next'])
+        # 選択肢にない件数は既定の30件
+        self.assertEqual(len(self.get(fields='likes', limit=7)['rows']), 30)
+
+
+class ImportCountTests(AnalyticsTestCase):
+    """インポート件数: 実際に書き込んだ件数と、重複でスキップした件数を分けて数える"""
+
+    rows = [
+        ('v1', 'a', '最初のコメント', 'x', 1, 0, '2024-01-01T00:00:00Z'),
+        ('v1', 'b', '二番目のコメント', 'y', 2, 0, '2024-01-02T00:00:00Z'),
+        ('v2', 'a', '別の動画のコメント', 'z', 3, 1, '2024-01-02T00:00:00Z'),
+    ]
+
+    def test_reimport_skips_duplicates(self):
+        first = import_csv_file(csv_upload(self.rows))
+        self.assertEqual((first.created, first.updated, first.skipped), (3, 0, 0))
+
+        second = import_csv_file(csv_upload(self.rows + [('v2', 'c', '新しいコメント', 'w', 0, 0, '')]))
+        self.assertEqual((second.count, second.created, second.skipped), (4, 1, 3))
+        self.assertTrue(second.summary().startswith('1 件のコメントをインポートしました'))
+        self.assertIn('重複 3 件をスキップ', second.summary())
+        self.assertEqual(YouTubeComment.objects.count(), 4)
+
+    def test_rows_without_comment_id_are_always_created(self):
+        rows = [('v1', '', '同じ本文', 'x', 0, 0, '')] * 2
+        import_csv_file(csv_upload(rows))
+        result = import_csv_file(csv_upload(rows))
+        self.assertEqual((result.created, result.skipped), (2, 0))
+        self.assertEqual(YouTubeComment.objects.count(), 4)
+
+    def test_upsert_updates_counts(self):
+        owner = User.objects.create_user('alice')
+        import_csv_file(csv_upload(self.rows), owner=owner)
+        changed = [row[:4] + (10, 5) + row[6:] for row in self.rows[:2]]
+        result = import_csv_file(csv_upload(changed), owner=owner, upsert=True)
+        self.assertEqual((result.created, result.updated, result.skipped), (0, 2, 0))
+        self.assertEqual(
+            sorted(YouTubeComment.objects.values_list('comment_id', 'video_id', 'like_count', 'reply_count')),
+            [('a', 'v1', 10, 5), ('a', 'v2', 3, 1), ('b', 'v1', 10, 5)],
+        )
+
+    def bad_csv_after_full_batch(self):
+        # 1バッチ（DEFAULT_BATCH_SIZE 件）をコミットした後の行で like_count が数値でない
+        rows = [('v1', f'ok{i}', '問題のない行', 'x', 1, 0, '') for i in range(DEFAULT_BATCH_SIZE)]
+        return csv_upload(rows + [('v1', 'bad', '壊れた行', 'x', 'many', 0, '')])
+
+    def test_csv_views_report_partial_import(self):
+        admin_user = User.objects.create_superuser('admin', password='pw')
+        bob = User.objects.create_user('bob')
+        self.client.force_login(admin_user)
+        for url, owner in [(reverse('import_csv'), admin_user), ('/admin/myapp/youtubecomment/import-csv/', bob)]:
+            with self.subTest(url=url):
+                data = {'csv_file': self.bad_csv_after_full_batch()}
+                if owner != admin_user:
+                    data['owner'] = owner.pk
+                response = self.client.post(url, data, follow=True)
+                self.assertEqual(response.status_code, 200)
+                messages = [str(message) for message in response.context['messages']]
+                self.assertEqual(len(messages), 1)
+                self.assertIn("invalid literal for int() with base 10: 'many'", messages[0])
+                self.assertIn(f'{DEFAULT_BATCH_SIZE} 件はインポート済みです', messages[0])
+                self.assertEqual(YouTubeComment.objects.filter(owner=owner).count(), DEFAULT_BATCH_SIZE)
+
+    def test_same_keys_for_another_owner_are_not_duplicates(self):
+        import_csv_file(csv_upload(self.rows))
+        result = import_csv_file(csv_upload(self.rows), owner=User.objects.create_user('bob'))
+        self.assertEqual((result.created, result.skipped), (3, 0))
+
+
+class JSONStreamingTests(AnalyticsTestCase):
+    """JSONインポート: 配列 / {"comments": [...]} / NDJSON を小さいチャンクで読んでも同じ結果になる"""
+
+    items = [
+        {'video_id': 'v1', 'comment_id': 'a', 'comment_text': 'こんにちは', 'like_count': 12345},
+        {'video_id': 'v1', 'comment_id': 'b', 'comment_text': '"引用" と \\ を含む', 'author': 'x'},
+    ]
+
+    def stream(self, text, **kwargs):
+        kwargs.setdefault('chunk_size', 7)
+        return list(iter_json_items(io.BytesIO(text.encode('utf-8')), **kwargs))
+
+    def test_supported_shapes(self):
+        shapes = [
+            json.dumps(self.items, ensure_ascii=False),
+            json.dumps({'video': 'v1', 'comments': self.items, 'total': 2}, ensure_ascii=False),
+            '\n'.join(json.dumps(item, ensure_ascii=False) for item in self.items) + '\n',
+        ]
+        for text in shapes:
+            with self.subTest(text=text[:20]):
+                self.assertEqual(self.stream(text), self.items)
+
+    def test_values_split_across_chunks(self):
+        # 数値・文字列・マルチバイト文字（UTF-8で3バイト）が2バイトのチャンク境界をまたぐ
+        stream = _JSONStream(io.BytesIO('\ufeff12345 "いいね" [1, 2]'.encode('utf-8')), chunk_size=2)
+        self.assertEqual(stream.decode_value(), 12345)
+        self.assertEqual(stream.decode_value(), 'いいね')
+        self.assertEqual(list(stream.iter_array()), [1, 2])
+        self.assertEqual(stream.peek(), '')
+        # 処理済みの部分は捨てるため、バッファは値1つ分+チャンク程度に収まる
+        self.assertLessEqual(len(stream.buffer), 8)
+
+    def test_objects_without_comments_yield_nothing(self):
+        for text in ['{}', '{"video": "v1", "total": 0}', '', '[]']:
+            with self.subTest(text=text):
+                self.assertEqual(self.stream(text), [])
+        result = import_json_file(SimpleUploadedFile('empty.json', b'{}'))
+        self.assertEqual((result.count, result.written), (0, 0))
+        self.assertFalse(YouTubeComment.objects.exists())
+
+    def test_malformed_value_fails_without_reading_to_eof(self):
+        fileobj = io.BytesIO(('[{"comment_id": "a", "comment_text": ' + 'x' * 10000 + '}]').encode('utf-8'))
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_items(fileobj, chunk_size=16, max_value_chars=64))
+        # 上限を超えた時点で止まり、ファイルの末尾までは読まない
+        self.assertLess(fileobj.tell(), 200)
+
+    def test_partial_import_reports_committed_rows(self):
+        text = '\n'.join(json.dumps(item) for item in self.items) + '\n{"comment_id": '
+        with self.assertRaises(ImportInterrupted) as raised:
+            import_json_file(SimpleUploadedFile('broken.json', text.encode('utf-8')), batch_size=1)
+        self.assertEqual(raised.exception.result.written, 2)
+        self.assertIsInstance(raised.exception.error, json.JSONDecodeError)
+        self.assertEqual(YouTubeComment.objects.count(), 2)
+
+    def test_view_reports_partial_count(self):
+        text = '\n'.join(json.dumps(item) for item in self.items) + '\n{"comment_id": '
+        upload = SimpleUploadedFile('broken.json', text.encode('utf-8'))
+        # 1件ずつコミットさせて、エラーの手前までが書き込まれた状態を作る
+        with mock.patch('myapp.views.import_json_file', wraps=lambda f, **kw: import_json_file(f, batch_size=1, **kw)):
+            response = self.client.post(reverse('import_json'), {'json_file': upload}, follow=True)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith('JSONファイルの形式が正しくありません（'))
+        self.assertTrue(messages[0].endswith('エラーの手前までの 2 件はインポート済みです。'))
+
+
+class ImportCommandTests(AnalyticsTestCase):
+    """manage.py import_comments: ファイルの行が所有者付きで書き込まれ、プロセスプールでも同じ結果になる"""
+
+    rows = ImportCountTests.rows
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = Path(self.tmpdir) / name
+        path.write_bytes(content)
+        return str(path)
+
+    def import_comments(self, *paths, **options):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_comments', *paths, stdout=out, **options)
+        return out.getvalue()
+
+    def stored(self):
+        return sorted(YouTubeComment.objects.filter(owner=self.alice).values_list(
+            'video_id', 'comment_id', 'comment_text', 'like_count', 'reply_count', 'tokens',
+        ))
+
+    def test_imports_csv_and_ndjson(self):
+        csv_path = self.write_file('comments.csv', csv_upload(self.rows).read())
+        items = [dict(item, video_id='v3') for item in JSONStreamingTests.items]
+        ndjson = '\n'.join(json.dumps(item, ensure_ascii=False) for item in items)
+        ndjson_path = self.write_file('comments.ndjson', ndjson.encode('utf-8'))
+
+        output = self.import_comments(csv_path, ndjson_path, owner='alice', workers=1, batch_size=2)
+        self.assertIn('合計: 5 件のコメントをインポートしました', output)
+        stored = self.stored()
+        self.assertEqual([row[:5] for row in stored], [
+            ('v1', 'a', '最初のコメント', 1, 0),
+            ('v1', 'b', '二番目のコメント', 2, 0),
+            ('v2', 'a', '別の動画のコメント', 3, 1),
+            ('v3', 'a', 'こんにちは', 12345, 0),
+            ('v3', 'b', '"引用" と \\ を含む', 0, 0),
+        ])
+        # 正規化テキストとトークンはインポート時に保存される
+        self.assertTrue(all(row[5] is not None for row in stored))
+        self.assertFalse(YouTubeComment.objects.filter(owner=None).exists())
+
+    def test_process_pool_matches_in_process(self):
+        path = self.write_file('comments.csv', csv_upload(self.rows).read())
+        self.import_comments(path, owner='alice', workers=1, batch_size=1)
+        expected = self.stored()
+        YouTubeComment.objects.all().delete()
+        self.import_comments(path, owner='alice', workers=2, batch_size=1)
+        self.assertEqual(self.stored(), expected)
+
+    def test_upsert_and_duplicates(self):
+        path = self.write_file('comments.csv', csv_upload(self.rows).read())
+        self.import_comments(path, owner='alice', workers=1)
+        output = self.import_comments(path, owner='alice', workers=1)
+        self.assertIn('重複 3 件をスキップ', output)
+
+        changed = [row[:4] + (10, 5) + row[6:] for row in self.rows[:2]]
+        self.import_comments(self.write_file('changed.csv', csv_upload(changed).read()), owner='alice', workers=1, upsert=True)
+        self.assertEqual(
+            sorted(YouTubeComment.objects.values_list('video_id', 'comment_id', 'like_count', 'reply_count')),
+            [('v1', 'a', 10, 5), ('v1', 'b', 10, 5), ('v2', 'a', 3, 1)],
+        )
+
+    def test_unknown_owner_or_missing_file_writes_nothing(self):
+        path = self.write_file('comments.csv', csv_upload(self.rows).read())
+        self.assertIn('ユーザー "nobody" が見つかりません', self.import_comments(path, owner='nobody', workers=1))
+        self.assertIn('ファイルが見つかりません', self.import_comments(path, path + '.missing', workers=1))
+        self.assertFalse(YouTubeComment.objects.exists())
+
+
+class BackfillTextFeaturesTests(AnalyticsTestCase):
+    """manage.py backfill_text_features: 未計算のコメントに正規化テキストとトークンを保存する"""
+
+    texts = ['今日の配信は最高でした！', 'https://example.com 音質が良いです', '字幕をつけてほしい', 'また見ます']
+
+    def backfill(self, **options):
+        out = io.StringIO()
+        call_command('backfill_text_features', stdout=out, **options)
+        return out.getvalue()
+
+    def test_fills_missing_features(self):
+        comments = [self.make_comment(comment_text=text) for text in self.texts]
+        # 移行前の行を再現（保存時の計算を取り消す）
+        YouTubeComment.objects.filter(pk__in=[c.pk for c in comments[:3]]).update(normalized_text='', tokens=None)
+        YouTubeComment.objects.filter(pk=comments[3].pk).update(normalized_text='古い値', tokens=['古い'])
+
+        output = self.backfill(batch_size=2)
+        self.assertIn('対象: 3 件', output)
+        self.assertIn('3 件のコメントを更新しました。', output)
+        stored = list(YouTubeComment.objects.order_by('id').values_list('normalized_text', 'tokens'))
+        self.assertEqual(stored[:3], [nlp.text_features(text) for text in self.texts[:3]])
+        # 計算済みの行は --all を指定しない限りそのまま
+        self.assertEqual(stored[3], ('古い値', ['古い']))
+
+        self.assertIn('4 件のコメントを更新しました。', self.backfill(all=True))
+        self.assertEqual(
+            list(YouTubeComment.objects.order_by('id').values_list('normalized_text', 'tokens')),
+            [nlp.text_features(text) for text in self.texts],
+        )
+
+
+class KSelectionTests(SimpleTestCase):
+    """kの選択: プロセスプールで評価しても同じプロセスで順に評価した場合と同じ結果になる"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = np.array([[0, 0, 0], [5, 5, 5], [0, 5, 0]], dtype=np.float64)
+        self.points = np.vstack([center + rng.normal(scale=0.3, size=(40, 3)) for center in centers])
+
+    def test_process_pool_matches_serial(self):
+        candidates = kselection.candidate_ks(len(self.points), k_max=5)
+        serial = kselection.select_k(self.points, candidates, max_workers=1)
+        # 閾値を下げてプロセスプール（forkserver / spawn、ワーカーごとに1スレッド）を通す
+        with mock.patch.object(kselection, 'ProcessPoolExecutor', wraps=kselection.ProcessPoolExecutor) as pool:
+            parallel = kselection.select_k(self.points, candidates, max_workers=2, parallel_min_points=10)
+        pool.assert_called_once()
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 2)
+        self.assertEqual(parallel[0], 3)
+        self.assertEqual(parallel, serial)
+
+    def test_small_inputs_stay_in_process(self):
+        with mock.patch.object(kselection, 'ProcessPoolExecutor') as pool:
+            k, scores = kselection.select_k(self.points, [2, 3, 4], max_workers=4)
+        pool.assert_not_called()
+        self.assertEqual((k, sorted(scores)), (3, [2, 3, 4]))
+
+    @override_settings(CLUSTERING_CPU_BUDGET=2)
+    def test_dashboard_threshold_setting(self):
+        # ダッシュボードのk選択は設定の閾値で select_k に渡し、既定の件数ではプールを使わない
+        for threshold, expected_calls in [(50000, 0), (10, 1)]:
+            with self.subTest(threshold=threshold), self.settings(CLUSTERING_K_PARALLEL_MIN_POINTS=threshold), \
+                    mock.patch.object(kselection, 'ProcessPoolExecutor', wraps=kselection.ProcessPoolExecutor) as pool:
+                k, scores = clustering.choose_cluster_count(self.points)
+            self.assertEqual(pool.call_count, expected_calls)
+            self.assertEqual(k, 3)
+
+
+class TokenizerTests(SimpleTestCase):
+    """形態素解析: トークナイザはスレッドごとに1つで、同じ本文の解析は1回だけ"""
+
+    def setUp(self):
+        nlp.token_cache.clear()
+
+    def test_tokenizer_is_per_thread(self):
+        if not nlp.JANOME_AVAILABLE:
+            self.skipTest('janome is not installed')
+        tokenizers = []
+        thread = threading.Thread(target=lambda: tokenizers.append(nlp.get_tokenizer()))
+        thread.start()
+        thread.join()
+        self.assertIs(nlp.get_tokenizer(), nlp.get_tokenizer())
+        self.assertIsNot(tokenizers[0], nlp.get_tokenizer())
+
+    def test_many_analyzes_duplicates_once(self):
+        texts = ['動画がとても面白かった', '', '動画がとても面白かった', '音楽が素晴らしい']
+        with mock.patch.object(nlp, '_tokenize', wraps=nlp._tokenize) as tokenize:
+            words = nlp.extract_japanese_words_many(texts)
+        self.assertEqual(tokenize.call_count, 2)
+        self.assertEqual(words[0], words[2])
+        self.assertEqual(words[1], [])
+        self.assertEqual(words, [nlp.extract_japanese_words(text) for text in texts])
+
+
+class KeysetPaginationTests(AnalyticsTestCase):
+    """キーセットページネーション: カーソルで前後に移動しても行の抜け・重複がない"""
+
+    def setUp(self):
+        super().setUp()
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        # 同じ投稿日時の行（idで並ぶ）と投稿日時のない行（最後に並ぶ）を含める
+        for i in range(11):
+            self.make_comment(created_at=base + timedelta(hours=i // 2))
+        for _ in range(3):
+            self.make_comment(created_at=None)
+        self.queryset = YouTubeComment.objects.all()
+        dated = YouTubeComment.objects.exclude(created_at=None).order_by('-created_at', '-id')
+        undated = YouTubeComment.objects.filter(created_at=None).order_by('-id')
+        self.expected = [c.pk for c in dated] + [c.pk for c in undated]
+
+    def walk_forward(self, per_page):
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(self.queryset, cursor, per_page)
+            pages.append([c.pk for c in page])
+            if not page.has_next():
+                return pages, page
+            cursor = page.next_cursor
+
+    def test_cursor_round_trip(self):
+        created_at = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(NEXT, created_at, 5)), (NEXT, (created_at, 5)))
+        self.assertEqual(decode_cursor(encode_cursor(NEXT, None, 5)), (NEXT, (None, 5)))
+        for broken in ['', 'not-a-cursor', encode_cursor('sideways', created_at, 5)]:
+            self.assertEqual(decode_cursor(broken), (NEXT, None))
+
+    def test_forward_and_back_visit_every_row_once(self):
+        for per_page in (1, 3, 4, 20):
+            with self.subTest(per_page=per_page):
+                pages, last = self.walk_forward(per_page)
+                self.assertEqual(sum(pages, []), self.expected)
+                # 最後のページから前のカーソルで戻ると、同じページを逆順にたどる
+                back, page = [[c.pk for c in last]], last
+                while page.has_previous():
+                    page = keyset_page(self.queryset, page.previous_cursor, per_page)
+                    back.append([c.pk for c in page])
+                self.assertEqual(back[::-1], pages)
+
+    def test_last_cursor_returns_last_page(self):
+        page = keyset_page(self.queryset, LAST_CURSOR, 4)
+        self.assertEqual([c.pk for c in page], self.expected[-4:])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_paginator_counts_only_on_demand(self):
+        # 先頭ページは投稿日時ありの区間だけで埋まるため1クエリ（COUNTなし）
+        with self.assertNumQueries(1):
+            page = keyset_page(self.queryset, None, 4)
+        with self.assertNumQueries(1):
+            self.assertEqual((page.paginator.count, page.paginator.num_pages), (14, 4))
+        self.assertEqual(list(page.paginator.page_range), [1, 2, 3, 4])
+
+
+def load_cluster_script():
+    """scripts/cluster_3d.py をモジュールとして読み込む（パッケージではないため）"""
+    spec = importlib.util.spec_from_file_location('cluster_3d', Path(settings.BASE_DIR) / 'scripts' / 'cluster_3d.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ClusterScriptTests(SimpleTestCase):
+    """scripts/cluster_3d.py: サンプルCSVでの出力が退化していない・安全にHTMLへ埋め込まれる"""
+
+    sample_csv = Path(settings.BASE_DIR) / 'youtube_comments_200.csv'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.script = load_cluster_script()
+
+    def run_script(self, *args):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        output = Path(output_dir) / 'out.html'
+        argv = ['cluster_3d.py', '--output', str(output), '--workers', '1', *args]
+        with mock.patch('sys.argv', argv), contextlib.redirect_stdout(io.StringIO()):
+            self.script.main()
+        return output
+
+    def test_streaming_projection_keeps_short_comments(self):
+        _, texts = next(self.script.iter_text_chunks(self.sample_csv, 'comment_text', 1000))
+        projected = self.script.StreamingReducer().project(texts)
+        self.assertFalse((~projected.any(axis=1)).any())
+
+    def test_streaming_clusters_are_not_degenerate(self):
+        output = self.run_script('--input', str(self.sample_csv), '--streaming', '--clusters', '4')
+        labels = pd.read_csv(output.with_suffix('.labels.csv'))
+        self.assertEqual(len(labels), 200)
+        self.assertGreater(labels['cluster'].nunique(), 1)
+        for axis in 'xyz':
+            self.assertGreater(labels[axis].abs().max(), 0, axis)
+
+
+    def test_compact_html_escapes_comment_text(self):
+        payload = '</script><script>alert(1)</script><!-- & '
+        comments = [payload, 'ふつうのコメント', 'a/b', 'もう一つ']
+        vectors_3d = np.arange(12, dtype=np.float32).reshape(4, 3)
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        output = Path(output_dir) / 'compact.html'
+        self.script.create_compact_visualization(vectors_3d, [0, 1, 0, 1], comments, str(output))
+        html = output.read_text(encoding='utf-8')
+        self.assertNotIn('<script>alert(1)', html)
+        self.assertEqual(html.count('</script>'), html.count('<script'))
+        # ブラウザ側で元の本文に戻る
+        traces = json.loads(html.split('var traces = ', 1)[1].split(';\n', 1)[0])
+        self.assertEqual(sorted(text for trace in traces for text in trace['text']), sorted(comments))
+
+
+class SimilarityTests(AnalyticsTestCase):
+    """類似コメント検索: インデックスの作成・更新はリクエスト外。変更された埋め込みも反映する"""
+
+    dim = 8
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('alice')
+        rng = np.random.default_rng(0)
+        self.comments = []
+        for i in range(40):
+            comment = YouTubeComment(owner=self.owner, video_id='v1', comment_id=f's{i}', comment_text=f'コメント{i}', author='a')
+            comment.set_embedding(rng.normal(size=self.dim))
+            comment.save()
+            self.comments.append(comment)
+
+    def nearest(self, vector, k=1):
+        return [pk for pk, _ in VectorIndex(self.owner.pk).search(vector, k=k)]
+
+    def test_search_without_index_does_not_build_it(self):
+        query = self.comments[0]
+        target = self.comments[1]
+        target.set_embedding(query.get_embedding() + 0.01)
+        target.save()
+        results = similar_comments(query, k=3)
+        self.assertEqual(results[0][0].pk, target.pk)
+        self.assertNotIn(query.pk, [c.pk for c, _ in results])
+        self.assertIsNone(VectorIndex(self.owner.pk).read_meta())
+
+    def test_other_owners_are_not_returned(self):
+        other = self.make_comment(User.objects.create_user('bob'))
+        other.set_embedding(self.comments[0].get_embedding())
+        other.save()
+        VectorIndex(self.owner.pk).rebuild()
+        self.assertNotIn(other.pk, [c.pk for c, _ in similar_comments(self.comments[0], k=10)])
+
+    def test_update_reembeds_changed_rows(self):
+        index = VectorIndex(self.owner.pk)
+        index.rebuild()
+        self.assertFalse(YouTubeComment.objects.filter(vector_indexed=False).exists())
+
+        # 既存行の埋め込みを変更・新しい行を追加・埋め込みを削除
+        changed = self.comments[5]
+        vector = np.ones(self.dim)
+        changed.set_embedding(vector)
+        changed.save()
+        added = YouTubeComment(owner=self.owner, video_id='v1', comment_id='new', comment_text='新規', author='a')
+        added.set_embedding(-vector)
+        added.save()
+        removed = self.comments[6]
+        removed_vector = removed.get_embedding()
+        removed.embedding = None
+        removed.save(update_fields=['embedding'])
+
+        meta = index.update()
+        self.assertEqual(meta['count'], 41)
+        self.assertEqual(self.nearest(vector), [changed.pk])
+        self.assertEqual(self.nearest(-vector), [added.pk])
+        self.assertNotEqual(self.nearest(removed_vector), [removed.pk])
+        self.assertFalse(YouTubeComment.objects.filter(vector_indexed=False).exists())
+
+    @override_settings(VECTOR_INDEX_IVF_MIN=20, VECTOR_INDEX_NPROBE=16)
+    def test_update_reembeds_changed_rows_with_ivf(self):
+        index = VectorIndex(self.owner.pk)
+        self.assertEqual(index.rebuild()['nlist'], 16)
+        changed = self.comments[3]
+        vector = np.arange(self.dim, dtype=float)
+        changed.set_embedding(vector)
+        changed.save()
+        index.update()
+        self.assertEqual(self.nearest(vector), [changed.pk])
+
+
+class DuplicateTests(AnalyticsTestCase):
+    """近似重複のグループ化は所有者ごと。クラスタリングでは重複を1点（件数の重み付き）にまとめる"""
+
+    texts = [
+        'この動画の編集は本当に素晴らしいと思います',
+        'この動画の編集は本当に素晴らしいと思います！',
+        'この動画の編集は本当に素晴らしいと思います!!',
+        '音楽の選曲がとても良くて最後まで楽しめました',
+        '説明がわかりやすくて初心者でも理解できました',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.alice_comments = [self.make_comment(self.alice, comment_text=text) for text in self.texts]
+        self.bob_comment = self.make_comment(self.bob, comment_text=self.texts[0])
+
+    def test_groups_near_duplicates_of_one_owner(self):
+        self.assertEqual(index_duplicates(owner_id=self.alice.pk, all_owners=False), 5)
+        canonical = self.alice_comments[0]
+        grouped = YouTubeComment.objects.filter(duplicate_of=canonical).values_list('pk', flat=True)
+        self.assertEqual(set(grouped), {c.pk for c in self.alice_comments[1:3]})
+        # 他の所有者のコメントは照合しない（同じ本文でも別のグループ）
+        self.bob_comment.refresh_from_db()
+        self.assertFalse(self.bob_comment.lsh_indexed)
+        index_duplicates()
+        self.bob_comment.refresh_from_db()
+        self.assertTrue(self.bob_comment.lsh_indexed)
+        self.assertIsNone(self.bob_comment.duplicate_of_id)
+
+    def test_clustering_collapses_duplicates_of_its_owner_only(self):
+        result = compute_clustering(self.alice.pk)
+        self.assertEqual(result.status, result.STATUS_DONE, result.error)
+        self.assertEqual(sorted(result.payload['weights']), [1, 1, 3])
+        self.assertEqual(result.comment_count, 5)
+        self.assertFalse(YouTubeComment.objects.filter(owner=self.bob, lsh_indexed=True).exists())
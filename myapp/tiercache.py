@@ -0,0 +1,110 @@
+"""
+ダッシュボード集計の2段キャッシュ
+L1: プロセス内の小さなLRU（大きな値を参照のたびにL2から読み込んで復元しない）
+L2: 全プロセスで共有するキャッシュ（settings.DASHBOARD_CACHE_ALIAS。既定はファイル、REDIS_URL があればRedis）
+
+大きな値は内容のハッシュをキーにL2へ1つだけ保存し、エントリからはハッシュで参照する
+（複数のワーカーや別のバージョンが同じ内容を計算しても、L2・L1とも1つを共有する）
+L1のエントリはデータバージョンと一緒に持ち、呼び出し側がバージョンを照合する（バージョンが上がれば次の参照でL2から読み直す）
+"""
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# これ以上の大きさ（pickle後のバイト数）の値は内容のハッシュで共有する
+BLOB_MIN_BYTES = 16 * 1024
+
+
+def shared_cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def blob_key(digest):
+    return f'blob_{digest}'
+
+
+class LocalCache:
+    """プロセス内のLRU: key -> (version, value, expires_at, duration, digest)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def find_value(self, digest):
+        """同じ内容（digest）の値を持つエントリがあればその値: (見つかったか, 値)"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry[4] == digest:
+                    return True, entry[1]
+        return False, None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalCache(getattr(settings, 'DASHBOARD_L1_MAX_ENTRIES', 64))
+
+
+def local_entry(key):
+    return local_cache.get(key)
+
+
+def load_entry(key):
+    """L2のエントリを読み込んでL1に入れる（ないか、参照先の値が消えていればNone）"""
+    cache = shared_cache()
+    stored = cache.get(key)
+    if stored is None or len(stored) != 5:
+        # 形式の異なる古いエントリは使わない
+        return None
+    version, value, expires_at, duration, digest = stored
+    if digest is not None:
+        found, value = local_cache.find_value(digest)
+        if not found:
+            data = cache.get(blob_key(digest))
+            if data is None:
+                return None
+            value = pickle.loads(data)
+    entry = (version, value, expires_at, duration, digest)
+    local_cache.set(key, entry)
+    return entry
+
+
+def store_entry(key, version, value, expires_at, duration, timeout):
+    """エントリをL2とL1に保存する（大きな値は内容のハッシュで共有）"""
+    cache = shared_cache()
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    digest = None
+    stored = value
+    if len(data) >= BLOB_MIN_BYTES:
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        # 同じ内容が保存済みなら書き込まずに期限だけ延ばす
+        if not cache.add(blob_key(digest), data, timeout) and not cache.touch(blob_key(digest), timeout):
+            cache.set(blob_key(digest), data, timeout)
+        found, existing = local_cache.find_value(digest)
+        if found:
+            value = existing
+        stored = None
+    cache.set(key, (version, stored, expires_at, duration, digest), timeout)
+    entry = (version, value, expires_at, duration, digest)
+    local_cache.set(key, entry)
+    return entry
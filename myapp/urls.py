@@ -5,6 +5,14 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("pricing/", views.pricing, name="pricing"),
     path("comments-table/", views.comments_table, name="comments_table"),
+    # コメントテーブルの行（JSON。ブラウザ側で描画）
+    path("comments/rows/", views.comment_rows_json, name="comment_rows"),
+    # ダッシュボードのグラフ用データ（ページ表示後に非同期で取得）
+    path("dashboard/graph-data/", views.graph_data_json, name="graph_data"),
+    path("dashboard/cluster-data/", views.cluster_data_json, name="cluster_data"),
+    # 集計キャッシュのヒット・ミス・古い値・待機の回数（管理者のみ）
+    path("dashboard/cache-stats/", views.dashboard_cache_stats, name="dashboard_cache_stats"),
+    path("comments/<int:pk>/similar/", views.similar_comments_json, name="similar_comments"),
     # CSV/JSONインポート
     path("import-csv/", views.import_csv, name="import_csv"),
     path("import-json/", views.import_json, name="import_json"),
@@ -0,0 +1,133 @@
+"""
+埋め込みベクトルのバイナリコーデック
+各ベクトルは「4バイトのヘッダ（形式・型・次元数）＋リトルエンディアンの値」で保存する
+インポート時（プロセスプールのワーカーを含む）にも使うため、Djangoには依存させない
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# 型コード -> 保存時のnumpy dtype（int8はベクトルごとのスケール付きで量子化）
+DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+    3: np.dtype('i1'),
+}
+DTYPE_CODES = {'float32': 1, 'float16': 2, 'int8': 3}
+
+# 保存時の型（float32 / float16 / int8）と宣言する次元数（0の場合は検証しない）
+EMBEDDING_DTYPE = os.environ.get('EMBEDDING_DTYPE', 'float32')
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', '0'))
+
+_HEADER = struct.Struct('<BBH')
+
+
+def parse_embedding(value):
+    """Parse an embedding from a list or its text form ("[0.1, 0.2]" or "0.1,0.2" / "0.1 0.2"); None if absent."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_embedding(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if not text or text == 'null':
+            return None
+        if text.startswith('['):
+            value = json.loads(text)
+        else:
+            value = text.replace(',', ' ').split()
+    array = np.asarray(value, dtype=np.float32).ravel()
+    return array if array.size else None
+
+
+def _record_dtype(code, dim):
+    """Structured dtype for one stored vector (int8 carries a float32 scale before the values)."""
+    fields = [('header', 'V4')]
+    if code == DTYPE_CODES['int8']:
+        fields.append(('scale', '<f4'))
+    fields.append(('values', DTYPES[code], (dim,)))
+    return np.dtype(fields)
+
+
+def encode_embedding(vector, dtype=None, dim=None):
+    """Pack a vector into bytes (float32 / float16 / int8-quantized); None stays None."""
+    vector = parse_embedding(vector)
+    if vector is None:
+        return None
+    dtype = dtype or EMBEDDING_DTYPE
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    dim = dim if dim is not None else EMBEDDING_DIM
+    if dim and vector.size != dim:
+        raise ValueError(f"Embedding has {vector.size} dimensions, expected {dim}")
+    if vector.size > 0xFFFF:
+        raise ValueError(f"Embedding has too many dimensions: {vector.size}")
+
+    code = DTYPE_CODES[dtype]
+    header = _HEADER.pack(FORMAT_VERSION, code, vector.size)
+    if dtype == 'int8':
+        # Symmetric per-vector quantization: value ~= int8 * scale
+        peak = float(np.max(np.abs(vector)))
+        scale = peak / 127 if peak else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype('i1')
+        return header + struct.pack('<f', scale) + quantized.tobytes()
+    return header + vector.astype(DTYPES[code]).tobytes()
+
+
+def embedding_info(blob):
+    """(dtype name, dimension) of a stored vector."""
+    version, code, dim = _HEADER.unpack_from(bytes(blob[:_HEADER.size]))
+    if version != FORMAT_VERSION or code not in DTYPES:
+        raise ValueError("Unknown embedding format")
+    return next(name for name, c in DTYPE_CODES.items() if c == code), dim
+
+
+def decode_embedding(blob):
+    """Unpack one stored vector into a float32 array."""
+    if blob is None:
+        return None
+    return decode_matrix([blob])[0]
+
+
+def decode_matrix(blobs, dim=None):
+    """
+    Decode stored vectors into one contiguous float32 matrix (n x dim) without per-row Python decoding.
+
+    All blobs must share a dtype and dimension; None entries become zero rows.
+    """
+    present = [blob for blob in blobs if blob is not None]
+    if not present:
+        return np.zeros((len(blobs), dim or 0), dtype=np.float32)
+    dtype_name, first_dim = embedding_info(present[0])
+    if dim is not None and dim != first_dim:
+        raise ValueError(f"Embedding has {first_dim} dimensions, expected {dim}")
+
+    record = _record_dtype(DTYPE_CODES[dtype_name], first_dim)
+    joined = b''.join(present)
+    if len(joined) != record.itemsize * len(present):
+        raise ValueError("Embeddings have mixed dtypes or dimensions")
+    records = np.frombuffer(joined, dtype=record)
+    headers = records['header'].view('<u4')
+    if np.any(headers != headers[0]):
+        raise ValueError("Embeddings have mixed dtypes or dimensions")
+
+    values = records['values'].astype(np.float32)
+    if 'scale' in record.names:
+        values *= records['scale'][:, None]
+    if len(present) == len(blobs):
+        return values
+    matrix = np.zeros((len(blobs), first_dim), dtype=np.float32)
+    mask = np.fromiter((blob is not None for blob in blobs), dtype=bool, count=len(blobs))
+    matrix[mask] = values
+    return matrix
+
+
+def embedding_matrix(queryset, dim=None):
+    """(ids, matrix) for the comments in queryset that have an embedding; one query, one decode."""
+    rows = list(queryset.filter(embedding__isnull=False).values_list('id', 'embedding'))
+    ids = np.fromiter((pk for pk, _ in rows), dtype=np.int64, count=len(rows))
+    return ids, decode_matrix([blob for _, blob in rows], dim=dim)
@@ -1,394 +1,243 @@
-from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
-from django.core.paginator import Paginator
+from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.cache import cache_control
 from django.contrib import messages
-from django.core.cache import cache
-from django.db.models import Max, Count
-from .models import YouTubeComment, Plan, UserPlan
-import json
-import pandas as pd
-import csv
-from io import TextIOWrapper
-from datetime import datetime
-import numpy as np
-import re
-from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-try:
-    from janome.tokenizer import Tokenizer
-    JANOME_AVAILABLE = True
-except ImportError:
-    JANOME_AVAILABLE = False
-
-
-def clean_text(text):
-    """Basic text cleaning: URLs, mentions, excessive symbols."""
-    if pd.isna(text):
-        return ""
-    
-    text = str(text)
-    # Remove URLs
-    text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', text)
-    # Remove mentions (e.g., @username)
-    text = re.sub(r'@\w+', '', text)
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    # Remove excessive symbols (keep basic punctuation)
-    text = re.sub(r'[^\w\s.,!?;:()\-]', '', text)
-    return text.strip()
-
-
-def extract_japanese_words(text):
-    """Extract meaningful Japanese words using morphological analysis."""
-    if not text:
-        return []
-    
-    # Remove URLs, mentions, and clean text
-    text = re.sub(r'http[s]?://\S+', '', text)
-    text = re.sub(r'@\w+', '', text)
-    
-    words = []
-    
-    if JANOME_AVAILABLE:
-        try:
-            tokenizer = Tokenizer()
-            tokens = tokenizer.tokenize(text)
-            
-            # Filter stop words and extract meaningful words
-            stop_words = {'の', 'に', 'は', 'を', 'が', 'で', 'と', 'も', 'か', 'な', 'だ', 'です', 'ます', 'ました', 'て', 'た', 'する', 'した', 'ある', 'いる', 'なる', 'れる', 'られる', 'です', 'ます', 'でした', 'ました', 'です', 'ます', 'です', 'ます'}
-            stop_pos = ['助詞', '助動詞', '記号']
-            
-            for token in tokens:
-                surface = token.surface
-                pos = token.part_of_speech.split(',')[0]
-                
-                # Skip stop words and stop parts of speech
-                if surface not in stop_words and pos not in stop_pos:
-                    # Keep nouns, verbs, adjectives, and meaningful words
-                    if pos in ['名詞', '動詞', '形容詞'] or len(surface) >= 2:
-                        if len(surface) >= 2 and len(surface) <= 10:
-                            words.append(surface)
-        except Exception:
-            # Fallback to simple extraction if tokenization fails
-            pass
-    
-    # Fallback: simple character-based extraction
-    if not words:
-        japanese_pattern = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\w]+'
-        phrases = re.findall(japanese_pattern, text)
-        stop_words = {'の', 'に', 'は', 'を', 'が', 'で', 'と', 'も', 'か', 'な', 'だ', 'です', 'ます', 'ました', 'て', 'た', 'する', 'した', 'ある', 'いる', 'なる', 'れる', 'られる'}
-        words = [p for p in phrases if 2 <= len(p) <= 10 and p not in stop_words]
-    
-    return words
+from django.db.models import Q, BooleanField, ExpressionWrapper
+from django.db.models.functions import Substr
+from django.utils import timezone
+from django.utils.text import Truncator
+from .models import YouTubeComment, ClusteringResult, Plan, UserPlan
+from .importers import ImportInterrupted, import_csv_file, import_json_file
+from .pagination import keyset_page
+from .clustering import latest_clustering_result, owner_comments, schedule_clustering
+from .dataversion import cache_counters, get_data_version, get_or_compute, scope_name
+from .stats import engagement_stats
+from .similarity import similar_comments
+
+
+# グラフ・クラスタのJSONで座標を丸める桁数
+COORD_DECIMALS = 4
+# エンゲージメントグラフのホバーに出すコメントの文字数
+GRAPH_TEXT_CHARS = 50
+# コメントテーブルの表示件数の選択肢
+TABLE_LIMIT_OPTIONS = [10, 30, 50]
+# コメント行JSONの本文の文字数（テーブルの truncatechars:80 と同じ）
+ROW_TEXT_CHARS = 80
+# コメント行JSONで選択できる列: 名前 -> モデルのフィールド（None は注釈で計算する列）
+COMMENT_ROW_FIELDS = {
+    "id": "id",
+    "author": "author",
+    "text": None,
+    "likes": "like_count",
+    "replies": "reply_count",
+    "created": "created_at",
+    "video": "video_id",
+    "similar": None,
+}
+DEFAULT_COMMENT_ROW_FIELDS = ["id", "author", "text", "likes", "replies", "created", "similar"]
+# get_or_compute でキャッシュするダッシュボードの値（dashboard_cache_stats で回数を返す）
+DASHBOARD_CACHED_VALUES = ["dashboard_summary", "graph_data", "cluster_data"]
+
+
+def _index_strings(values):
+    """重複する文字列を1つにまとめる: (一意な値のリスト, 各要素の添字のリスト)"""
+    lookup = {}
+    index = [lookup.setdefault(value, len(lookup)) for value in values]
+    return list(lookup), index
+
+
+def _round_list(values, decimals=COORD_DECIMALS):
+    return [round(float(v), decimals) for v in values]
+
+
+def _dashboard_owner(request):
+    """ダッシュボードの集計対象の所有者（ログインユーザー。未ログインの場合は所有者のないコメント）"""
+    return request.user.pk if request.user.is_authenticated else None
+
+
+def _table_limit(request):
+    try:
+        limit = int(request.GET.get('limit', 30))
+    except ValueError:
+        return 30
+    return limit if limit in TABLE_LIMIT_OPTIONS else 30
+
+
+def _comment_row_fields(value):
+    """?fields=author,likes,... から列名のリスト（先頭は常に id。未知の名前は無視）"""
+    if not value:
+        return DEFAULT_COMMENT_ROW_FIELDS
+    fields = ["id"]
+    for name in value.split(","):
+        name = name.strip()
+        if name in COMMENT_ROW_FIELDS and name not in fields:
+            fields.append(name)
+    return fields
+
+
+def _comment_rows(owner_id, fields):
+    """コメントテーブル用のクエリセット（owner_id のコメントの、選んだ列だけを読む）"""
+    columns = {"id", "created_at"}
+    columns.update(COMMENT_ROW_FIELDS[field] for field in fields if COMMENT_ROW_FIELDS[field])
+    queryset = owner_comments(owner_id).only(*columns)
+    if "text" in fields:
+        # 本文は表示する文字数（+省略の判定用に1文字）だけをDBから読む
+        queryset = queryset.annotate(text_head=Substr("comment_text", 1, ROW_TEXT_CHARS + 1))
+    if "similar" in fields:
+        # 埋め込みは有無だけを確認する（バイト列は読まない）
+        queryset = queryset.annotate(has_embedding=ExpressionWrapper(Q(embedding__isnull=False), output_field=BooleanField()))
+    return queryset
+
+
+def _comment_row_value(comment, field):
+    if field == "text":
+        return Truncator(comment.text_head).chars(ROW_TEXT_CHARS)
+    if field == "similar":
+        return int(comment.has_embedding)
+    if field == "created":
+        created_at = comment.created_at
+        if created_at is None:
+            return None
+        if timezone.is_aware(created_at):
+            created_at = timezone.localtime(created_at)
+        return created_at.strftime("%Y-%m-%d %H:%M")
+    return getattr(comment, COMMENT_ROW_FIELDS[field])
 
 
-def analyze_cluster_features(comments, cluster_labels, vectorizer, n_clusters):
-    """Analyze features of each cluster and generate summary."""
-    cluster_analyses = []
-    
-    # Get feature names from vectorizer
-    feature_names = vectorizer.get_feature_names_out()
-    
-    for i in range(n_clusters):
-        mask = np.array(cluster_labels) == i
-        cluster_comments = [comments[j] for j in range(len(comments)) if mask[j]]
-        
-        if len(cluster_comments) == 0:
-            continue
-        
-        # Extract meaningful words from comments using morphological analysis
-        all_words = []
-        for comment in cluster_comments:
-            words = extract_japanese_words(comment)
-            all_words.extend(words)
-        
-        # Count word frequency
-        word_freq = Counter(all_words)
-        
-        # Get top keywords: combine TF-IDF and frequency-based approach
-        # First, get TF-IDF top keywords
-        cluster_text = ' '.join(cluster_comments)
-        cluster_vector = vectorizer.transform([cluster_text])
-        feature_array = cluster_vector.toarray()[0]
-        top_indices = np.argsort(feature_array)[-15:][::-1]  # Top 15 keywords
-        tfidf_keywords = [feature_names[idx] for idx in top_indices if feature_array[idx] > 0]
-        
-        # Get top frequent words (at least 2 occurrences)
-        frequent_words = [word for word, count in word_freq.most_common(20) if count >= 2]
-        
-        # Combine and deduplicate, prioritize frequent words
-        combined_keywords = []
-        seen = set()
-        
-        # Add frequent words first (they are more reliable)
-        for word in frequent_words[:5]:
-            if word not in seen and len(word) >= 2:
-                combined_keywords.append(word)
-                seen.add(word)
-        
-        # Add TF-IDF keywords that aren't already included
-        for keyword in tfidf_keywords:
-            if keyword not in seen and len(keyword) >= 2:
-                combined_keywords.append(keyword)
-                seen.add(keyword)
-        
-        # Get top 3 keywords
-        top_keywords = combined_keywords[:3]
-        
-        # Generate summary
-        avg_length = np.mean([len(c) for c in cluster_comments])
-        sample_comments = cluster_comments[:3]  # Sample comments
-        
-        cluster_analyses.append({
-            'cluster_id': i,
-            'comment_count': len(cluster_comments),
-            'top_keywords': top_keywords,  # Top 3 keywords (unified)
-            'avg_comment_length': round(avg_length, 1),
-            'sample_comments': sample_comments
-        })
-    
-    return cluster_analyses
+def _dashboard_summary(owner_id):
+    """
+    統計サマリー・分析結果・アドバイス（owner_id のコメントをSQLで集計）
+    get_or_compute でデータバージョンが一致するキャッシュの値を返し、その場合DBクエリは発行しない
+    再計算は同時に1リクエストだけ（キャッシュ上のロック）。その間、他のリクエストは古い値を返し、値がまだない場合だけ完了を待つ
+    """
+    return get_or_compute(owner_id, "dashboard_summary", lambda: _compute_dashboard_summary(owner_id))
 
 
-def perform_clustering(comments_df, n_clusters=6):
-    """Perform 3D clustering on comments."""
-    if comments_df is None or len(comments_df) == 0:
-        return None
-    
-    # Check if comment_text column exists
-    if 'comment_text' not in comments_df.columns:
-        return None
-    
-    try:
-        # Extract and clean comments
-        comments = comments_df['comment_text'].apply(clean_text).tolist()
-        comments = [c for c in comments if c and len(c.strip()) > 0]  # Remove empty comments
-        
-        # Limit max clusters to 6
-        max_clusters = min(6, n_clusters)
-        if len(comments) < max_clusters:
-            max_clusters = max(2, len(comments) // 2)
-        
-        if len(comments) < 2:
-            return None
-        
-        # Vectorize
-        vectorizer = TfidfVectorizer(
-            max_features=1000,
-            stop_words=None,
-            ngram_range=(1, 2),
-            min_df=1,
-            max_df=0.95
-        )
-        vectors = vectorizer.fit_transform(comments)
-        
-        if vectors.shape[0] < 2:
-            return None
-        
-        # Reduce to 3D
-        pca = PCA(n_components=3, random_state=42)
-        vectors_3d = pca.fit_transform(vectors.toarray())
-        
-        # Cluster
-        kmeans = KMeans(n_clusters=max_clusters, random_state=42, n_init=10)
-        cluster_labels = kmeans.fit_predict(vectors_3d)
-        
-        # Analyze cluster features
-        cluster_analyses = analyze_cluster_features(comments, cluster_labels.tolist(), vectorizer, max_clusters)
-        
-        # Calculate cluster centers and radii for sphere visualization
-        cluster_centers = []
-        cluster_radii = []
-        for i in range(max_clusters):
-            mask = cluster_labels == i
-            if np.sum(mask) > 0:
-                cluster_points = vectors_3d[mask]
-                center = np.mean(cluster_points, axis=0)
-                # Calculate radius as max distance from center to points in cluster
-                distances = np.linalg.norm(cluster_points - center, axis=1)
-                radius = np.max(distances) if len(distances) > 0 else 0.1
-                cluster_centers.append(center.tolist())
-                cluster_radii.append(float(radius))
-            else:
-                cluster_centers.append([0, 0, 0])
-                cluster_radii.append(0.1)
-        
-        # Add jitter to points to prevent overlapping
-        # Calculate the overall scale of the data
-        data_range = np.max(vectors_3d, axis=0) - np.min(vectors_3d, axis=0)
-        jitter_scale = np.mean(data_range) * 0.02  # 2% of average range
-        
-        # Add small random offset to each point
-        np.random.seed(42)  # For reproducibility
-        jitter = np.random.normal(0, jitter_scale, vectors_3d.shape)
-        vectors_3d_jittered = vectors_3d + jitter
-        
-        # Prepare data for visualization
-        cluster_data = {
-            'x': vectors_3d_jittered[:, 0].tolist(),
-            'y': vectors_3d_jittered[:, 1].tolist(),
-            'z': vectors_3d_jittered[:, 2].tolist(),
-            'cluster_labels': cluster_labels.tolist(),
-            'comments': comments,
-            'explained_variance': float(pca.explained_variance_ratio_.sum()),
-            'n_clusters': max_clusters,
-            'cluster_centers': cluster_centers,
-            'cluster_radii': cluster_radii,
-            'cluster_analyses': cluster_analyses
-        }
-        
-        return cluster_data
-    except Exception as e:
-        import traceback
-        print(f"Clustering error: {e}")
-        print(traceback.format_exc())
+def _compute_dashboard_summary(owner_id):
+    # 統計情報・分析結果を計算（1クエリ。有料プラン・無料プラン両方で生成）
+    stats, analysis = engagement_stats(owner_comments(owner_id))
+    if stats is None:
+        return None, None, None
+
+    engagement_ratio = analysis["engagement_ratio"]
+
+    # アドバイスを生成
+    advice_items = []
+
+    if stats["avg_likes"] < 5:
+        advice_items.append("平均いいね数が低い傾向にあります。コメントの内容をより具体的で価値のあるものにすることで、エンゲージメントを向上させることができます。")
+
+    if stats["avg_replies"] < 2:
+        advice_items.append("返信数が少ない傾向にあります。質問形式のコメントや議論を促す内容を増やすことで、コミュニティの活性化につながります。")
+
+    if engagement_ratio < 20:
+        advice_items.append("高エンゲージメントコメントの割合が低いです。視聴者の興味を引く話題や、タイムリーな内容を意識することで改善できます。")
+
+    if analysis["high_engagement_count"] > 0:
+        advice_items.append(f"最もエンゲージメントが高いコメントは{analysis['top_comment_likes']}いいね、{analysis['top_liked_comment_replies']}返信を獲得しています。このようなコメントの特徴を分析し、同様のアプローチを他のコメントにも適用することをお勧めします。")
+
+    if stats["max_likes"] > stats["avg_likes"] * 3:
+        advice_items.append("一部のコメントが非常に高いエンゲージメントを獲得しています。これらの成功パターンを分析し、コンテンツ戦略に反映させることで、全体的なエンゲージメント向上が期待できます。")
+
+    if not advice_items:
+        advice_items.append("現在のエンゲージメント状況は良好です。継続的な分析と改善により、さらなる成長が期待できます。")
+
+    advice = advice_items
+
+    return stats, analysis, advice
+
+
+def _graph_payload(owner_id):
+    """
+    エンゲージメントグラフ用の列指向データ（同じ並びの配列）
+    投稿者・コメント本文は一意な値のリストと添字で持ち、ホバー文字列はブラウザ側で組み立てる
+    """
+    # グラフ用には最大300件を使用
+    rows = list(owner_comments(owner_id)[:300].values_list("like_count", "reply_count", "created_at", "author", "comment_text"))
+    if not rows:
         return None
+    likes, replies, created_at, authors, texts = zip(*rows)
+    author_values, author_index = _index_strings(authors)
+    text_values, text_index = _index_strings((text or "")[:GRAPH_TEXT_CHARS] for text in texts)
+    return {
+        "count": len(rows),
+        "likes": list(likes),
+        "replies": list(replies),
+        # タイムスタンプを数値に変換（Z軸・色分け用）
+        "created_at": [int(dt.timestamp()) if dt else None for dt in created_at],
+        "authors": author_values,
+        "author_index": author_index,
+        "texts": text_values,
+        "text_index": text_index,
+    }
+
+
+def _cluster_payload(payload):
+    """
+    ClusteringResult.payload を列指向のJSON用に詰める
+    座標は丸め、コメント本文は一意な値のリストと添字にする（重複をまとめた点は weights で表す）
+    """
+    text_values, text_index = _index_strings(payload["comments"])
+    weights = payload.get("weights")
+    return {
+        "count": len(text_index),
+        "n_clusters": payload["n_clusters"],
+        "x": _round_list(payload["x"]),
+        "y": _round_list(payload["y"]),
+        "z": _round_list(payload["z"]),
+        "cluster_labels": payload["cluster_labels"],
+        "comment_ids": payload["comment_ids"],
+        # 全件1（重複なし）の場合は省略
+        "weights": weights if weights and any(w != 1 for w in weights) else None,
+        "texts": text_values,
+        "text_index": text_index,
+        "explained_variance": payload["explained_variance"],
+        "cluster_centers": [_round_list(center) for center in payload["cluster_centers"]],
+        "cluster_radii": _round_list(payload["cluster_radii"]),
+        "cluster_analyses": payload["cluster_analyses"],
+    }
+
+
+def _load_cluster_payload(pk):
+    payload = ClusteringResult.objects.filter(pk=pk).values_list("payload", flat=True).first()
+    return _cluster_payload(payload) if payload else {}
+
+
+def _graph_etag(request):
+    # ログイン・ログアウトで対象が変わるため、スコープもETagに含める
+    owner_id = _dashboard_owner(request)
+    return f"graph-{scope_name(owner_id)}-{get_data_version(owner_id)}"
+
+
+def _cluster_etag(request):
+    clustering = latest_clustering_result(_dashboard_owner(request), with_payload=False)
+    return f"clustering-{clustering.pk}" if clustering else None
 
 
 def index(request):
+    # 集計・一覧の対象はログインユーザーのコメント（未ログインの場合は所有者のないコメント）
+    owner_id = _dashboard_owner(request)
+
     # 表示件数をクエリパラメータから取得（デフォルト: 30件）
-    limit_options = [10, 30, 50]
-    limit = int(request.GET.get('limit', 30))
-    if limit not in limit_options:
-        limit = 30
-    
-    # ページ番号を取得（デフォルト: 1ページ目）
-    page_number = request.GET.get('page', 1)
-    
-    # テーブル表示用には全件を取得してページネーション
-    all_comments = YouTubeComment.objects.all().order_by('-created_at')
+    limit_options = TABLE_LIMIT_OPTIONS
+    limit = _table_limit(request)
     
-    # ページネーション
-    paginator = Paginator(all_comments, limit)
-    page_obj = paginator.get_page(page_number)
+    # テーブル表示用: カーソルの位置から limit 件（キーセットページネーション。OFFSET・全件COUNTなし）
+    # 表示する列だけを読む（2ページ目以降はブラウザが comment_rows_json から取得して描画）
+    page_obj = keyset_page(_comment_rows(owner_id, DEFAULT_COMMENT_ROW_FIELDS), request.GET.get('cursor'), limit)
     comments = page_obj.object_list
 
-    # キャッシュキー生成用：データが更新されたかどうかを判定
-    # コメント数と最新更新時刻を取得
-    comment_count = YouTubeComment.objects.count()
-    latest_update = YouTubeComment.objects.aggregate(Max('created_at'))['created_at__max']
-    cache_key_base = f"index_data_{comment_count}_{latest_update}"
-    
-    # キャッシュからデータを取得
-    graph_data = cache.get(f"{cache_key_base}_graph")
-    stats = cache.get(f"{cache_key_base}_stats")
-    analysis = cache.get(f"{cache_key_base}_analysis")
-    advice = cache.get(f"{cache_key_base}_advice")
-    cluster_data = cache.get(f"{cache_key_base}_cluster")
-    
-    # キャッシュにない場合は計算
-    if graph_data is None or stats is None:
-        # グラフ用には最大300件を使用
-        comments_for_graph = YouTubeComment.objects.all()[:300]
-        
-        if comments_for_graph.exists():
-            df = pd.DataFrame(list(comments_for_graph.values(
-            "like_count",
-            "reply_count",
-            "created_at",
-                "author",
-                "comment_text",
-            )))
-
-            # タイムスタンプを数値に変換
-            df["created_at_num"] = df["created_at"].astype("int64") // 10**9
-            
-            # グラフ用のデータをリスト形式に変換
-            graph_data = {
-                "x": df["like_count"].tolist(),
-                "y": df["reply_count"].tolist(),
-                "z": df["created_at_num"].tolist(),
-                "text": [
-                    f"Author: {author}<br>Likes: {likes}<br>Replies: {replies}<br>Comment: {text[:50]}..."
-                    for author, likes, replies, text in zip(
-                        df["author"], df["like_count"], df["reply_count"], df["comment_text"]
-                    )
-                ],
-                "colors": df["created_at_num"].tolist(),  # 色分け用
-            }
-
-            # 統計情報を計算
-            stats = {
-                "total_comments": len(df),
-                "avg_likes": float(df["like_count"].mean()),
-                "avg_replies": float(df["reply_count"].mean()),
-                "max_likes": int(df["like_count"].max()),
-                "max_replies": int(df["reply_count"].max()),
-                "total_likes": int(df["like_count"].sum()),
-                "total_replies": int(df["reply_count"].sum()),
-            }
-            
-            # 分析結果とアドバイスを生成（有料プラン・無料プラン両方で生成）
-            if analysis is None:
-                analysis = None
-                advice = None
-            
-            if len(df) > 0:
-                # 分析結果を生成
-                high_engagement = df[(df["like_count"] > stats["avg_likes"]) & (df["reply_count"] > stats["avg_replies"])]
-                low_engagement = df[(df["like_count"] < stats["avg_likes"]) & (df["reply_count"] < stats["avg_replies"])]
-                
-                engagement_ratio = len(high_engagement) / len(df) * 100 if len(df) > 0 else 0
-                
-                analysis = {
-                    "high_engagement_count": len(high_engagement),
-                    "low_engagement_count": len(low_engagement),
-                    "engagement_ratio": round(engagement_ratio, 1),
-                    "top_comment_likes": int(df.nlargest(1, "like_count")["like_count"].iloc[0]) if len(df) > 0 else 0,
-                    "top_comment_replies": int(df.nlargest(1, "reply_count")["reply_count"].iloc[0]) if len(df) > 0 else 0,
-                }
-                
-                # アドバイスを生成
-                advice_items = []
-                
-                if stats["avg_likes"] < 5:
-                    advice_items.append("平均いいね数が低い傾向にあります。コメントの内容をより具体的で価値のあるものにすることで、エンゲージメントを向上させることができます。")
-                
-                if stats["avg_replies"] < 2:
-                    advice_items.append("返信数が少ない傾向にあります。質問形式のコメントや議論を促す内容を増やすことで、コミュニティの活性化につながります。")
-                
-                if engagement_ratio < 20:
-                    advice_items.append("高エンゲージメントコメントの割合が低いです。視聴者の興味を引く話題や、タイムリーな内容を意識することで改善できます。")
-                
-                if len(high_engagement) > 0:
-                    top_comment = df.nlargest(1, "like_count").iloc[0]
-                    advice_items.append(f"最もエンゲージメントが高いコメントは{int(top_comment['like_count'])}いいね、{int(top_comment['reply_count'])}返信を獲得しています。このようなコメントの特徴を分析し、同様のアプローチを他のコメントにも適用することをお勧めします。")
-                
-                if stats["max_likes"] > stats["avg_likes"] * 3:
-                    advice_items.append("一部のコメントが非常に高いエンゲージメントを獲得しています。これらの成功パターンを分析し、コンテンツ戦略に反映させることで、全体的なエンゲージメント向上が期待できます。")
-                
-                if not advice_items:
-                    advice_items.append("現在のエンゲージメント状況は良好です。継続的な分析と改善により、さらなる成長が期待できます。")
-                
-                advice = advice_items
-            
-            # 3Dクラスタリング処理
-            if cluster_data is None:
-                cluster_data = None
-                if len(df) > 0:
-                    try:
-                        cluster_data = perform_clustering(df, n_clusters=6)
-                    except Exception as e:
-                        import traceback
-                        print(f"Clustering failed: {e}")
-                        print(traceback.format_exc())
-                        cluster_data = None
-            
-            # キャッシュに保存（5分間有効）
-            cache.set(f"{cache_key_base}_graph", graph_data, 300)
-            cache.set(f"{cache_key_base}_stats", stats, 300)
-            cache.set(f"{cache_key_base}_analysis", analysis, 300)
-            cache.set(f"{cache_key_base}_advice", advice, 300)
-            if cluster_data:
-                cache.set(f"{cache_key_base}_cluster", cluster_data, 300)
-        else:
-            # comments_for_graphが存在しない場合の初期化
-            if cluster_data is None:
-                cluster_data = None
+    # 統計サマリー・分析結果（グラフとクラスタの座標は graph_data_json / cluster_data_json から非同期に取得）
+    stats, analysis, advice = _dashboard_summary(owner_id)
+    has_comments = stats is not None
+    
+    # 3Dクラスタリング結果は有無と計算日時だけを確認（payloadは読み込まない。リクエスト内では計算しない）
+    clustering = latest_clustering_result(owner_id, with_payload=False)
+    if clustering is None and has_comments:
+        # まだ一度も計算されていない場合は計算を予約
+        schedule_clustering(owner_id)
     
     # 有料プランチェック（ユーザーごとに異なるためキャッシュしない）
     is_premium = False
@@ -400,7 +249,7 @@ def index(request):
             pass
 
     return render(request, "index.html", {
-        "graph_data": json.dumps(graph_data) if graph_data else None,
+        "has_comments": has_comments,
         "stats": stats,
         "comments": comments,
         "page_obj": page_obj,
@@ -409,27 +258,54 @@ def index(request):
         "is_premium": is_premium,
         "analysis": analysis,
         "advice": advice,
-        "cluster_data": json.dumps(cluster_data) if cluster_data is not None else None,
+        "has_clustering": clustering is not None,
+        "clustering_updated_at": clustering.finished_at if clustering else None,
+        "clustering_pending": clustering is None and has_comments,
+    })
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_graph_etag)
+def graph_data_json(request):
+    """エンゲージメントグラフ用データ（所有者ごとにデータバージョンが変わるまでキャッシュ。ETagで再検証）"""
+    owner_id = _dashboard_owner(request)
+    graph_data = get_or_compute(owner_id, "graph_data", lambda: _graph_payload(owner_id))
+    return JsonResponse({"graph_data": graph_data})
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_cluster_etag)
+def cluster_data_json(request):
+    """3Dクラスタリング結果（計算結果ごとにキャッシュ。ETagで再検証）"""
+    owner_id = _dashboard_owner(request)
+    clustering = latest_clustering_result(owner_id, with_payload=False)
+    if clustering is None:
+        return JsonResponse({"cluster_data": None, "pending": owner_comments(owner_id).exists()})
+    # 計算結果（pk）ごとに1時間キャッシュ。新しい結果ができると所有者ごとのキーを置き換える
+    cluster_data = get_or_compute(owner_id, "cluster_data", lambda: _load_cluster_payload(clustering.pk), version=clustering.pk, timeout=3600)
+    return JsonResponse({
+        "cluster_data": cluster_data or None,
+        "updated_at": clustering.finished_at.isoformat() if clustering.finished_at else None,
     })
 
 
+def dashboard_cache_stats(request):
+    """管理者用: ダッシュボード集計キャッシュのヒット・ミス・古い値・待機の回数（傾向を見るための概数）"""
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse({"counters": cache_counters(DASHBOARD_CACHED_VALUES)})
+
+
 def comments_table(request):
     """Ajax用: コメントテーブル部分のみを返す"""
+    owner_id = _dashboard_owner(request)
+
     # 表示件数をクエリパラメータから取得（デフォルト: 30件）
-    limit_options = [10, 30, 50]
-    limit = int(request.GET.get('limit', 30))
-    if limit not in limit_options:
-        limit = 30
-    
-    # ページ番号を取得（デフォルト: 1ページ目）
-    page_number = request.GET.get('page', 1)
-    
-    # テーブル表示用には全件を取得してページネーション
-    all_comments = YouTubeComment.objects.all().order_by('-created_at')
+    limit_options = TABLE_LIMIT_OPTIONS
+    limit = _table_limit(request)
     
-    # ページネーション
-    paginator = Paginator(all_comments, limit)
-    page_obj = paginator.get_page(page_number)
+    # テーブル表示用: カーソルの位置から limit 件（キーセットページネーション。OFFSET・全件COUNTなし）
+    page_obj = keyset_page(_comment_rows(owner_id, DEFAULT_COMMENT_ROW_FIELDS), request.GET.get('cursor'), limit)
     comments = page_obj.object_list
 
     from django.template.loader import render_to_string
@@ -443,28 +319,66 @@ def comments_table(request):
     return JsonResponse({'html': html})
 
 
+def comment_rows_json(request):
+    """
+    Ajax用: コメントテーブルの行をJSONで返す（列名のリスト + 値の配列の行。描画はブラウザ側）
+    ?fields= で列を選び、?cursor= でページを指定する。読むのは選んだ列と本文の先頭だけ
+    """
+    limit = _table_limit(request)
+    fields = _comment_row_fields(request.GET.get("fields"))
+    page_obj = keyset_page(_comment_rows(_dashboard_owner(request), fields), request.GET.get("cursor"), limit)
+    return JsonResponse({
+        "fields": fields,
+        "rows": [[_comment_row_value(comment, field) for field in fields] for comment in page_obj],
+        "next": page_obj.next_cursor,
+        "prev": page_obj.previous_cursor,
+        "last": page_obj.last_cursor if page_obj.has_next() else None,
+    }, json_dumps_params={"ensure_ascii": False, "separators": (",", ":")})
+
+
+def similar_comments_json(request, pk):
+    """埋め込みが近いコメント（類似コメント）をJSONで返す"""
+    comment = get_object_or_404(YouTubeComment, pk=pk)
+    # 所有者のいるコメントは本人（または管理者）のみ
+    if comment.owner_id and comment.owner_id != request.user.id and not request.user.is_staff:
+        raise Http404
+    try:
+        k = min(max(int(request.GET.get('k', 10)), 1), 50)
+    except ValueError:
+        k = 10
+
+    results = similar_comments(comment, k=k)
+    return JsonResponse({
+        'comment_id': comment.pk,
+        'has_embedding': comment.embedding is not None,
+        'results': [
+            {
+                'id': similar.pk,
+                'author': similar.author,
+                'comment_text': similar.comment_text,
+                'ai_reply': similar.ai_reply,
+                'score': round(score, 4),
+            }
+            for similar, score in results
+        ],
+    })
+
+
+def _import_owner(request):
+    return request.user if request.user.is_authenticated else None
+
+
 def import_csv(request):
     """CSVファイルをインポート"""
     if request.method == "POST" and request.FILES.get("csv_file"):
-        csv_file = TextIOWrapper(request.FILES["csv_file"].file, encoding="utf-8")
-        reader = csv.DictReader(csv_file)
-        count = 0
-        for row in reader:
-            YouTubeComment.objects.create(
-                video_id=row.get("video_id", ""),
-                comment_id=row.get("comment_id", ""),
-                comment_text=row.get("comment_text", ""),
-                author=row.get("author", ""),
-                like_count=int(row.get("like_count") or 0),
-                reply_count=int(row.get("reply_count") or 0),
-                reply_depth_potential=int(row.get("reply_depth_potential") or 0),
-                engagement_score=float(row.get("engagement_score") or 0),
-                created_at=row.get("created_at") or None,
-                ai_reply=row.get("ai_reply") if row.get("ai_reply") and row.get("ai_reply") != "null" else None,
-                embedding=row.get("embedding") if row.get("embedding") else None,
-            )
-            count += 1
-        messages.success(request, f"{count} 件のコメントをインポートしました。")
+        # upsert: 既存コメントは重複させずにカウント類を更新
+        # ログインユーザーのコメントとして取り込む（ダッシュボードの集計も所有者ごと）
+        try:
+            result = import_csv_file(request.FILES["csv_file"], owner=_import_owner(request), upsert=request.POST.get("upsert") == "1")
+        except ImportInterrupted as exc:
+            messages.error(request, exc.summary("CSV"))
+            return redirect("index")
+        messages.success(request, result.summary())
         return redirect("index")
     
     messages.error(request, "CSVファイルを選択してください。")
@@ -474,50 +388,13 @@ def import_csv(request):
 def import_json(request):
     """JSONファイルをインポート"""
     if request.method == "POST" and request.FILES.get("json_file"):
-        json_file = request.FILES["json_file"]
         try:
-            data = json.load(json_file)
-            count = 0
-            
-            # JSONが配列の場合
-            if isinstance(data, list):
-                for item in data:
-                    YouTubeComment.objects.create(
-                        video_id=item.get("video_id", ""),
-                        comment_id=item.get("comment_id", ""),
-                        comment_text=item.get("comment_text", ""),
-                        author=item.get("author", ""),
-                        like_count=int(item.get("like_count") or 0),
-                        reply_count=int(item.get("reply_count") or 0),
-                        reply_depth_potential=int(item.get("reply_depth_potential") or 0),
-                        engagement_score=float(item.get("engagement_score") or 0),
-                        created_at=item.get("created_at") or None,
-                        ai_reply=item.get("ai_reply") if item.get("ai_reply") and item.get("ai_reply") != "null" else None,
-                        embedding=item.get("embedding") if item.get("embedding") else None,
-                    )
-                    count += 1
-            # JSONがオブジェクトでcommentsキーがある場合
-            elif isinstance(data, dict) and "comments" in data:
-                for item in data["comments"]:
-                    YouTubeComment.objects.create(
-                        video_id=item.get("video_id", ""),
-                        comment_id=item.get("comment_id", ""),
-                        comment_text=item.get("comment_text", ""),
-                        author=item.get("author", ""),
-                        like_count=int(item.get("like_count") or 0),
-                        reply_count=int(item.get("reply_count") or 0),
-                        reply_depth_potential=int(item.get("reply_depth_potential") or 0),
-                        engagement_score=float(item.get("engagement_score") or 0),
-                        created_at=item.get("created_at") or None,
-                        ai_reply=item.get("ai_reply") if item.get("ai_reply") and item.get("ai_reply") != "null" else None,
-                        embedding=item.get("embedding") if item.get("embedding") else None,
-                    )
-                    count += 1
-            
-            messages.success(request, f"{count} 件のコメントをインポートしました。")
+            # 配列 / {"comments": [...]} / NDJSON をストリーミングで読み込む
+            result = import_json_file(request.FILES["json_file"], owner=_import_owner(request), upsert=request.POST.get("upsert") == "1")
+            messages.success(request, result.summary())
             return redirect("index")
-        except json.JSONDecodeError:
-            messages.error(request, "JSONファイルの形式が正しくありません。")
+        except ImportInterrupted as exc:
+            messages.error(request, exc.summary("JSON"))
             return redirect("index")
     
     messages.error(request, "JSONファイルを選択してください。")
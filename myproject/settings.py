@@ -140,8 +140,77 @@ CACHES = {
         }
     }
 }
+# ダッシュボード集計の共有キャッシュ（L2。全ワーカーでデータバージョン・ロック・集計結果を共有する）
+# REDIS_URL があればRedis、なければ外部サービスなしで使えるファイルキャッシュ
+if os.environ.get('REDIS_URL'):
+    CACHES['dashboard'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+else:
+    CACHES['dashboard'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DASHBOARD_CACHE_DIR', str(BASE_DIR / 'cache' / 'dashboard')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
+    }
+DASHBOARD_CACHE_ALIAS = 'dashboard'
+# プロセス内のL1に持つ集計結果の数
+DASHBOARD_L1_MAX_ENTRIES = int(os.environ.get('DASHBOARD_L1_MAX_ENTRIES', '64'))
+# ダッシュボード集計のキャッシュ期間（データバージョンが変わった時点で無効になる。期限前から確率的に再計算する）
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('DASHBOARD_CACHE_TIMEOUT', '300'))
 STATICFILES_DIRS = [BASE_DIR / 'myapp' / 'static']
 
+# ============================================
+# クラスタリング設定
+# ============================================
+# コメント変更時にバックグラウンドスレッドで再計算する（Falseの場合は refresh_clustering コマンドで計算）
+CLUSTERING_BACKGROUND = os.environ.get('CLUSTERING_BACKGROUND', 'true').lower() == 'true'
+# 1回のクラスタリングで使う最大コメント数（新しい順）
+CLUSTERING_MAX_COMMENTS = int(os.environ.get('CLUSTERING_MAX_COMMENTS', '300'))
+# 前回の学習結果に新規コメントだけを追加学習する（MiniBatchKMeans.partial_fit）
+CLUSTERING_INCREMENTAL = os.environ.get('CLUSTERING_INCREMENTAL', 'true').lower() == 'true'
+# 新規コメントのうち、学習時のクラスタから外れる（重心までの距離が学習時の95パーセンタイル超）割合がこれを超えたら全体を再学習
+CLUSTERING_DRIFT_THRESHOLD = float(os.environ.get('CLUSTERING_DRIFT_THRESHOLD', '0.5'))
+# 対象コメントのうち新規コメントがこの割合を超えたら全体を再学習
+CLUSTERING_REFIT_FRACTION = float(os.environ.get('CLUSTERING_REFIT_FRACTION', '0.5'))
+# 3次元への次元削減方式（pca: 密行列PCA / svd: 疎行列のままTruncatedSVD / auto: 件数で切り替え）
+CLUSTERING_REDUCTION = os.environ.get('CLUSTERING_REDUCTION', 'auto')
+# auto の場合、この件数を超えたら svd を使う
+CLUSTERING_SVD_THRESHOLD = int(os.environ.get('CLUSTERING_SVD_THRESHOLD', '5000'))
+# クラスタ数（数値で固定、auto: 候補のkをシルエット係数で比較して自動選択。追加学習中は前回のkを使う）
+CLUSTERING_N_CLUSTERS = os.environ.get('CLUSTERING_N_CLUSTERS', '6')
+CLUSTERING_N_CLUSTERS = CLUSTERING_N_CLUSTERS if CLUSTERING_N_CLUSTERS == 'auto' else int(CLUSTERING_N_CLUSTERS)
+# auto の場合に評価するkの範囲
+CLUSTERING_K_MIN = int(os.environ.get('CLUSTERING_K_MIN', '2'))
+CLUSTERING_K_MAX = int(os.environ.get('CLUSTERING_K_MAX', '10'))
+# シルエット係数を計算するサンプル数の上限
+CLUSTERING_K_SAMPLE_SIZE = int(os.environ.get('CLUSTERING_K_SAMPLE_SIZE', '2000'))
+# kの評価に使うCPU予算（並列プロセス数。各プロセスは1スレッド）
+CLUSTERING_CPU_BUDGET = int(os.environ.get('CLUSTERING_CPU_BUDGET', str(min(4, os.cpu_count() or 1))))
+# この件数以上のときだけkの評価をプロセスプールで行う（プロセスの起動に1〜2秒かかるため）
+# 既定の CLUSTERING_MAX_COMMENTS（300件）では届かず同じプロセスで評価する。プールを使うのは scripts/cluster_3d.py の大きな入力
+CLUSTERING_K_PARALLEL_MIN_POINTS = int(os.environ.get('CLUSTERING_K_PARALLEL_MIN_POINTS', '50000'))
+
+# ============================================
+# 類似コメント検索（埋め込みベクトルのインデックス）
+# ============================================
+# コメント変更時にバックグラウンドスレッドでインデックスを更新する（Falseの場合は build_vector_index コマンドで更新）
+VECTOR_INDEX_BACKGROUND = os.environ.get('VECTOR_INDEX_BACKGROUND', str(CLUSTERING_BACKGROUND)).lower() == 'true'
+# 所有者ごとのインデックスファイル（メモリマップするfloat32行列）の保存先
+VECTOR_INDEX_DIR = Path(os.environ.get('VECTOR_INDEX_DIR', BASE_DIR / 'vector_index'))
+# この件数以上でIVF（k-meansのリストで探索対象を絞る近似検索）を使う
+VECTOR_INDEX_IVF_MIN = int(os.environ.get('VECTOR_INDEX_IVF_MIN', '50000'))
+# IVFで探索するリスト数（多いほど正確・遅い）
+VECTOR_INDEX_NPROBE = int(os.environ.get('VECTOR_INDEX_NPROBE', '8'))
+
+# ============================================
+# 近似重複コメントの検出（MinHash/LSH）
+# ============================================
+# 文字3-gramのJaccard係数がこの値以上なら同じグループ（分析では1点にまとめる）
+DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', '0.8'))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # ============================================
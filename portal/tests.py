@@ -1,3 +1,40 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
 
-# Create your tests here.
+from myapp.models import YouTubeComment
+from myapp.pagination import KeysetPaginator
+from myapp.tests import AnalyticsTestCase
+
+
+class CommentListPaginationTests(AnalyticsTestCase):
+    """ポータルの一覧: キーセットページネーションでも paginator / page_obj.paginator が使える"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='secret')
+        other = User.objects.create_user('bob')
+        for i in range(25):
+            YouTubeComment.objects.create(owner=self.user, video_id='v1', comment_id=f'a{i}', comment_text=f'コメント{i}')
+        YouTubeComment.objects.create(owner=other, video_id='v1', comment_id='b0', comment_text='他の人のコメント')
+        self.client.force_login(self.user)
+
+    def test_pages_follow_cursors(self):
+        seen = []
+        response = self.client.get(reverse('portal:comment_list'))
+        while True:
+            self.assertIsInstance(response.context['paginator'], KeysetPaginator)
+            self.assertIs(response.context['page_obj'].paginator, response.context['paginator'])
+            seen.extend(comment.pk for comment in response.context['comments'])
+            page = response.context['page_obj']
+            if not page.has_next():
+                break
+            response = self.client.get(reverse('portal:comment_list'), {'cursor': page.next_cursor})
+        self.assertEqual(len(seen), 25)
+        self.assertCountEqual(seen, YouTubeComment.objects.filter(owner=self.user).values_list('pk', flat=True))
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+
+    def test_dashboard_renders(self):
+        response = self.client.get(reverse('portal:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(response.context['total_count'], 25)
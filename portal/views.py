@@ -10,6 +10,8 @@ from django.urls import reverse_lazy
 from django.contrib import messages
 from django.db.models import Q
 from myapp.models import YouTubeComment
+from myapp.pagination import KeysetPaginationMixin
+from myapp.similarity import similar_comments
 from .forms import YouTubeCommentForm
 from .mixins import PortalLoginRequiredMixin, OwnerRequiredMixin
 
@@ -49,9 +51,10 @@ class PortalLogoutView(LogoutView):
         return super().dispatch(request, *args, **kwargs)
 
 
-class PortalDashboardView(PortalLoginRequiredMixin, ListView):
+class PortalDashboardView(PortalLoginRequiredMixin, KeysetPaginationMixin, ListView):
     """
     ポータルダッシュボード（一覧ページ）
+    ページはキーセットページネーション（?cursor=...。OFFSET・全件COUNTなし）
     """
     template_name = 'portal/dashboard.html'
     context_object_name = 'comments'
@@ -84,9 +87,10 @@ class PortalDashboardView(PortalLoginRequiredMixin, ListView):
         return context
 
 
-class CommentListView(PortalLoginRequiredMixin, OwnerRequiredMixin, ListView):
+class CommentListView(PortalLoginRequiredMixin, OwnerRequiredMixin, KeysetPaginationMixin, ListView):
     """
     コメント一覧ビュー
+    ページはキーセットページネーション（?cursor=...。OFFSET・全件COUNTなし）
     """
     model = YouTubeComment
     template_name = 'portal/comment_list.html'
@@ -126,6 +130,14 @@ class CommentDetailView(PortalLoginRequiredMixin, OwnerRequiredMixin, DetailView
     model = YouTubeComment
     template_name = 'portal/comment_detail.html'
     context_object_name = 'comment'
+    
+    def get_context_data(self, **kwargs):
+        """
+        埋め込みの近いコメント（類似コメント）を追加
+        """
+        context = super().get_context_data(**kwargs)
+        context['similar_comments'] = similar_comments(self.object, k=5)
+        return context
 
 
 class CommentCreateView(PortalLoginRequiredMixin, CreateView):
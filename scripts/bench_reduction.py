@@ -0,0 +1,74 @@
+"""
+Benchmark dense PCA vs sparse TruncatedSVD for the 3D reduction step.
+
+Generates a synthetic TF-IDF-like CSR matrix (l2-normalized rows, a handful of
+non-zeros per comment over a 1000-term vocabulary) and reports wall time and
+peak traced memory for each reduction at each size.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+def synthetic_tfidf(n_rows, n_features=1000, terms_per_row=12, seed=42):
+    """Random CSR matrix shaped like the TF-IDF output of short comments."""
+    rng = np.random.default_rng(seed)
+    # Zipf-ish term distribution so a few terms dominate, as in real comments
+    weights = 1.0 / np.arange(1, n_features + 1)
+    weights /= weights.sum()
+    indices = rng.choice(n_features, size=n_rows * terms_per_row, p=weights)
+    indptr = np.arange(0, n_rows * terms_per_row + 1, terms_per_row)
+    data = rng.random(n_rows * terms_per_row)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(n_rows, n_features))
+    matrix.sum_duplicates()
+    return normalize(matrix)
+
+
+def measure(fn):
+    """Run fn and return (seconds, peak MiB allocated during the call)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def reduce_pca(matrix):
+    PCA(n_components=3, random_state=42).fit_transform(matrix.toarray())
+
+
+def reduce_svd(matrix):
+    TruncatedSVD(n_components=3, random_state=42).fit_transform(matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PCA vs TruncatedSVD for 3D reduction')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='Numbers of comments to benchmark (default: 10k 100k 1M)')
+    parser.add_argument('--features', type=int, default=1000,
+                        help='Vocabulary size, matching TfidfVectorizer(max_features=1000)')
+    parser.add_argument('--max-dense-gb', type=float, default=4.0,
+                        help='Skip dense PCA when the densified matrix would exceed this size')
+    args = parser.parse_args()
+
+    print(f"{'comments':>10}  {'method':<6}  {'seconds':>8}  {'peak MiB':>9}")
+    for n_rows in args.sizes:
+        matrix = synthetic_tfidf(n_rows, n_features=args.features)
+        dense_gb = n_rows * args.features * 8 / 2 ** 30
+        for name, fn in (('pca', reduce_pca), ('svd', reduce_svd)):
+            if name == 'pca' and dense_gb > args.max_dense_gb:
+                print(f"{n_rows:>10}  {name:<6}  {'skipped':>8}  {'(dense ' + f'{dense_gb:.1f} GiB)':>9}")
+                continue
+            elapsed, peak = measure(lambda: fn(matrix))
+            print(f"{n_rows:>10}  {name:<6}  {elapsed:>8.2f}  {peak:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,24 @@
 import pandas as pd
 import numpy as np
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
+import base64
+import json
+import tempfile
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.decomposition import PCA, TruncatedSVD, IncrementalPCA
+from sklearn.random_projection import SparseRandomProjection
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import plotly.graph_objects as go
 import plotly.express as px
 import argparse
+import os
 import sys
 from pathlib import Path
 
+# k selection is shared with the dashboard (myapp.kselection does not depend on Django)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from myapp.kselection import candidate_ks, select_k
+
 
 def load_csv(filepath):
     """Load CSV file with pandas."""
@@ -62,11 +71,21 @@ def vectorize_comments(comments, max_features=1000):
     return vectors, vectorizer
 
 
-def reduce_to_3d(vectors):
-    """Reduce vectors to 3 dimensions using PCA."""
-    pca = PCA(n_components=3, random_state=42)
-    reduced = pca.fit_transform(vectors.toarray())
-    return reduced, pca
+# Above this many rows, 'auto' reduction switches to sparse TruncatedSVD
+SPARSE_REDUCTION_THRESHOLD = 5000
+
+
+def reduce_to_3d(vectors, method='auto'):
+    """Reduce vectors to 3 dimensions using PCA (dense) or TruncatedSVD (sparse, never densified)."""
+    if method == 'auto':
+        method = 'svd' if vectors.shape[0] > SPARSE_REDUCTION_THRESHOLD else 'pca'
+    if method == 'svd':
+        reducer = TruncatedSVD(n_components=3, random_state=42)
+        reduced = reducer.fit_transform(vectors)
+    else:
+        reducer = PCA(n_components=3, random_state=42)
+        reduced = reducer.fit_transform(vectors.toarray())
+    return reduced, reducer
 
 
 def cluster_comments(vectors_3d, n_clusters=10):
@@ -76,23 +95,243 @@ def cluster_comments(vectors_3d, n_clusters=10):
     return cluster_labels, kmeans
 
 
-def create_3d_visualization(vectors_3d, cluster_labels, comments, output_path):
-    """Create interactive 3D scatter plot using Plotly."""
-    # Create color map for clusters
-    n_clusters = len(np.unique(cluster_labels))
-    colors = px.colors.qualitative.Set3[:n_clusters]
-    
+def cluster_count_arg(value):
+    """argparse type for --clusters: a number >= 2 or 'auto'."""
+    if value == 'auto':
+        return value
+    try:
+        n_clusters = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number or 'auto'")
+    if n_clusters < 2:
+        raise argparse.ArgumentTypeError("need at least 2 clusters")
+    return n_clusters
+
+
+def select_n_clusters(vectors_3d, k_max=10, workers=1):
+    """Pick k in 2..k_max with the best silhouette (myapp.kselection); candidates are fitted concurrently."""
+    candidates = candidate_ks(len(vectors_3d), k_max=k_max) or [2]
+    n_clusters, scores = select_k(vectors_3d, candidates, max_workers=workers)
+    print("Silhouette by k: " + ", ".join(f"{k}={score:.3f}" for k, score in scores.items()))
+    return n_clusters
+
+
+# Streaming mode: hashed feature space and the intermediate projection it is reduced through
+HASH_FEATURES = 2 ** 18
+PROJECTION_DIM = 256
+# Share of non-zero projection entries. The default (1/sqrt(n_features) = 1/512) gives each hashed feature
+# about half a non-zero component, so short comments with one or two features mostly project to zero;
+# at 1/16 every feature reaches ~16 components (the projection matrix stays around 50MB)
+PROJECTION_DENSITY = 1 / 16
+
+
+def detect_text_column_from_header(filepath, text_column=None):
+    """Pick the text column from the first rows only (streaming mode never loads the whole file)."""
+    sample = pd.read_csv(filepath, nrows=100)
+    if text_column:
+        return text_column
+    # Exports from the dashboard DB already carry clean_text output in `normalized_text`
+    if 'normalized_text' in sample.columns:
+        return 'normalized_text'
+    return detect_text_column(sample)
+
+
+def iter_text_chunks(filepath, text_column, chunk_size):
+    """Yield (row_numbers, cleaned_texts) per chunk, reading only the text column; empty texts are skipped."""
+    needs_cleaning = text_column != 'normalized_text'
+    reader = pd.read_csv(filepath, usecols=[text_column], dtype={text_column: str}, chunksize=chunk_size)
+    offset = 0
+    for chunk in reader:
+        texts = chunk[text_column].fillna('')
+        if needs_cleaning:
+            texts = texts.map(clean_text)
+        texts = texts.tolist()
+        rows = [offset + i for i, text in enumerate(texts) if text]
+        yield np.asarray(rows, dtype=np.int64), [texts[i - offset] for i in rows]
+        offset += len(texts)
+
+
+class StreamingReducer:
+    """
+    Stateless hashing -> fixed sparse random projection -> IncrementalPCA(3).
+
+    Only IncrementalPCA holds learned state, so every step works on one chunk at a time.
+    """
+
+    def __init__(self, random_state=42):
+        self.vectorizer = HashingVectorizer(
+            n_features=HASH_FEATURES,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm='l2'
+        )
+        self.projection = SparseRandomProjection(
+            n_components=PROJECTION_DIM, density=PROJECTION_DENSITY, dense_output=True, random_state=random_state
+        )
+        self.projection.fit(self.vectorizer.transform(['']))  # only needs n_features
+        self.pca = IncrementalPCA(n_components=3)
+
+    def project(self, texts):
+        return self.projection.transform(self.vectorizer.transform(texts)).astype(np.float32)
+
+    def partial_fit(self, texts):
+        projected = self.project(texts)
+        if len(projected) >= 3:
+            self.pca.partial_fit(projected)
+
+    def transform(self, texts):
+        return self.pca.transform(self.project(texts)).astype(np.float32)
+
+
+def run_streaming(args):
+    """Out-of-core clustering: three passes over the CSV, memory bounded by --chunk-size."""
+    text_column = detect_text_column_from_header(args.input, args.text_column)
+    print(f"Streaming {args.input} (text column: {text_column}, chunk size: {args.chunk_size})")
+    labels_path = args.labels_output or str(Path(args.output).with_suffix('.labels.csv'))
+
+    # Pass 1: fit the incremental PCA
+    reducer = StreamingReducer()
+    n_rows = 0
+    for rows, texts in iter_text_chunks(args.input, text_column, args.chunk_size):
+        reducer.partial_fit(texts)
+        n_rows += len(rows)
+        print(f"  [1/3] fitted {n_rows} comments", end='\r')
+    print()
+    if n_rows < 2:
+        print("Not enough comments to cluster")
+        return
+    print(f"Explained variance ratio (IncrementalPCA over {PROJECTION_DIM}-d projection): {reducer.pca.explained_variance_ratio_.sum():.3f}")
+    if args.clusters == 'auto':
+        # Choose k on the first chunk (one extra projection of a bounded sample)
+        _, first_texts = next(iter_text_chunks(args.input, text_column, args.chunk_size))
+        n_clusters = select_n_clusters(reducer.transform(first_texts), args.k_max, args.workers)
+        print(f"Selected {n_clusters} clusters")
+    else:
+        n_clusters = min(args.clusters, max(2, n_rows // 2))
+
+    # Pass 2: project each chunk once, keep 3D coordinates in a disk-backed array, partial_fit the clustering
+    with tempfile.TemporaryDirectory() as tmpdir:
+        coords = np.memmap(Path(tmpdir) / 'coords.f32', dtype=np.float32, mode='w+', shape=(n_rows, 3))
+        row_numbers = np.memmap(Path(tmpdir) / 'rows.i64', dtype=np.int64, mode='w+', shape=(n_rows,))
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=4096)
+        # Reservoir sample of points for the HTML plot (bounded by --plot-sample)
+        rng = np.random.default_rng(42)
+        sample_positions = np.empty(0, dtype=np.int64)
+        sample_texts = []
+        pending = None
+        position = 0
+        for rows, texts in iter_text_chunks(args.input, text_column, args.chunk_size):
+            chunk_3d = reducer.transform(texts)
+            coords[position:position + len(rows)] = chunk_3d
+            row_numbers[position:position + len(rows)] = rows
+            # MiniBatchKMeans needs at least n_clusters points in its first batch
+            pending = chunk_3d if pending is None else np.vstack([pending, chunk_3d])
+            if len(pending) >= n_clusters:
+                kmeans.partial_fit(pending)
+                pending = None
+            sample_positions, sample_texts = reservoir_update(
+                rng, sample_positions, sample_texts, position, texts, args.plot_sample
+            )
+            position += len(rows)
+            print(f"  [2/3] projected {position} / {n_rows} comments", end='\r')
+        if pending is not None:
+            kmeans.partial_fit(pending)
+        print()
+
+        # Pass 3: assign labels and write them chunk by chunk
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        with open(labels_path, 'w', encoding='utf-8') as out:
+            for start in range(0, n_rows, args.chunk_size):
+                chunk_3d = np.asarray(coords[start:start + args.chunk_size])
+                labels = kmeans.predict(chunk_3d)
+                counts += np.bincount(labels, minlength=n_clusters)
+                write_labels(out, row_numbers[start:start + args.chunk_size], labels, chunk_3d, header=start == 0)
+                print(f"  [3/3] labeled {min(start + args.chunk_size, n_rows)} / {n_rows} comments", end='\r')
+        print()
+        print(f"Cluster distribution: {counts}")
+        print(f"Labels saved to {labels_path}")
+
+        order = np.argsort(sample_positions)
+        sample_positions = sample_positions[order]
+        sample_texts = [sample_texts[i] for i in order]
+        sample_3d = np.asarray(coords[sample_positions])
+    sample_labels = kmeans.predict(sample_3d)
+    print(f"Creating visualization from {len(sample_positions)} sampled comments...")
+    visualize(args, sample_3d, sample_labels, sample_texts)
+
+
+def reservoir_update(rng, positions, texts, offset, chunk_texts, capacity):
+    """Algorithm R over a chunk: keep a uniform sample of at most capacity (position, text) pairs."""
+    positions = positions.tolist()
+    for i, text in enumerate(chunk_texts):
+        seen = offset + i
+        if len(positions) < capacity:
+            positions.append(seen)
+            texts.append(text)
+        else:
+            j = rng.integers(0, seen + 1)
+            if j < capacity:
+                positions[j] = seen
+                texts[j] = text
+    return np.asarray(positions, dtype=np.int64), texts
+
+
+def cluster_indices(cluster_labels, n_clusters):
+    """Row indices of each cluster via one stable argsort (instead of a mask scan per cluster)."""
+    cluster_labels = np.asarray(cluster_labels)
+    order = np.argsort(cluster_labels, kind='stable')
+    counts = np.bincount(cluster_labels, minlength=n_clusters)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def decimate(indices_per_cluster, point_budget, seed=42):
+    """
+    Thin each cluster to a share of point_budget proportional to its size (at least a few points each).
+
+    Points are dropped uniformly at random within a cluster, so the shape and relative density
+    of every cluster are preserved while the total stays near the budget.
+    """
+    total = sum(len(idx) for idx in indices_per_cluster)
+    if not point_budget or total <= point_budget:
+        return indices_per_cluster
+    rng = np.random.default_rng(seed)
+    decimated = []
+    for idx in indices_per_cluster:
+        keep = min(len(idx), max(int(round(point_budget * len(idx) / total)), min(len(idx), 20)))
+        decimated.append(np.sort(rng.choice(idx, keep, replace=False)) if keep < len(idx) else idx)
+    return decimated
+
+
+def encode_float32(values):
+    """Base64 of a little-endian float32 array (decoded into a Float32Array in the browser)."""
+    return base64.b64encode(np.ascontiguousarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def truncate_text(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars - 1] + '…'
+
+
+def write_labels(out, rows, labels, vectors_3d, header=False):
+    """Append row,cluster,x,y,z lines (full label assignments) to an open file."""
+    if header:
+        out.write('row,cluster,x,y,z\n')
+    pd.DataFrame({
+        'row': rows,
+        'cluster': labels,
+        'x': vectors_3d[:, 0], 'y': vectors_3d[:, 1], 'z': vectors_3d[:, 2],
+    }).to_csv(out, header=False, index=False, float_format='%.5f')
+
+
+def build_figure(n_clusters, traces_data=None):
+    """Figure with one Scatter3d trace per cluster; traces_data gives (x, y, z, text) or None for empty traces."""
+    colors = px.colors.qualitative.Set3
     fig = go.Figure()
-    
     for cluster_id in range(n_clusters):
-        mask = cluster_labels == cluster_id
-        cluster_points = vectors_3d[mask]
-        cluster_comments = [comments[i] for i in range(len(comments)) if mask[i]]
-        
+        x, y, z, text = traces_data[cluster_id] if traces_data else ([], [], [], [])
         fig.add_trace(go.Scatter3d(
-            x=cluster_points[:, 0],
-            y=cluster_points[:, 1],
-            z=cluster_points[:, 2],
+            x=x,
+            y=y,
+            z=z,
             mode='markers',
             marker=dict(
                 size=5,
@@ -100,7 +339,7 @@ def create_3d_visualization(vectors_3d, cluster_labels, comments, output_path):
                 opacity=0.7
             ),
             name=f'Cluster {cluster_id}',
-            text=cluster_comments,
+            text=text,
             hovertemplate='<b>Cluster %{fullData.name}</b><br>' +
                          'X: %{x:.2f}<br>' +
                          'Y: %{y:.2f}<br>' +
@@ -118,8 +357,92 @@ def create_3d_visualization(vectors_3d, cluster_labels, comments, output_path):
         width=1200,
         height=800
     )
-    
-    fig.write_html(output_path)
+    return fig
+
+
+def create_3d_visualization(vectors_3d, cluster_labels, comments, output_path):
+    """Create interactive 3D scatter plot using Plotly."""
+    cluster_labels = np.asarray(cluster_labels)
+    n_clusters = int(cluster_labels.max()) + 1
+    comments = np.asarray(comments, dtype=object)
+    traces_data = [
+        (vectors_3d[idx, 0], vectors_3d[idx, 1], vectors_3d[idx, 2], comments[idx].tolist())
+        for idx in cluster_indices(cluster_labels, n_clusters)
+    ]
+    build_figure(n_clusters, traces_data).write_html(output_path)
+
+
+# Fills the empty traces of a compact figure from base64 float32 arrays after Plotly has drawn it
+COMPACT_POST_SCRIPT = """
+(function() {
+    var gd = document.getElementById('{plot_id}');
+    var traces = %s;
+    function decode(b64) {
+        var bin = atob(b64);
+        var bytes = new Uint8Array(bin.length);
+        for (var i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+        return new Float32Array(bytes.buffer);
+    }
+    var update = {x: [], y: [], z: [], text: []};
+    traces.forEach(function(t) {
+        update.x.push(decode(t.x));
+        update.y.push(decode(t.y));
+        update.z.push(decode(t.z));
+        update.text.push(t.text);
+    });
+    Plotly.restyle(gd, update, traces.map(function(_, i) { return i; }));
+})();
+"""
+
+
+def script_json(value):
+    """JSON that is safe inside an inline <script> (comment text can contain '</script>' or '<!--')."""
+    return (
+        json.dumps(value, ensure_ascii=False)
+        .replace('&', '\\u0026')
+        .replace('<', '\\u003c')
+        .replace('>', '\\u003e')
+        .replace('/', '\\/')
+    )
+
+
+def create_compact_visualization(vectors_3d, cluster_labels, comments, output_path, point_budget=None, hover_chars=80):
+    """
+    Compact HTML: coordinates as base64 float32 typed arrays, truncated hover text and
+    optional per-cluster decimation to point_budget. Returns the number of points plotted.
+    """
+    cluster_labels = np.asarray(cluster_labels)
+    n_clusters = int(cluster_labels.max()) + 1
+    selected = decimate(cluster_indices(cluster_labels, n_clusters), point_budget)
+    traces = [
+        {
+            'x': encode_float32(vectors_3d[idx, 0]),
+            'y': encode_float32(vectors_3d[idx, 1]),
+            'z': encode_float32(vectors_3d[idx, 2]),
+            'text': [truncate_text(comments[i], hover_chars) for i in idx],
+        }
+        for idx in selected
+    ]
+    fig = build_figure(n_clusters)
+    fig.write_html(
+        output_path,
+        include_plotlyjs='cdn',
+        post_script=COMPACT_POST_SCRIPT % script_json(traces),
+    )
+    return sum(len(idx) for idx in selected)
+
+
+def visualize(args, vectors_3d, cluster_labels, comments):
+    """Write the HTML in the mode selected on the command line."""
+    if args.compact:
+        plotted = create_compact_visualization(
+            vectors_3d, cluster_labels, comments, args.output,
+            point_budget=args.point_budget, hover_chars=args.hover_chars
+        )
+        print(f"Compact visualization ({plotted} of {len(comments)} points) saved to {args.output}")
+    else:
+        create_3d_visualization(vectors_3d, cluster_labels, comments, args.output)
+        print(f"Visualization saved to {args.output}")
 
 
 def main():
@@ -128,13 +451,41 @@ def main():
                        help='Input CSV file path (default: comments.csv)')
     parser.add_argument('--output', '-o', type=str, default='cluster_3d_visualization.html',
                        help='Output HTML file path (default: cluster_3d_visualization.html)')
-    parser.add_argument('--clusters', '-c', type=int, default=10,
-                       help='Number of clusters (default: 10)')
+    parser.add_argument('--clusters', '-c', type=cluster_count_arg, default=10,
+                       help="Number of clusters, or 'auto' to pick k by silhouette score (default: 10)")
+    parser.add_argument('--k-max', type=int, default=10,
+                       help='Largest k tried by --clusters auto (default: 10)')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                       help='Processes used to evaluate k values for --clusters auto; the pool is only used for large inputs (default: min(4, CPUs))')
     parser.add_argument('--text-column', '-t', type=str, default=None,
                        help='Text column name (auto-detected if not specified)')
+    parser.add_argument('--reduction', '-r', choices=['auto', 'pca', 'svd'], default='auto',
+                       help=f'Dimensionality reduction: pca (dense), svd (sparse TruncatedSVD), '
+                            f'auto = svd above {SPARSE_REDUCTION_THRESHOLD} rows (default: auto)')
+    parser.add_argument('--streaming', action='store_true',
+                       help='Out-of-core mode: read the CSV in chunks (text column only), hashing vectorizer, '
+                            'incremental PCA and MiniBatchKMeans; memory is bounded by --chunk-size')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                       help='Rows per chunk in --streaming mode (default: 50000)')
+    parser.add_argument('--labels-output', type=str, default=None,
+                       help='CSV of row,cluster,x,y,z for every comment, written with --streaming or --compact '
+                            '(default: <output>.labels.csv)')
+    parser.add_argument('--plot-sample', type=int, default=20000,
+                       help='Points kept for the HTML plot in --streaming mode (default: 20000)')
+    parser.add_argument('--compact', action='store_true',
+                       help='Compact HTML: base64 float32 coordinates, truncated hover text, '
+                            'plus a sidecar labels CSV with every assignment')
+    parser.add_argument('--point-budget', type=int, default=None,
+                       help='With --compact, decimate each cluster proportionally so about this many points are plotted')
+    parser.add_argument('--hover-chars', type=int, default=80,
+                       help='With --compact, truncate hover text to this many characters (default: 80)')
     
     args = parser.parse_args()
     
+    if args.streaming:
+        run_streaming(args)
+        return
+    
     # Load CSV
     print(f"Loading CSV from {args.input}...")
     df = load_csv(args.input)
@@ -145,12 +496,18 @@ def main():
     print(f"Using text column: {text_column}")
     
     # Extract and clean comments
-    print("Cleaning text...")
-    comments = df[text_column].apply(clean_text).tolist()
-    comments = [c for c in comments if c]  # Remove empty comments
+    # Exports from the dashboard DB already carry clean_text output in `normalized_text`
+    if 'normalized_text' in df.columns and args.text_column is None:
+        print("Using precomputed normalized_text column")
+        comments = df['normalized_text'].fillna('').astype(str).tolist()
+    else:
+        print("Cleaning text...")
+        comments = df[text_column].apply(clean_text).tolist()
+    rows = np.array([i for i, c in enumerate(comments) if c], dtype=np.int64)  # CSV data row of each kept comment
+    comments = [comments[i] for i in rows]  # Remove empty comments
     print(f"Processed {len(comments)} non-empty comments")
     
-    if len(comments) < args.clusters:
+    if args.clusters != 'auto' and len(comments) < args.clusters:
         print(f"Warning: Number of comments ({len(comments)}) is less than number of clusters ({args.clusters})")
         args.clusters = max(2, len(comments) // 2)
         print(f"Adjusting clusters to {args.clusters}")
@@ -161,19 +518,27 @@ def main():
     print(f"Vector shape: {vectors.shape}")
     
     # Reduce to 3D
-    print("Reducing to 3 dimensions with PCA...")
-    vectors_3d, pca = reduce_to_3d(vectors)
-    print(f"Explained variance ratio: {pca.explained_variance_ratio_.sum():.3f}")
+    print(f"Reducing to 3 dimensions ({args.reduction})...")
+    vectors_3d, reducer = reduce_to_3d(vectors, method=args.reduction)
+    print(f"Explained variance ratio ({type(reducer).__name__}): {reducer.explained_variance_ratio_.sum():.3f}")
     
     # Cluster
-    print(f"Clustering into {args.clusters} clusters...")
-    cluster_labels, kmeans = cluster_comments(vectors_3d, n_clusters=args.clusters)
+    n_clusters = args.clusters
+    if n_clusters == 'auto':
+        print(f"Selecting the number of clusters (workers: {args.workers})...")
+        n_clusters = select_n_clusters(vectors_3d, args.k_max, args.workers)
+    print(f"Clustering into {n_clusters} clusters...")
+    cluster_labels, kmeans = cluster_comments(vectors_3d, n_clusters=n_clusters)
     print(f"Cluster distribution: {np.bincount(cluster_labels)}")
     
     # Visualize
     print(f"Creating visualization...")
-    create_3d_visualization(vectors_3d, cluster_labels, comments, args.output)
-    print(f"Visualization saved to {args.output}")
+    visualize(args, vectors_3d, cluster_labels, comments)
+    if args.compact:
+        labels_path = args.labels_output or str(Path(args.output).with_suffix('.labels.csv'))
+        with open(labels_path, 'w', encoding='utf-8') as out:
+            write_labels(out, rows, cluster_labels, vectors_3d, header=True)
+        print(f"Labels saved to {labels_path}")
 
 
 if __name__ == '__main__':